@@ -0,0 +1,14 @@
+# Library interface, see treesorter.api. Names are loaded on first use, so that importing the
+# package does not import the parser, numpy or pyarrow.
+__all__ = ["parse_tree", "parse_trees", "compile_criteria", "evaluate", "evaluate_many", "FlatTree", "Options",
+           "SubtreeMemo"]
+
+
+def __getattr__(name):
+    if name in ("FlatTree", "Options", "SubtreeMemo"):
+        from treesorter import treesorter
+        return getattr(treesorter, name)
+    if name in __all__:
+        from treesorter import api
+        return getattr(api, name)
+    raise AttributeError(f"module 'treesorter' has no attribute {name!r}")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Library interface working on in-memory data. Errors are raised as ValueError instead of
+# exiting, results are the dictionaries the command line writes as rows:
+# {'file': name, 'taxon': seed taxon, 'size': subtree size, 'crits': {criterion: (bootstrap, r_t, a_t) or None}}
+from math import isnan
+from numbers import Real
+
+from treesorter.treesorter import Critter, FlatTree, Input, Options, SubtreeMemo
+
+# choices of the --search and --engine flags
+searches = ('pruned', 'exhaustive')
+engines = ('python', 'numpy')
+
+
+def parse_tree(data):
+    # first tree of newick or nexus data given as str or bytes
+    for tree in parse_trees(data):
+        return tree
+    raise ValueError("No newick tree found in data")
+
+
+def parse_trees(data):
+    # every tree of newick or nexus data given as str or bytes, trees are parsed one at a time
+    if isinstance(data, str):
+        data = data.encode()
+    for newick, translate in Input.iter_trees("", data):
+        yield FlatTree(newick, translate)
+
+
+def compile_criteria(criteria):
+    # criteria in the command line format, e.g. ["some_dinos=0.333+Dinos*", "ufboot@2=4+Karo*"]
+    if isinstance(criteria, str):
+        criteria = [criteria]
+    if not isinstance(criteria, (list, tuple)) or not criteria:
+        raise ValueError(f"Criteria have to be a non-empty list of strings, not {criteria!r}")
+    for crit in criteria:
+        if not isinstance(crit, str):
+            raise ValueError(f"Criterion {crit!r} is not a string")
+        if '=' not in crit:
+            raise ValueError(f"Criterion {crit} is not in the format NAME=DEFINITIONS")
+    try:
+        return Critter.build_criteria_tree(criteria)
+    except IndexError as e:
+        raise ValueError(f"Wrong criteria: {e}")
+
+
+def evaluate(tree, criteria, seed=None, tolerance=0.0, mintaxons=3, nested=False, name='', search='pruned',
+             engine='python', memo=None):
+    # Results of one tree, one per seed taxon. Tree is parsed from str or bytes when it is not a
+    # FlatTree already, criteria are compiled when they are not. Seed is a taxon name, a list of
+    # them or None to look at all clades. Mintaxons is the smallest subtree size that is evaluated,
+    # the command line sets it to -m + 1.
+    check_options(tolerance, mintaxons, nested, name, search, engine, memo)
+    if not isinstance(tree, (FlatTree, str, bytes)):
+        raise ValueError(f"Tree has to be a FlatTree, str or bytes, not {type(tree).__name__}")
+    if not isinstance(tree, FlatTree):
+        tree = parse_tree(tree)
+    crit_tree = criteria if isinstance(criteria, dict) else compile_criteria(criteria)
+    seeds = [seed] if seed is None or isinstance(seed, str) else seed
+    if not isinstance(seeds, (list, tuple)) or not all(s is None or isinstance(s, str) for s in seeds):
+        raise ValueError(f"Seed has to be a taxon name, a list of them or None, not {seed!r}")
+    if nested and None in seeds:
+        raise ValueError("Nested evaluation requires a seed taxon")
+    if engine == 'numpy':
+        try:
+            import numpy
+        except ImportError:
+            raise ValueError("Engine numpy requires the numpy package (pip install numpy)")
+    options = Options(tolerance, mintaxons, nested, search=search, engine=engine, memo=memo)
+    return Critter.sort_tree_seeds(tree, seeds, crit_tree, name, options)
+
+
+def check_options(tolerance, mintaxons, nested, name, search, engine, memo):
+    # arguments of evaluate() with the types and ranges the command line allows
+    if isinstance(tolerance, bool) or not isinstance(tolerance, Real) or isnan(tolerance) or tolerance < 0:
+        raise ValueError(f"Tolerance has to be a number from 0 up, not {tolerance!r}")
+    if isinstance(mintaxons, bool) or not isinstance(mintaxons, int) or mintaxons < 1:
+        raise ValueError(f"Mintaxons has to be an integer from 1 up, not {mintaxons!r}")
+    if not isinstance(nested, bool):
+        raise ValueError(f"Nested has to be True or False, not {nested!r}")
+    if not isinstance(name, str):
+        raise ValueError(f"Name has to be a string, not {name!r}")
+    if search not in searches:
+        raise ValueError(f"Search has to be one of {', '.join(searches)}, not {search!r}")
+    if engine not in engines:
+        raise ValueError(f"Engine has to be one of {', '.join(engines)}, not {engine!r}")
+    if memo is not None and not isinstance(memo, SubtreeMemo):
+        raise ValueError(f"Memo has to be a SubtreeMemo or None, not {type(memo).__name__}")
+
+
+def evaluate_many(trees, criteria, seed=None, **kwargs):
+    # evaluate() for every tree of an iterable, criteria are compiled only once
+    # yields (index, results) as trees come
+    crit_tree = criteria if isinstance(criteria, dict) else compile_criteria(criteria)
+    for i, tree in enumerate(trees):
+        yield i, evaluate(tree, crit_tree, seed, **kwargs)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+from argparse import ArgumentParser
+from glob import glob
+from json import dump, load
+from os.path import join
+from platform import python_version
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter, strftime
+
+from treesorter.output import CSVOutput
+from treesorter.treesorter import PTree, FlatTree, Input, Critter, Options
+
+default_prefixes = ["Alpha-", "Beta-", "Gamma-", "Delta-"]
+default_criteria = ["alpha=0.5+Alpha-*", "mixed=1+(Beta-*,Gamma-*),Delta-*"]
+shapes = ["balanced", "caterpillar", "realistic"]
+
+
+def leaf_names(leaves, prefixes):
+    # prefixes are given out in contiguous blocks of leaves, so clades share them and criteria match
+    return [f"{prefixes[i * len(prefixes) // leaves]}{i}" for i in range(leaves)]
+
+
+def generate_newick(shape, leaves, prefixes=None, seed=0, duplicates=0):
+    # deterministic unrooted newick with a root taxon and two subtrees, built without recursion
+    # ranges of leaves are split in the middle (balanced), one leaf off the end (caterpillar)
+    # or at random (realistic, which also swaps some leaves between prefix blocks)
+    # duplicates renames that many random leaves to the name of the second one, like paralogs
+    rng = Random(seed)
+    names = leaf_names(leaves, prefixes or default_prefixes)
+    if shape == "realistic":
+        for _ in range(leaves // 50):
+            a, b = rng.randrange(1, leaves), rng.randrange(1, leaves)
+            names[a], names[b] = names[b], names[a]
+    for _ in range(duplicates):
+        names[rng.randrange(2, leaves)] = names[1]
+
+    def split(lo, hi):
+        if shape == "balanced":
+            return (lo + hi) // 2
+        elif shape == "caterpillar":
+            return hi - 1
+        return lo + 1 + rng.randrange(hi - lo - 1)
+
+    out = ["(", f"{names[0]}:{rng.random():.4f}"]
+    k = split(1, leaves)
+    stack = [(k, leaves), ",", (1, k), ","]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+        lo, hi = item
+        if hi - lo == 1:
+            out.append(f"{names[lo]}:{rng.random():.4f}")
+            continue
+        k = split(lo, hi)
+        out.append("(")
+        stack += [f"){rng.randint(0, 100)}:{rng.random():.4f}", (k, hi), ",", (lo, k)]
+    out.append(");")
+    return "".join(out)
+
+
+def balanced_newick(leaves, prefix="Taxon-"):
+    return generate_newick("balanced", leaves, [prefix])
+
+
+def caterpillar_newick(leaves, prefix="Taxon-"):
+    return generate_newick("caterpillar", leaves, [prefix])
+
+
+def best_time(function, repeats):
+    # best time of repeated runs in seconds and result of the last run
+    best = None
+    result = None
+    for _ in range(repeats):
+        start = perf_counter()
+        result = function()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_case(path, criteria, options, repeats, out_dir):
+    # times of read -> parse -> criteria -> evaluate -> csv stages for one tree file
+    stages = {}
+    stages['read_tree_file'], data = best_time(lambda: Input.read_tree_file(path), repeats)
+    stages['parse_file'], _ = best_time(lambda: PTree().parse_file(data), repeats)
+    stages['flat_tree'], _ = best_time(lambda: FlatTree(*Input.read_first_tree(path)), repeats)
+    stages['build_criteria_tree'], crit_tree = best_time(lambda: Critter.build_criteria_tree(criteria), repeats)
+
+    tree = FlatTree(data)
+    seed = tree.leaf_names[1]
+
+    def sort_one():
+        # match matrix is built again on every run
+        tree.match_matrix = None
+        return Critter.sort_one_tree_file(tree, seed, crit_tree, path, options)
+
+    def sort_seeds():
+        tree.match_matrix = None
+        return Critter.sort_tree_seeds(tree, tree.leaf_names, crit_tree, path, options)
+
+    stages['sort_one_tree_file'], _ = best_time(sort_one, repeats)
+    stages['sort_tree_seeds'], results = best_time(sort_seeds, repeats)
+
+    def write_csv():
+        csv = CSVOutput(join(out_dir, "benchmark.csv"))
+        csv.write_headers(criteria)
+        for res in results:
+            csv.write_result(res)
+        csv.close_file()
+
+    stages['csv_output'], _ = best_time(write_csv, repeats)
+    return stages
+
+
+def verify_search(path, criteria, seeds, engines):
+    # every search mode and engine must give the results of exhaustive search in python, returns mismatches
+    crit_tree = Critter.build_criteria_tree(criteria)
+    mismatches = 0
+    for tolerance in [0, 0.1, 0.3, 2]:
+        for mintaxons in [2, 3, 6]:
+            for nested in [False, True]:
+                reference = Options(tolerance, mintaxons, nested, search='exhaustive')
+                modes = [Options(tolerance, mintaxons, nested, search=search, engine=engine)
+                         for search in ['pruned', 'exhaustive'] for engine in engines]
+                for seed in seeds if nested else seeds + [None]:
+                    expected = Critter.sort_one_tree_file(FlatTree(*Input.read_first_tree(path)), seed, crit_tree,
+                                                          path, reference)
+                    for options in modes:
+                        # fresh tree, so that no verdicts are shared between engines
+                        tree = FlatTree(*Input.read_first_tree(path))
+                        result = Critter.sort_one_tree_file(tree, seed, crit_tree, path, options)
+                        if not nested:
+                            result = [result, Critter.sort_tree_seeds(tree, [seed], crit_tree, path, options)[0]]
+                        for res in result if not nested else [result]:
+                            if res != expected:
+                                mismatches += 1
+                                print(f"MISMATCH {path} seed {seed} tolerance {tolerance} mintaxons {mintaxons} "
+                                      f"nested {nested} search {options.search} engine {options.engine}: "
+                                      f"{res} != {expected}")
+    return mismatches
+
+
+def compare(report, baseline, threshold, min_time):
+    # prints ratios to baseline, returns number of stages slower than threshold
+    # stages faster than min_time in both reports are too noisy to be counted
+    slower = 0
+    print(f"{'case':24s} {'stage':22s} {'baseline':>12s} {'current':>12s} {'ratio':>8s}")
+    for name, stages in report['cases'].items():
+        for stage, seconds in stages.items():
+            base = baseline['cases'].get(name, {}).get(stage)
+            if not base:
+                continue
+            ratio = seconds / base
+            flag = "SLOWER" if ratio > threshold and max(base, seconds) >= min_time else ""
+            slower += bool(flag)
+            print(f"{name:24s} {stage:22s} {base * 1000:9.2f} ms {seconds * 1000:9.2f} ms {ratio:8.2f} {flag}")
+    return slower
+
+
+def time_parser(method, data, repeats):
+    start = perf_counter()
+    try:
+        if method == 'flat':
+            seconds, _ = best_time(lambda: FlatTree(data), repeats)
+        else:
+            seconds, _ = best_time(lambda: getattr(PTree(), method)(data), repeats)
+    except RecursionError:
+        return f"recursion limit ({(perf_counter() - start) * 1000:.0f} ms)"
+    return f"{seconds * 1000:.2f} ms"
+
+
+def compare_parsers(directory, sizes, repeats):
+    # flat array, iterative and recursive newick parser on test trees and synthetic trees
+    cases = []
+    for path in sorted(glob(join(directory, '**', '*.tre'), recursive=True)):
+        cases.append((path, Input.read_tree_file(path)))
+    for size in sizes:
+        cases.append((f"balanced {size}", balanced_newick(size)))
+        cases.append((f"caterpillar {size}", caterpillar_newick(size)))
+
+    print(f"{'tree':60s} {'chars':>10s} {'flat':>16s} {'iterative':>16s} {'recursive':>16s}")
+    for name, data in cases:
+        print(f"{name[-60:]:60s} {len(data):10d} "
+              f"{time_parser('flat', data, repeats):>16s} "
+              f"{time_parser('parse_file', data, repeats):>16s} "
+              f"{time_parser('parse_file_recursive', data, repeats):>16s}", flush=True)
+
+
+def main():
+    parser = ArgumentParser(
+        prog='TreeSorter benchmark',
+        description="Times stages of the parse -> evaluate -> csv pipeline on deterministic synthetic trees \
+                    and compares them to a saved JSON report.")
+    parser.add_argument('--sizes', nargs='*', type=int, default=[100, 1000, 10000],
+                        help="Leaf counts of synthetic trees, at least 3")
+    parser.add_argument('--shapes', nargs='*', default=shapes, choices=shapes,
+                        help="Shapes of synthetic trees")
+    parser.add_argument('--prefixes', nargs='*', default=default_prefixes,
+                        help="Taxon name prefixes, given out in blocks of leaves")
+    parser.add_argument('-c', '--criteria', nargs='*', default=default_criteria,
+                        help="Criteria evaluated on synthetic trees, in the treesorter format")
+    parser.add_argument('-t', '--tolerance', default=0.1,
+                        help="Tolerance used in evaluation")
+    parser.add_argument('--search', choices=['pruned', 'exhaustive'], default='pruned',
+                        help="Search mode of sort_one_tree_file")
+    parser.add_argument('--engine', choices=['python', 'numpy'], default='python',
+                        help="Engine checking criteria on clades")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the random generator of realistic trees")
+    parser.add_argument('-r', '--repeats', type=int, default=3,
+                        help="Best of how many runs is reported")
+    parser.add_argument('-o', '--output',
+                        help="Save JSON report to this path")
+    parser.add_argument('-b', '--baseline',
+                        help="Compare to this JSON report and exit with 1 if any stage is slower")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="Ratio to baseline above which a stage is reported slower")
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help="Stages under this many milliseconds are never reported slower")
+    parser.add_argument('--verify', action='store_true',
+                        help="Only check that search modes and engines give equal results on synthetic trees, \
+                        exits with 1 on any difference")
+    parser.add_argument('--parsers', action='store_true',
+                        help="Only compare newick parsers on test trees and synthetic trees")
+    parser.add_argument('-d', '--directory', default='tests',
+                        help="Directory searched recursively for tree files in --parsers mode")
+    args = parser.parse_args()
+
+    if min(args.sizes, default=3) < 3:
+        exit("Synthetic trees need at least 3 leaves")
+
+    if args.parsers:
+        compare_parsers(args.directory, args.sizes, args.repeats)
+        return
+
+    if args.verify:
+        engines = ['python']
+        try:
+            import numpy
+            engines.append('numpy')
+        except ImportError:
+            print("numpy is not installed, only the python engine is verified")
+        mismatches = 0
+        with TemporaryDirectory() as out_dir:
+            for shape in args.shapes:
+                for size in args.sizes:
+                    path = join(out_dir, f"{shape}-{size}.tre")
+                    with open(path, 'w') as f:
+                        f.write(generate_newick(shape, size, args.prefixes, args.seed))
+                    seeds = [leaf_names(size, args.prefixes)[i] for i in Random(args.seed).sample(range(size), 5)]
+                    mismatches += verify_search(path, args.criteria, seeds, engines)
+                # seed name with several copies in the smallest tree
+                size = min(args.sizes)
+                path = join(out_dir, f"{shape}-{size}-duplicates.tre")
+                with open(path, 'w') as f:
+                    f.write(generate_newick(shape, size, args.prefixes, args.seed, duplicates=3))
+                mismatches += verify_search(path, args.criteria, [FlatTree(*Input.read_first_tree(path)).leaf_names[1]],
+                                            engines)
+        print(f"{mismatches} mismatches")
+        if mismatches:
+            exit(1)
+        return
+
+    options = Options(args.tolerance, search=args.search, engine=args.engine)
+    report = {"created": strftime("%Y-%m-%dT%H:%M:%S"), "python": python_version(), "repeats": args.repeats,
+              "seed": args.seed, "criteria": args.criteria, "search": args.search, "engine": args.engine,
+              "cases": {}}
+    with TemporaryDirectory() as out_dir:
+        for shape in args.shapes:
+            for size in args.sizes:
+                name = f"{shape}-{size}"
+                path = join(out_dir, f"{name}.tre")
+                with open(path, 'w') as f:
+                    f.write(generate_newick(shape, size, args.prefixes, args.seed))
+                stages = run_case(path, args.criteria, options, args.repeats, out_dir)
+                report['cases'][name] = stages
+                print(f"{name:24s} " + " ".join(f"{stage} {seconds * 1000:.2f} ms" for stage, seconds in stages.items()),
+                      flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = load(f)
+        if compare(report, baseline, args.threshold, args.min_time / 1000):
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
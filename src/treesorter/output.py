@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# Writers of result rows to CSV, JSON Lines and, with pyarrow, Parquet and Arrow files
+from json import dumps as json_dumps
+
+from treesorter.treesorter import Settings
+
+
+class CSVOutput:
+    def __init__(self, out_path, file_object=None):
+        self.out_path = out_path
+        self.rows_written = 0
+        self.ordered_crits = []
+        self.sweep = False
+        # rows waiting to be written, flushed every Settings.output_batch_rows rows
+        self.buffer = []
+        try:
+            self.file_object = file_object or open(out_path, 'w')
+        except OSError as e:
+            exit(f"Wrong output path: {e}")
+
+    def close_file(self):
+        self.flush()
+        self.file_object.close()
+
+    def flush(self):
+        self.file_object.write("".join(self.buffer))
+        self.buffer = []
+
+    def write_result(self, result: dict):
+        if self.sweep:
+            for row in self.long_rows(result):
+                self.write_row(self.csv_row_from_list(row))
+        else:
+            self.write_row(self.csv_row_from_list(self.list_from_result_dict(result)))
+
+    @staticmethod
+    def long_rows(result: dict):
+        # one row per criterion of a --sweep result, criteria differ between configurations
+        head = [result['config'], result['file'], result['taxon'], result['size']]
+        return [head + [column] + (list(crit) if crit else ['', '', '']) for column, crit in result['crits'].items()]
+
+    def list_from_result_dict(self, result: dict):
+        build_list = [result['file'], result['taxon'], result['size']]
+        for key in self.ordered_crits:
+            if result['crits'][key]:
+                build_list += [result['crits'][key][0],
+                               result['crits'][key][1],
+                               result['crits'][key][2]]
+            else:
+                build_list += ['', '', '']
+            pass
+        return build_list
+
+    def csv_row_from_list(self, items: list):
+        # every field quoted, quotes inside fields doubled
+        row = ",".join(['"' + str(item).replace('"', '""') + '"' for item in items])
+        return "\n" + row if self.rows_written > 0 else row
+
+    def write_row(self, s: str):
+        self.buffer.append(s)
+        self.rows_written += 1
+        if len(self.buffer) >= Settings.output_batch_rows:
+            self.flush()
+
+    def write_headers(self, crit_list: list, support=False, sweep=False):
+        if self.rows_written == 0:
+            if support:
+                # aggregated over all trees of a file
+                items = ["filename", "seed_taxon", "total_trees"]
+                crit_columns = ["valid_trees", "mean_bs"]
+            else:
+                items = ["filename", "seed_taxon", "total_taxons"]
+                crit_columns = ["tu_R", "tu_A"]
+            if sweep:
+                # long format tagged with the configuration
+                self.sweep = True
+                items = ["config"] + items + ["criterion", "valid_fraction" if support else "bootstrap"]
+                self.write_row(self.csv_row_from_list(items + crit_columns))
+                return
+            crit_items = []
+            for item in crit_list:
+                crit_items += [item] + crit_columns
+                self.ordered_crits += [item[:item.find("=")]]
+            items += crit_items
+            self.write_row(self.csv_row_from_list(items))
+        else:
+            exit("Headers already written")
+
+
+class RecordOutput:
+    # Results as flat records for analysis tools: file name, seed taxon, size and three fields for
+    # every criterion, named by the criterion and the same as the CSV columns. Missing values are
+    # None. Subclasses write the records.
+    def __init__(self, out_path):
+        self.out_path = out_path
+        self.rows_written = 0
+        self.ordered_crits = []
+        self.fields = []
+        self.buffer = []
+        self.sweep = False
+
+    def write_headers(self, crit_list: list, support=False, sweep=False):
+        if self.fields:
+            exit("Headers already written")
+        if support:
+            self.fields = ["filename", "seed_taxon", "total_trees"]
+            crit_columns = ["", "_valid_trees", "_mean_bs"]
+        else:
+            self.fields = ["filename", "seed_taxon", "total_taxons"]
+            crit_columns = ["", "_tu_R", "_tu_A"]
+        self.support = support
+        if sweep:
+            # long format tagged with the configuration, the same columns as in CSV
+            self.sweep = True
+            self.fields = (["config"] + self.fields + ["criterion", "valid_fraction" if support else "bootstrap"]
+                           + [suffix[1:] for suffix in crit_columns[1:]])
+            return
+        for item in crit_list:
+            column = item[:item.find("=")]
+            self.ordered_crits.append(column)
+            self.fields += [column + suffix for suffix in crit_columns]
+
+    def record_from_result(self, result: dict):
+        values = [result['file'], result['taxon'], None if result['size'] == '' else result['size']]
+        for key in self.ordered_crits:
+            crit = result['crits'][key]
+            values += [None if value == '' else value for value in crit] if crit else [None, None, None]
+        return dict(zip(self.fields, values))
+
+    def write_result(self, result: dict):
+        if self.sweep:
+            for row in CSVOutput.long_rows(result):
+                self.buffer.append(dict(zip(self.fields, [None if value == '' else value for value in row])))
+        else:
+            self.buffer.append(self.record_from_result(result))
+        self.rows_written += 1
+        if len(self.buffer) >= Settings.output_batch_rows:
+            self.flush()
+
+    def close_file(self):
+        self.flush()
+
+
+class JSONLinesOutput(RecordOutput):
+    def __init__(self, out_path, file_object=None):
+        super().__init__(out_path)
+        try:
+            self.file_object = file_object or open(out_path, 'w')
+        except OSError as e:
+            exit(f"Wrong output path: {e}")
+
+    def flush(self):
+        self.file_object.write("".join(json_dumps(record) + "\n" for record in self.buffer))
+        self.buffer = []
+
+    def close_file(self):
+        self.flush()
+        self.file_object.close()
+
+
+class ArrowOutput(RecordOutput):
+    # parquet file or arrow IPC file written in record batches, needs the pyarrow package
+    def __init__(self, out_path, output_format='parquet'):
+        super().__init__(out_path)
+        try:
+            import pyarrow
+        except ImportError:
+            exit(f"Output format {output_format} requires the pyarrow package (pip install pyarrow)")
+        self.pa = pyarrow
+        self.output_format = output_format
+        self.writer = None
+
+    def schema(self):
+        pa = self.pa
+        if self.support:
+            crit_types = [pa.float64(), pa.int64(), pa.float64()]
+        else:
+            # support values can be decimal, e.g. posteriors
+            crit_types = [pa.float64(), pa.float64(), pa.int64()]
+        if self.sweep:
+            types = [pa.string(), pa.string(), pa.string(), pa.int64(), pa.string()] + crit_types
+        else:
+            types = [pa.string(), pa.string(), pa.int64()] + crit_types * len(self.ordered_crits)
+        return pa.schema(list(zip(self.fields, types)))
+
+    def flush(self):
+        if self.writer is None:
+            self.arrow_schema = self.schema()
+            try:
+                if self.output_format == 'parquet':
+                    import pyarrow.parquet
+                    self.writer = pyarrow.parquet.ParquetWriter(self.out_path, self.arrow_schema)
+                else:
+                    import pyarrow.ipc
+                    self.writer = pyarrow.ipc.new_file(self.out_path, self.arrow_schema)
+            except OSError as e:
+                exit(f"Wrong output path: {e}")
+        if self.buffer:
+            self.writer.write_table(self.pa.Table.from_pylist(self.buffer, schema=self.arrow_schema))
+        self.buffer = []
+
+    def close_file(self):
+        self.flush()
+        self.writer.close()
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+# What runs keep on disk: the cache of parsed trees and results, the manifest of --incremental,
+# the taxon name index of --index and the shard checkpoints of --shards
+from os.path import isfile, basename, join, dirname
+from os import makedirs, replace, remove, utime, walk, lstat, stat, getpid
+from re import compile as re_compile
+from hashlib import blake2b
+from pickle import dumps as pickle_dumps, loads as pickle_loads, HIGHEST_PROTOCOL, UnpicklingError
+from json import dump as json_dump, dumps as json_dumps, load as json_load, loads as json_loads
+
+from treesorter.treesorter import Batch, Critter, Settings
+
+
+class Cache:
+    # Opt-in on-disk cache. Parsed trees and taxon names for --index are stored under the hash
+    # of file content. Best clades of each criterion for every seed taxon are stored under the
+    # hash of content, that criterion and options, so a run with criteria added or removed
+    # evaluates only the new ones. Rows are put together from them with the carry over between
+    # criteria. Results of --all-trees, --stream and --sweep are stored whole under the hash of
+    # content, all criteria and options. Least recently used entries are removed when the cache
+    # grows over its size limit.
+    version = 3
+    kinds = ('trees', 'names', 'bests', 'results')
+
+    def __init__(self, directory, max_megabytes=None):
+        self.directory = directory
+        self.max_bytes = int((max_megabytes or Settings.default_cache_size) * 1024 * 1024)
+
+    @staticmethod
+    def file_key(path, content=None):
+        digest = blake2b(f"{Cache.version}".encode(), digest_size=16)
+        if content is not None:
+            digest.update(content)
+            return digest.hexdigest()
+        with open(path, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def results_key(file_key, file, crit_tree, options):
+        signature = (file_key, file[1], Critter.criteria_signature(crit_tree), options.signature())
+        return blake2b(repr(signature).encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def bests_key(file_key, file, column, criterium, options):
+        # the name of a criterion matters only by the support value it ranks by
+        groups = [(group[0], [p.source for p in group[1]]) for group in criterium]
+        signature = (file_key, file[1], Critter.support_index(column), groups, options.signature())
+        return blake2b(repr(signature).encode(), digest_size=16).hexdigest()
+
+    def path(self, kind, key):
+        return join(self.directory, kind, key[:2], key)
+
+    def load(self, kind, key):
+        path = self.path(kind, key)
+        try:
+            with open(path, 'rb') as f:
+                data = pickle_loads(f.read())
+        except (OSError, EOFError, UnpicklingError):
+            return None
+        try:
+            # last use for eviction
+            utime(path)
+        except OSError:
+            pass
+        return data
+
+    def store(self, kind, key, data):
+        path = self.path(kind, key)
+        makedirs(dirname(path), exist_ok=True)
+        # written under temporary name, parallel workers never see half written entries
+        temp_path = f"{path}.{getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(pickle_dumps(data, protocol=HIGHEST_PROTOCOL))
+        replace(temp_path, path)
+
+    def entries(self):
+        found = []
+        for kind in Cache.kinds:
+            for root, dirs, names in walk(join(self.directory, kind)):
+                for name in names:
+                    path = join(root, name)
+                    try:
+                        st = lstat(path)
+                    except OSError:
+                        continue
+                    found.append((st.st_mtime, st.st_size, path))
+        return found
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(_[1] for _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            try:
+                remove(path)
+            except OSError:
+                pass
+
+
+class Manifest:
+    # Inputs behind an output file, kept next to it for --incremental runs: path, seed taxon, size,
+    # mtime and content hash of every file with its results, under a signature of criteria and
+    # options. Files that did not change are not evaluated again, their stored results are written.
+    version = 1
+
+    def __init__(self, output_file, signature):
+        self.path = output_file + ".manifest"
+        self.signature = repr((Manifest.version, signature))
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                data = json_load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('signature') == self.signature:
+            self.entries = {(entry['path'], entry['seed']): entry for entry in data['files']}
+        elif Settings.verbose:
+            print(f"Criteria or options changed since {self.path} was written, evaluating all files")
+
+    def stored_results(self, file):
+        # results of unchanged file, None if the file is new or changed
+        entry = self.entries.get((file[0], file[1]))
+        if entry is None:
+            return None
+        try:
+            st = stat(file[0])
+        except OSError:
+            return None
+        if (st.st_mtime_ns, st.st_size) != (entry['mtime_ns'], entry['size']):
+            if st.st_size != entry['size'] or Cache.file_key(file[0]) != entry['hash']:
+                return None
+            # touched but not modified
+            entry['mtime_ns'] = st.st_mtime_ns
+        return entry['results']
+
+    def record(self, file, st, digest, results):
+        # state of the file is taken before it is evaluated, later changes are seen by the next run,
+        # digest is the hash of the content that was evaluated
+        self.entries[(file[0], file[1])] = {'path': file[0], 'seed': file[1], 'size': st.st_size,
+                                            'mtime_ns': st.st_mtime_ns, 'hash': digest, 'results': results}
+
+    def merge(self, numbered_files, evaluate, ordered=True):
+        # (index, file, results, profile, names, digest) for all files, evaluate gets numbered files
+        # that are new or changed and yields the same tuples with digest of the evaluated content
+        # (Options.hash_files). Files no longer listed are dropped.
+        stored = {}
+        pending = []
+        before = {}
+        for i, file in numbered_files:
+            results = self.stored_results(file)
+            if results is None:
+                before[i] = stat(file[0])
+                pending.append((i, file))
+            else:
+                stored[i] = (i, file, results, None, None, None)
+        if Settings.verbose:
+            print(f"{len(pending)} new or changed files, {len(stored)} unchanged files")
+        listed = {(file[0], file[1]) for i, file in numbered_files}
+        self.entries = {key: entry for key, entry in self.entries.items() if key in listed}
+
+        def recorded(evaluated):
+            for item in evaluated:
+                self.record(item[1], before[item[0]], item[5], item[2])
+                yield item
+
+        return Batch.interleave(stored, recorded(evaluate(pending)), ordered)
+
+    def save(self):
+        # written under temporary name and renamed, an interrupted run leaves the old manifest
+        temp_path = f"{self.path}.{getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json_dump({'signature': self.signature,
+                       'files': [entry for entry in self.entries.values() if entry['results'] is not None]}, f)
+        replace(temp_path, self.path)
+
+
+class CorpusIndex:
+    # Taxon names of evaluated files, kept on disk with --index. Inverted from name and from name
+    # prefix tokens (Dinos-, Dinos-Kareniaceae-) to files and leaf ids, so seed taxons and criteria
+    # are checked before a file is parsed. Files without a matching seed taxon, or where no criterion
+    # has enough matching taxons, get their rows without being parsed. Entries of new and changed
+    # files are taken from trees parsed for evaluation.
+    version = 1
+    token_re = re_compile(r"[-_|.]")
+
+    def __init__(self, path):
+        self.path = path
+        # path: (mtime_ns, size, names in leaf order)
+        self.files = {}
+        # name: {path: [leaf ids]}
+        self.postings = {}
+        # prefix token: names starting with it
+        self.tokens = {}
+        self.changed = False
+        self.matches = {}
+        try:
+            with open(path, 'rb') as f:
+                version, self.files, self.postings, self.tokens = pickle_loads(f.read())
+            if version != CorpusIndex.version:
+                raise ValueError(version)
+        except (OSError, EOFError, UnpicklingError, ValueError, TypeError):
+            self.files, self.postings, self.tokens = {}, {}, {}
+
+    def fresh_names(self, path):
+        # names of the file if its entry is up to date, None otherwise
+        entry = self.files.get(path)
+        if entry is None:
+            return None
+        try:
+            st = stat(path)
+        except OSError:
+            return None
+        return entry[2] if (st.st_mtime_ns, st.st_size) == entry[:2] else None
+
+    def add(self, path, st, names):
+        self.remove(path)
+        self.files[path] = (st.st_mtime_ns, st.st_size, tuple(names))
+        for leaf, name in enumerate(names):
+            self.postings.setdefault(name, {}).setdefault(path, []).append(leaf)
+            for m in CorpusIndex.token_re.finditer(name):
+                self.tokens.setdefault(name[:m.end()], set()).add(name)
+        self.changed = True
+
+    def remove(self, path):
+        entry = self.files.pop(path, None)
+        if entry is None:
+            return
+        for name in set(entry[2]):
+            files = self.postings[name]
+            del files[path]
+            if not files:
+                del self.postings[name]
+                for m in CorpusIndex.token_re.finditer(name):
+                    token = name[:m.end()]
+                    self.tokens[token].discard(name)
+                    if not self.tokens[token]:
+                        del self.tokens[token]
+        self.changed = True
+
+    def names_matching(self, pattern):
+        # all indexed names matching a Critter.Pattern, glob patterns are narrowed by prefix tokens
+        if pattern.source not in self.matches:
+            candidates = self.postings
+            if pattern.parts and len(pattern.parts) == 1:
+                candidates = [pattern.source] if pattern.source in self.postings else []
+            elif pattern.parts:
+                for m in CorpusIndex.token_re.finditer(pattern.parts[0]):
+                    # every name starting with the literal start of the pattern has its tokens
+                    candidates = self.tokens.get(pattern.parts[0][:m.end()], ())
+                    if not candidates:
+                        break
+            self.matches[pattern.source] = {name for name in candidates if pattern.match(name)}
+        return self.matches[pattern.source]
+
+    def file_counts(self, patterns):
+        # number of leaves matching any of patterns in every file
+        names = set().union(*(self.names_matching(pattern) for pattern in patterns))
+        counts = {}
+        for name in names:
+            for path, leaves in self.postings[name].items():
+                counts[path] = counts.get(path, 0) + len(leaves)
+        return counts
+
+    def impossible_columns(self, crit_tree, options):
+        # per criterion, files without enough matching taxons in the whole tree for any valid clade
+        impossible = {}
+        for column, criterium in crit_tree.items():
+            checks = []
+            for q, patterns in criterium:
+                if q > 0:
+                    # relative minimum needs one taxon, absolute minimum q needs more than q
+                    checks.append((self.file_counts(patterns), 1 if q < 1 else int(q) + 1))
+            if options.tolerance < 1.0 or options.mintaxons > options.tolerance:
+                # at least one taxon has to pass some group to keep tolerance used under the limit
+                checks.append((self.file_counts([p for group in criterium for p in group[1]]), 1))
+            impossible[column] = checks
+        return impossible
+
+    def skipped_results(self, file, names, checks, options):
+        # rows of a file that can't give a valid clade, None if the file has to be evaluated
+        path = file[0]
+        if options.seed_pattern:
+            seed_names = self.names_matching(options.seed_pattern)
+            seeds = [name for name in names if name in seed_names]
+        elif not options.no_seed:
+            seeds = [file[1]]
+        else:
+            seeds = [None]
+        if seeds:
+            for column_checks in checks.values():
+                if all(counts.get(path, 0) >= needed for counts, needed in column_checks):
+                    return None
+        return [{'file': basename(path), 'taxon': seed, 'size': '', 'crits': {column: None for column in checks}}
+                for seed in seeds]
+
+    def evaluator(self, evaluate, crit_tree, options, ordered=True):
+        # evaluate wrapped to skip files that can't match and to index files it parses
+        checks = self.impossible_columns(crit_tree, options)
+
+        def filtered(numbered_files):
+            skipped = {}
+            pending = []
+            before = {}
+            for i, file in numbered_files:
+                names = self.fresh_names(file[0])
+                results = None if names is None else self.skipped_results(file, names, checks, options)
+                if results is None:
+                    pending.append((i, file))
+                    if names is None:
+                        # state before parsing, a later change is seen by the next run
+                        before[file[0]] = stat(file[0])
+                else:
+                    skipped[i] = (i, file, results, None, None, None)
+            if Settings.verbose:
+                print(f"{len(skipped)} files skipped by index, {len(pending)} files evaluated")
+
+            def indexed(evaluated):
+                for item in evaluated:
+                    path = item[1][0]
+                    if item[4] is not None and path in before:
+                        self.add(path, before[path], item[4])
+                    yield item
+
+            return Batch.interleave(skipped, indexed(evaluate(pending)), ordered)
+
+        return filtered
+
+    def prune(self):
+        # entries of files that no longer exist
+        for path in [path for path in self.files if not isfile(path)]:
+            self.remove(path)
+
+    def save(self):
+        self.prune()
+        if not self.changed:
+            return
+        temp_path = f"{self.path}.{getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(pickle_dumps((CorpusIndex.version, self.files, self.postings, self.tokens),
+                                 protocol=HIGHEST_PROTOCOL))
+        replace(temp_path, self.path)
+
+
+class Shards:
+    # --shards: files are split into N shards by a hash of path and seed taxon, so every host
+    # sharing the filesystem computes the same split. Each shard appends results of evaluated files
+    # to its own checkpoint next to the output, one JSON line per file after a signature line, so
+    # a restarted shard skips files it finished. Merging reads all checkpoints and gives results
+    # in the order of the file list.
+    version = 1
+
+    def __init__(self, output_file, count, signature):
+        self.output_file = output_file
+        self.count = count
+        self.signature = repr((Shards.version, signature))
+
+    def path(self, shard):
+        return f"{self.output_file}.shard-{shard}-of-{self.count}"
+
+    def shard_of(self, file):
+        digest = blake2b(f"{file[0]}\0{file[1]}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') % self.count
+
+    @staticmethod
+    def file_state(file):
+        # size and mtime, a file changed since its checkpoint is evaluated again
+        try:
+            st = stat(file[0])
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def read(self, shard):
+        # ({(path, seed): record} and byte length of complete lines) of a checkpoint written under
+        # the current signature, a line cut off by an interrupted run is left out
+        try:
+            with open(self.path(shard), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return {}, 0
+        length = data.rfind(b'\n') + 1
+        lines = data[:length].splitlines()
+        try:
+            if not lines or json_loads(lines[0]).get('signature') != self.signature:
+                if lines and Settings.verbose:
+                    print(f"Criteria or options changed since {self.path(shard)} was written, evaluating again")
+                return {}, 0
+            records = [json_loads(line) for line in lines[1:]]
+        except ValueError:
+            exit(f"Checkpoint {self.path(shard)} is damaged, remove it to evaluate the shard again")
+        # later records of a file replace earlier ones
+        return {(record['path'], record['seed']): record for record in records}, length
+
+    def run(self, shard, numbered_files, evaluate):
+        # evaluates files of the shard without a checkpoint, returns their number
+        done, length = self.read(shard)
+        states = {}
+        for i, file in numbered_files:
+            if self.shard_of(file) == shard:
+                record = done.get((file[0], file[1]))
+                state = self.file_state(file)
+                if record is None or record['state'] != state:
+                    states[i] = state
+        pending = [(i, file) for i, file in numbered_files if i in states]
+        if Settings.verbose:
+            print(f"Shard {shard} of {self.count}: {len(pending)} files to evaluate")
+        try:
+            with open(self.path(shard), 'r+b' if length else 'wb') as f:
+                f.truncate(length)
+                f.seek(length)
+                if not length:
+                    f.write(json_dumps({'signature': self.signature}).encode() + b'\n')
+                for i, file, results, profile, names, digest in evaluate(pending):
+                    record = {'path': file[0], 'seed': file[1], 'state': states[i], 'results': results}
+                    f.write(json_dumps(record).encode() + b'\n')
+                    # every finished file survives an interrupted run
+                    f.flush()
+        except OSError as e:
+            exit(f"Wrong checkpoint path: {e}")
+        return len(pending)
+
+    @staticmethod
+    def work(shards, shard, numbered_files, crit_tree, options):
+        return shards.run(shard, numbered_files, lambda pending: (Critter.evaluate_numbered(numbered, crit_tree,
+                                                                                            options)
+                                                                  for numbered in pending))
+
+    def run_local(self, numbered_files, crit_tree, options):
+        from multiprocessing import Pool
+        with Pool(self.count) as pool:
+            evaluated = pool.starmap(Shards.work, [(self, shard, numbered_files, crit_tree, options)
+                                                   for shard in range(self.count)])
+        if Settings.verbose:
+            print(f"{sum(evaluated)} files evaluated in {self.count} shards")
+
+    def merged(self, numbered_files):
+        # (index, file, results, None, None, None) of all files in list order from all checkpoints,
+        # exits when some file has no current results yet
+        done = {}
+        for shard in range(self.count):
+            done.update(self.read(shard)[0])
+        merged = []
+        missing = 0
+        for i, file in numbered_files:
+            record = done.get((file[0], file[1]))
+            if record is None or record['state'] != self.file_state(file):
+                missing += 1
+                if Settings.verbose:
+                    print(f"No results of {file[0]} in shard {self.shard_of(file)}")
+                continue
+            merged.append((i, file, record['results'], None, None, None))
+        if missing:
+            exit(f"EXIT: {missing} files have no results in shard checkpoints, run their shards with --shard first")
+        return merged
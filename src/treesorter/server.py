@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# Query server of --serve, answering criteria sent over HTTP from trees kept in memory
+from os.path import isfile, basename, exists
+from os import remove, stat
+from time import sleep
+from json import loads as json_loads
+from collections import OrderedDict
+from threading import Lock, Thread
+from io import StringIO
+from copy import copy
+
+from treesorter.output import CSVOutput, JSONLinesOutput
+from treesorter.treesorter import Critter, FlatTree, Input, Options, Settings
+
+
+class Server:
+    # Local query server started with --serve. Trees of the listed files are parsed once and kept in
+    # memory, least recently used ones are dropped over the memory limit and changed files are
+    # reloaded. Queries carry criteria and options and are answered in the CSV output schema.
+    def __init__(self, args):
+        self.args = args
+        self.memory_limit = int((args.server_memory or Settings.default_server_memory) * 1024 * 1024)
+        self.lock = Lock()
+        # path: (mtime_ns, size, tree, bytes), oldest use first
+        self.trees = OrderedDict()
+        self.memory = 0
+        self.files = self.list_files()
+
+    def list_files(self):
+        return [file for file in Input.list_files(self.args) if isfile(file[0])]
+
+    def get_tree(self, path):
+        with self.lock:
+            entry = self.trees.get(path)
+            if entry:
+                self.trees.move_to_end(path)
+                return entry[2]
+        # parsed outside of the lock, other queries go on meanwhile
+        return self.load(path)
+
+    def load(self, path):
+        st = stat(path)
+        tree = FlatTree(*Input.read_first_tree(path))
+        size = tree.nbytes()
+        with self.lock:
+            old = self.trees.pop(path, None)
+            if old:
+                self.memory -= old[3]
+            self.trees[path] = (st.st_mtime_ns, st.st_size, tree, size)
+            self.memory += size
+            while self.memory > self.memory_limit and len(self.trees) > 1:
+                self.memory -= self.trees.popitem(last=False)[1][3]
+        return tree
+
+    def drop(self, path):
+        with self.lock:
+            entry = self.trees.pop(path, None)
+            if entry:
+                self.memory -= entry[3]
+
+    def watch(self, interval):
+        # new and removed files of the listing, changed files in memory are parsed again
+        while True:
+            sleep(interval)
+            files = self.list_files()
+            listed = {file[0] for file in files}
+            with self.lock:
+                loaded = [(path, entry[0], entry[1]) for path, entry in self.trees.items()]
+            for path, mtime_ns, size in loaded:
+                if path not in listed:
+                    self.drop(path)
+                    continue
+                try:
+                    st = stat(path)
+                    if (st.st_mtime_ns, st.st_size) != (mtime_ns, size):
+                        if Settings.verbose:
+                            print(f"Reloading changed {path}")
+                        self.load(path)
+                except (OSError, ValueError):
+                    self.drop(path)
+            self.files = files
+
+    @staticmethod
+    def params_from_query(query):
+        # GET parameters: c repeated for every criterion, other parameters once
+        params = {key: values[0] for key, values in query.items()}
+        params['criteria'] = query.get('c', []) + query.get('criteria', [])
+        if 'files' in query:
+            params['files'] = query['files']
+        return params
+
+    @staticmethod
+    def flag(params, key, default):
+        # true or false given as JSON boolean or as text of GET parameters
+        value = params.get(key, default)
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ('1', 'true', 'yes'):
+            return True
+        if isinstance(value, str) and value.lower() in ('0', 'false', 'no'):
+            return False
+        raise ValueError(f"{key} has to be true or false, not {value!r}")
+
+    def query(self, params):
+        # rows of all files (or of files given by path or name) for criteria and options of the query,
+        # options not in the query are taken from the command line
+        args = self.args
+        criteria = params.get('criteria') or []
+        if isinstance(criteria, str):
+            criteria = [criteria]
+        if not criteria:
+            raise ValueError("No sorting criteria specified.")
+        crit_tree = Critter.build_criteria_tree(criteria)
+
+        no_seed = Server.flag(params, 'no_seed', args.n)
+        nested = Server.flag(params, 'nested', args.nested)
+        if nested and no_seed:
+            raise ValueError("Option nested requires the use of seed taxon")
+        if params.get('mintaxons') is not None:
+            mintaxons = int(params['mintaxons']) + 1
+        elif no_seed and not args.n:
+            raise ValueError("Minimum taxon number in subtree has to be set with mintaxons")
+        else:
+            mintaxons = args.mintaxons
+        seedtaxon = None if no_seed else params.get('seedtaxon', args.seedtaxon)
+        options = Options(params.get('tolerance', args.tolerance), mintaxons, nested, seedtaxon, no_seed,
+                          search=args.search, engine=args.engine)
+
+        files = self.files
+        if params.get('files'):
+            wanted = set(params['files'])
+            files = [file for file in files if file[0] in wanted or basename(file[0]) in wanted]
+
+        text = StringIO()
+        if params.get('format', 'csv') == 'jsonl':
+            output = JSONLinesOutput(None, text)
+        else:
+            output = CSVOutput(None, text)
+        output.write_headers(criteria)
+        for file in files:
+            try:
+                # match matrix of the criteria is built on a copy, it goes with the response and is
+                # neither counted in the memory of the trees nor replaced by other queries meanwhile
+                tree = copy(self.get_tree(file[0]))
+            except (OSError, ValueError) as e:
+                if Settings.verbose:
+                    print(f"Skipping {file[0]}: {e}")
+                continue
+            for res in Critter.sort_tree_seeds(tree, Critter.seed_taxons(tree, file, options), crit_tree,
+                                               file[0], options):
+                output.write_result(res)
+        output.flush()
+        return text.getvalue()
+
+    @staticmethod
+    def make_handler():
+        from http.server import BaseHTTPRequestHandler
+        from urllib.parse import parse_qs, urlsplit
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.answer(lambda: Server.params_from_query(parse_qs(urlsplit(self.path).query)))
+
+            def do_POST(self):
+                # JSON object with criteria list and options
+                length = int(self.headers.get('Content-Length', 0))
+                self.answer(lambda: json_loads(self.rfile.read(length) or b'{}'))
+
+            def answer(self, get_params):
+                try:
+                    params = get_params()
+                    content_type = "application/x-ndjson" if params.get('format') == 'jsonl' else "text/csv"
+                    body = self.server.treesorter.query(params).encode()
+                    status = 200
+                except (ValueError, TypeError, IndexError, KeyError, AttributeError) as e:
+                    content_type = "text/plain"
+                    body = f"Wrong query: {e}\n".encode()
+                    status = 400
+                self.send_response(status)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def address_string(self):
+                # unix socket clients have no address
+                return self.client_address[0] if self.client_address else "unix socket"
+
+            def log_message(self, format, *args):
+                if Settings.verbose:
+                    super().log_message(format, *args)
+
+        return Handler
+
+    def serve(self):
+        args = self.args
+        handler = Server.make_handler()
+        if args.socket:
+            from socketserver import UnixStreamServer, ThreadingMixIn
+
+            class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+                daemon_threads = True
+
+            if exists(args.socket):
+                remove(args.socket)
+            server = UnixHTTPServer(args.socket, handler)
+            address = args.socket
+        else:
+            from http.server import ThreadingHTTPServer
+            server = ThreadingHTTPServer((args.host, args.port), handler)
+            address = f"http://{args.host}:{server.server_address[1]}/"
+        server.treesorter = self
+
+        for file in self.files:
+            # parsed up front until memory limit
+            if self.memory > self.memory_limit:
+                break
+            try:
+                self.load(file[0])
+            except (OSError, ValueError) as e:
+                print(f"Skipping {file[0]}: {e}")
+        if args.watch_interval > 0:
+            Thread(target=self.watch, args=(args.watch_interval,), daemon=True).start()
+
+        print(f"Serving {len(self.files)} tree files ({len(self.trees)} in memory) on {address}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if args.socket and exists(args.socket):
+                remove(args.socket)
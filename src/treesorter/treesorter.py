@@ -1,20 +1,46 @@
 #!/usr/bin/env python3
-from argparse import ArgumentParser
-from pprint import pprint
-from os.path import isfile, basename
+from os.path import isfile, basename, splitext
 from os import listdir
-from re import match, sub
+from re import sub, compile as re_compile, error as RegexError, IGNORECASE
+from itertools import chain, accumulate, islice, product
+from mmap import mmap, ACCESS_READ
+from array import array
+from math import isnan
+from sys import intern, getsizeof
+from time import perf_counter, process_time
+from json import dump as json_dump, load as json_load
+from collections import OrderedDict, deque
+from threading import Thread
+from io import BytesIO
+from queue import Queue
+from functools import cached_property
+# modules used only by the command line, the server, worker processes and profiling are imported
+# where they are used, so that importing the module as a library stays fast. The server, output
+# writers and what runs keep on disk are in modules of their own, imported the same way.
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:
+    # not available on windows, peak memory of the process is then not reported
+    getrusage = None
 
 
 class Settings:
-    allowed_extensions = [".tre", ".tree", ".nex", ".nxs", ".treefile"]
+    allowed_extensions = [".tre", ".tree", ".trees", ".nex", ".nxs", ".treefile"]
     verbose = False
     default_output_file = 'bootstraps.csv'
     relative_tolerance_rounding = 3
+    default_cache_size = 1024
+    default_server_memory = 2048
+    output_batch_rows = 1000
+    output_formats = {".jsonl": "jsonl", ".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
     args = None
 
 
 def main():
+    from treesorter.output import ArrowOutput, CSVOutput, JSONLinesOutput
+    from treesorter.persistence import Cache, CorpusIndex, Manifest, Shards
+    from treesorter.server import Server
     args = parse_args()
     Settings.args = args
     # pprint(args)
@@ -25,13 +51,22 @@ def main():
 
     if Settings.verbose:
         print("DEBUG-ARGS:", end=' ')
+        from pprint import pprint
         pprint(args)
 
-    if len(args.criteria) < 1:
+    if args.sweep:
+        if args.stream or args.index or args.serve:
+            exit("Flag --sweep can't be used with --stream, --index or --serve")
+        # read before -m is turned into the minimal subtree size
+        sweep = Sweep.from_file(args.sweep, args)
+    else:
+        sweep = None
+
+    if not args.criteria and not args.serve and not sweep:
         exit("No sorting criteria specified.")
 
     if not args.mintaxons:
-        if args.n:
+        if args.n and not sweep:
             exit("Minimum taxon number in subtree has to be set with -m MINTAXONS")
         else:
             args.mintaxons = 3
@@ -39,131 +74,538 @@ def main():
         args.mintaxons = int(args.mintaxons) + 1
         pass
 
+    if args.engine == 'numpy':
+        try:
+            import numpy
+        except ImportError:
+            exit("Flag --engine numpy requires the numpy package (pip install numpy)")
+
+    if args.stream and (args.nested or args.seedtaxon and Critter.Pattern(args.seedtaxon).parts != [args.seedtaxon]):
+        exit("Flag --stream can't be used with --nested or a seed taxon pattern, they need the whole tree in memory")
+
+    if args.shards:
+        if args.shard is not None and not 0 <= args.shard < args.shards:
+            exit(f"Shard number has to be from 0 to {args.shards - 1}")
+        if args.shard is not None and args.merge_shards:
+            exit("Flags --shard and --merge-shards can't be used together, merge after all shards finished")
+        if args.incremental or args.index or args.serve:
+            exit("Flag --shards can't be used with --incremental, --index or --serve, shards keep their own checkpoints")
+    elif args.shard is not None or args.merge_shards:
+        exit("Flags --shard and --merge-shards require the number of shards. Use together with --shards SHARDS")
+
+    if args.serve:
+        if args.all_trees:
+            exit("Flag --all-trees can't be used with --serve, the server evaluates first tree of each file")
+        Server(args).serve()
+        return
+
+    if args.clear_cache:
+        if not args.cache:
+            exit("Flag --clear-cache requires the cache directory. Use together with --cache CACHE")
+        Cache(args.cache).clear()
+
     files = Input.get_file_list(args)
-    crit_tree = Critter.build_criteria_tree(args.criteria)
+    if sweep:
+        # criteria of all sets, every tree is matched against them once
+        crit_tree = sweep.crit_tree
+    else:
+        try:
+            crit_tree = Critter.build_criteria_tree(args.criteria)
+        except (ValueError, IndexError) as e:
+            exit(f"Wrong criteria: {e}")
+    options = Options.from_args(args)
+    options.sweep = sweep
 
     if args.output:
         output_file = args.output[0]
     else:
         output_file = Settings.default_output_file
+    signature = (args.criteria, Critter.criteria_signature(crit_tree), options.signature())
+
+    def evaluate(numbered_files):
+        if args.jobs > 1:
+            return Batch.run(numbered_files, crit_tree, options, args.jobs, args.chunksize, not args.unordered)
+        if args.prefetch:
+            return Pipeline.evaluate(numbered_files, crit_tree, options, args.readers, args.prefetch)
+        return (Critter.evaluate_numbered(numbered, crit_tree, options) for numbered in numbered_files)
+
+    merged = None
+    if args.shards:
+        shards = Shards(output_file, args.shards, signature)
+        if args.shard is not None:
+            # one shard only, e.g. on one of several hosts, output is written by --merge-shards
+            evaluated_n = shards.run(args.shard, list(enumerate(files)), evaluate)
+            print(f"Shard {args.shard} of {args.shards}: {evaluated_n} files evaluated, "
+                  f"results in {shards.path(args.shard)}")
+            return
+        if not args.merge_shards:
+            # all shards on this machine, worker processes stand in for hosts
+            shards.run_local(list(enumerate(files)), crit_tree, options)
+        merged = shards.merged(list(enumerate(files)))
+
+    # format given by flag or by extension of output file
+    output_format = args.format or Settings.output_formats.get(splitext(output_file)[1].lower(), 'csv')
+    if output_format == 'csv':
+        output = CSVOutput(output_file)
+    elif output_format == 'jsonl':
+        output = JSONLinesOutput(output_file)
+    else:
+        output = ArrowOutput(output_file, output_format)
+    output.write_headers(args.criteria, args.all_trees, bool(sweep))
+
+    index = CorpusIndex(args.index) if args.index and not args.all_trees else None
+    if index:
+        options.collect_names = True
+        evaluate = index.evaluator(evaluate, crit_tree, options, not args.unordered)
+
+    manifest = None
+    if merged is not None:
+        evaluated = merged
+    elif args.incremental:
+        manifest = Manifest(output_file, signature)
+        options.hash_files = True
+        evaluated = manifest.merge(list(enumerate(files)), evaluate, not args.unordered)
+    else:
+        evaluated = evaluate(list(enumerate(files)))
+
+    if args.cprofile:
+        from cProfile import Profile as CProfile
+        profiler = CProfile()
+    else:
+        profiler = None
+    if profiler:
+        # worker processes of --jobs are not included
+        profiler.enable()
 
-    csv = CSVOutput(output_file)
-    csv.write_headers(args.criteria)
+    writer = Pipeline.Writer(output, args.prefetch) if args.prefetch else None
 
+    profiles = []
     i_t = 0
-    for file in files:
+    for i, file, results, profile, names, digest in evaluated:
         i_t += 1
         if Settings.verbose:
             print(f"File number {i_t:5d} {file[0]}")
-        tree = PTree()
-        tree.parse_file(Input.read_tree_file(file[0]))
-        seed_taxons = []
-
-        if args.seedtaxon:
-            seed_taxon_re = Critter.regize(args.seedtaxon)
-            for taxon in tree.taxons:
-                if match(seed_taxon_re, taxon.name):
-                    seed_taxons.append(taxon.name)
-        elif not args.n:
-            seed_taxons = [file[1]]
-        elif args.n:
-            # no seed taxon
-            seed_taxons = [None]
-        for seed_taxon in seed_taxons:
-            res = Critter.sort_one_tree_file(tree, seed_taxon, crit_tree, file[0])
-            row = csv.csv_row_from_list(csv.list_from_result_dict(res))
-            csv.write_row(row)
-    csv.close_file()
-
-
-class CSVOutput:
-    def __init__(self, out_path):
-        self.out_path = out_path
-        self.rows_written = 0
-        self.ordered_crits = []
+        if profile:
+            profile.restart()
+        if writer:
+            writer.write(results)
+        else:
+            for res in results:
+                output.write_result(res)
+        if profile:
+            profile.lap('output')
+            profiles.append(profile)
+    if writer:
+        writer.close()
+    else:
+        output.close_file()
+
+    if manifest:
+        manifest.save()
+    if index:
+        index.save()
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+
+    if args.profile:
+        Profile.write_report(args.profile, profiles)
+        Profile.print_summary(profiles)
+
+    if options.cache:
+        options.cache.evict()
+
+
+class Options:
+    # evaluation settings passed explicitly instead of read from Settings.args,
+    # so they can be sent to worker processes
+    def __init__(self, tolerance=0.0, mintaxons=3, nested=False, seedtaxon=None, no_seed=False, all_trees=False,
+                 cache=None, profile=False, profile_memory=False, search='pruned', engine='python', memo=None,
+                 stream=False):
+        self.tolerance = float(tolerance)
+        self.mintaxons = int(mintaxons)
+        self.nested = nested
+        self.seedtaxon = seedtaxon
+        self.seed_pattern = Critter.Pattern(seedtaxon) if seedtaxon else None
+        self.no_seed = no_seed
+        self.all_trees = all_trees
+        self.cache = cache
+        self.profile = profile
+        self.profile_memory = profile_memory
+        self.search = search
+        self.engine = engine
+        self.memo = memo
+        self.stream = stream
+        # configurations of --sweep evaluated on every tree instead of the criteria alone
+        self.sweep = None
+        # taxon names of parsed trees are sent back for the corpus index
+        self.collect_names = False
+        # content of evaluated files is hashed for the manifest of --incremental
+        self.hash_files = False
+
+    @staticmethod
+    def from_args(args):
+        from treesorter.persistence import Cache
+        cache = Cache(args.cache, args.cache_size) if args.cache else None
+        memo = SubtreeMemo(args.memo) if args.memo else None
+        return Options(args.tolerance, args.mintaxons, args.nested, args.seedtaxon, args.n, args.all_trees, cache,
+                       bool(args.profile), args.profile_memory, args.search, args.engine, memo, args.stream)
+
+    def signature(self):
+        # everything besides criteria and tree that results depend on, search modes, engines,
+        # the memo and streaming give equal results
+        signature = (self.tolerance, self.mintaxons, self.nested, self.seedtaxon, self.no_seed, self.all_trees)
+        return signature + (self.sweep.signature(),) if self.sweep else signature
+
+
+class SubtreeMemo:
+    # --memo: in-memory memo shared by all trees of a run (of one worker process with --jobs).
+    # Keys start with the id of a compiled criterion. Leaf names map to their rows of the match
+    # matrix and edge sides map to their verdict. A side is keyed by a hash of its leaf names,
+    # so equal clades of paralog copies, re-runs or repeated subtrees reuse the verdict. Oldest
+    # entries are dropped over the limit, lookups are on the hot path and do not reorder them.
+    missing = object()
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.criteria = {}
+
+    def criterion_id(self, criterium):
+        key = tuple((group[0], tuple(pattern.source for pattern in group[1])) for group in criterium)
+        return self.criteria.setdefault(key, len(self.criteria))
+
+    def get(self, key):
+        value = self.entries.get(key, SubtreeMemo.missing)
+        if value is not SubtreeMemo.missing:
+            Profile.counters['memo_hits'] += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class Sweep:
+    # --sweep: configurations of criteria sets x tolerances x -m values x nested from a JSON file, e.g.
+    # {"criteria": {"strict": ["dinos=0.5+Dinos*"], "loose": ["dinos=0.2+Dinos*", "hapto=1+Hapto*"]},
+    #  "tolerance": [0, 0.1], "mintaxons": [1, 2], "nested": [false, true]}
+    # Missing keys are taken from the command line. Every tree is parsed once and matched against
+    # the criteria of all sets once, configurations only threshold the shared clade counts.
+    def __init__(self, criteria_sets, tolerances, mintaxons, nested):
+        # criteria of all sets keyed by set number and name, a criterion with equal name and
+        # definition in several sets is matched once
+        self.crit_tree = {}
+        self.columns = {}
+        keys = {}
+        set_trees = {}
+        for i, (name, criteria) in enumerate(criteria_sets.items()):
+            set_tree = {}
+            criteria = [criteria] if isinstance(criteria, str) else criteria
+            for column, criterium in Critter.build_criteria_tree(criteria).items():
+                key = keys.setdefault(repr(Critter.criteria_signature({column: criterium})), f"{i}/{column}")
+                self.crit_tree.setdefault(key, criterium)
+                self.columns[key] = column
+                set_tree[key] = self.crit_tree[key]
+            set_trees[name] = set_tree
+        self.configs = []
+        for (name, set_tree), tolerance, m, nest in product(set_trees.items(), tolerances, mintaxons, nested):
+            config = f"{name}:t={tolerance:g}:m={m}" + (":nested" if nest else "")
+            self.configs.append((config, set_tree, tolerance, m + 1, nest))
+
+    @staticmethod
+    def from_file(path, args):
         try:
-            self.file_object = open(out_path, 'w')
-        except OSError as e:
-            exit(f"Wrong output path: {e}")
-
-    def close_file(self):
-        self.file_object.close()
-
-    def list_from_result_dict(self, result: dict):
-        build_list = [result['file'], result['taxon'], result['size']]
-        for key in self.ordered_crits:
-            if result['crits'][key]:
-                build_list += [result['crits'][key][0],
-                               result['crits'][key][1],
-                               result['crits'][key][2]]
-            else:
-                build_list += ['', '', '']
-            pass
-        return build_list
+            with open(path) as f:
+                spec = json_load(f)
+            criteria_sets = spec.get('criteria') or ({'default': args.criteria} if args.criteria else {})
+            if not isinstance(criteria_sets, dict):
+                raise ValueError("criteria have to be an object of set names and lists of criteria")
+
+            def values(key, default, convert):
+                given = spec.get(key, default)
+                return [convert(value) for value in (given if isinstance(given, list) else [given])]
+
+            tolerances = values('tolerance', args.tolerance, float)
+            mintaxons = values('mintaxons', args.mintaxons or [], int)
+            nested = values('nested', args.nested, bool)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            exit(f"Wrong sweep file: {e}")
+        if not criteria_sets:
+            exit("No sorting criteria specified, neither in the sweep file nor with -c")
+        if not mintaxons:
+            if args.n:
+                exit("Minimum taxon number in subtree has to be set with -m MINTAXONS or in the sweep file")
+            mintaxons = [2]
+        if any(nested) and args.n:
+            exit("Nested configurations require the use of seed taxon. Use together with -s [SEEDTAXON]")
+        try:
+            return Sweep(criteria_sets, tolerances, mintaxons, nested)
+        except (ValueError, IndexError, TypeError) as e:
+            exit(f"Wrong criteria: {e}")
+
+    def signature(self):
+        return [(config, Critter.criteria_signature(set_tree), tolerance, mintaxons, nested)
+                for config, set_tree, tolerance, mintaxons, nested in self.configs]
+
+    def evaluate(self, tree, seed_taxons, tree_path, options):
+        # results of every configuration for one tree, tagged with the configuration and keyed by
+        # criterion names of its set
+        Critter.get_match_matrix(tree, self.crit_tree, options.memo).keep_counts = True
+        results = []
+        for config, set_tree, tolerance, mintaxons, nested in self.configs:
+            config_options = Options(tolerance, mintaxons, nested, all_trees=options.all_trees, search=options.search,
+                                     engine=options.engine, memo=options.memo)
+            for res in Critter.sort_tree_seeds(tree, seed_taxons, set_tree, tree_path, config_options):
+                res['config'] = config
+                res['crits'] = {self.columns[key]: crit for key, crit in res['crits'].items()}
+                results.append(res)
+        return results
+
 
-    def csv_row_from_list(self, items: list):
-        row = "\n" if self.rows_written > 0 else ""
-        items_n = len(items)
-        for i, item in enumerate(items):
-            row += f"\"{item}\"" + ("," if i + 1 < items_n else "")
+class Pipeline:
+    # --prefetch: reader threads read upcoming files into memory while the current tree is parsed
+    # and evaluated, a writer thread drains rows to the output. At most `depth` files are read ahead
+    # and at most `depth` results wait for the writer, so memory stays bounded for any file count.
+    @staticmethod
+    def read(path):
+        with open(path, 'rb') as f:
+            return f.read()
 
+    @staticmethod
+    def evaluate(numbered_files, crit_tree, options, readers, depth):
+        # yields (index, file, results, profile, names, digest) in input order
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(readers) as pool:
+            upcoming = iter(numbered_files)
+            window = deque()
+            for numbered in islice(upcoming, depth):
+                window.append((numbered, pool.submit(Pipeline.read, numbered[1][0])))
+            while window:
+                numbered, future = window.popleft()
+                for following in islice(upcoming, 1):
+                    window.append((following, pool.submit(Pipeline.read, following[1][0])))
+                try:
+                    content = future.result()
+                except OSError:
+                    # read again while evaluating, so the error is the same as without prefetch
+                    content = None
+                yield Critter.evaluate_numbered(numbered, crit_tree, options, content)
+
+    class Writer:
+        def __init__(self, output, depth):
+            self.output = output
+            self.queue = Queue(depth)
+            self.error = None
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+        def run(self):
+            while (results := self.queue.get()) is not None:
+                if self.error:
+                    continue
+                try:
+                    for res in results:
+                        self.output.write_result(res)
+                except BaseException as e:
+                    # raised in main thread on close, also exit() of output writers
+                    self.error = e
+
+        def write(self, results):
+            self.queue.put(results)
+
+        def close(self):
+            self.queue.put(None)
+            self.thread.join()
+            if self.error:
+                raise self.error
+            self.output.close_file()
+
+
+class Batch:
+    # process pool spreading files over workers, criteria and options are sent to each worker once
+    crit_tree = None
+    options = None
+
+    @staticmethod
+    def init_worker(crit_tree, options):
+        Batch.crit_tree = crit_tree
+        Batch.options = options
+
+    @staticmethod
+    def work(numbered_file):
+        return Critter.evaluate_numbered(numbered_file, Batch.crit_tree, Batch.options)
+
+    @staticmethod
+    def interleave(stored, evaluated, ordered=True):
+        # Evaluated (index, file, ...) tuples merged with stored tuples of other files, which are
+        # keyed by ascending index. In input order when ordered, stored tuples first otherwise.
+        if not ordered:
+            yield from stored.values()
+            stored = {}
+        for item in evaluated:
+            while stored and next(iter(stored)) < item[0]:
+                yield stored.pop(next(iter(stored)))
+            yield item
+        yield from stored.values()
+
+    @staticmethod
+    def run(numbered_files, crit_tree, options, jobs, chunksize=None, ordered=True):
+        # yields (index, file, results, profile, names, digest) in input order, or as finished when not ordered
+        if not numbered_files:
+            return
+        if not chunksize:
+            chunksize = max(1, min(64, len(numbered_files) // (jobs * 4)))
+        from multiprocessing import Pool
+        with Pool(jobs, initializer=Batch.init_worker, initargs=(crit_tree, options)) as pool:
+            mapper = pool.imap if ordered else pool.imap_unordered
+            yield from mapper(Batch.work, numbered_files, chunksize)
+
+
+class Profile:
+    # wall and cpu time per stage, work counters and peak memory of one file, collected with --profile
+    stages = ["cache", "read", "parse", "match", "evaluate", "output"]
+    counter_names = ["edges", "pattern_matches", "checker_calls", "memo_hits"]
+    # incremented by evaluation whether profiling or not, in bulk where it is on a hot path
+    counters = dict.fromkeys(counter_names, 0)
+    summary_size = 10
+
+    def __init__(self, file, options):
+        self.file = file[0]
+        self.trees = 0
+        self.wall = dict.fromkeys(Profile.stages, 0.0)
+        self.cpu = dict.fromkeys(Profile.stages, 0.0)
+        self.counts = dict(Profile.counters)
+        self.peak_memory = None
+        self.trace_memory = options.profile_memory
+        if self.trace_memory:
+            from tracemalloc import is_tracing, start as start_tracing, reset_peak
+            if not is_tracing():
+                start_tracing()
+            reset_peak()
+        self.restart()
+
+    def restart(self):
+        self.mark = (perf_counter(), process_time())
+
+    def lap(self, stage):
+        # time since the last lap or restart is added to stage
+        wall, cpu = perf_counter(), process_time()
+        self.wall[stage] += wall - self.mark[0]
+        self.cpu[stage] += cpu - self.mark[1]
+        self.mark = (wall, cpu)
+
+    def finish(self):
+        self.counts = {name: Profile.counters[name] - self.counts[name] for name in Profile.counter_names}
+        if self.trace_memory:
+            # peak of python allocations while evaluating this file, without tracing it stays empty as
+            # the resident size of the process only grows over the run and says nothing about the file
+            from tracemalloc import get_traced_memory
+            self.peak_memory = get_traced_memory()[1]
+        return self
+
+    def total(self):
+        return sum(self.wall.values())
+
+    def row(self):
+        row = {"file": self.file, "trees": self.trees, "wall": round(self.total(), 6)}
+        for stage in Profile.stages:
+            row[f"{stage}_wall"] = round(self.wall[stage], 6)
+            row[f"{stage}_cpu"] = round(self.cpu[stage], 6)
+        row.update(self.counts)
+        row["peak_memory"] = self.peak_memory
         return row
 
-    def write_row(self, s: str):
-        self.file_object.write(s)
-        self.rows_written += 1
-
-    def write_headers(self, crit_list: list):
-        if self.rows_written == 0:
-            items = ["filename", "seed_taxon", "total_taxons"]
-            crit_items = []
-            for item in crit_list:
-                crit_items += [item, "tu_R", "tu_A"]
-                self.ordered_crits += [item[:item.find("=")]]
-            items += crit_items
-            self.write_row(self.csv_row_from_list(items))
-        else:
-            exit("Headers already written")
+    @staticmethod
+    def write_report(path, profiles):
+        # json list of rows for .json paths, csv otherwise
+        rows = [profile.row() for profile in profiles]
+        try:
+            with open(path, 'w', newline='') as f:
+                if path.endswith(".json"):
+                    json_dump(rows, f, indent=1)
+                else:
+                    from csv import DictWriter
+                    writer = DictWriter(f, fieldnames=list(rows[0]) if rows else ["file"])
+                    writer.writeheader()
+                    writer.writerows(rows)
+        except OSError as e:
+            exit(f"Wrong profile path: {e}")
+
+    @staticmethod
+    def process_peak_memory():
+        # peak resident size of this process over the whole run in bytes, kB on linux, None without getrusage
+        return getrusage(RUSAGE_SELF).ru_maxrss * 1024 if getrusage else None
+
+    @staticmethod
+    def print_summary(profiles):
+        total = sum(profile.total() for profile in profiles)
+        print(f"Profiled {len(profiles)} files in {total:.3f} s")
+        peak = Profile.process_peak_memory()
+        if peak is not None:
+            # worker processes of --jobs are not included
+            print(f"  peak memory of the process {peak / 1024 / 1024:.1f} MB")
+        for stage in Profile.stages:
+            wall = sum(profile.wall[stage] for profile in profiles)
+            cpu = sum(profile.cpu[stage] for profile in profiles)
+            print(f"  {stage:10s} wall {wall:10.3f} s  cpu {cpu:10.3f} s")
+        for name in Profile.counter_names:
+            print(f"  {name:16s} {sum(profile.counts[name] for profile in profiles):14d}")
+        print("Slowest files:")
+        for profile in sorted(profiles, key=Profile.total, reverse=True)[:Profile.summary_size]:
+            stage = max(Profile.stages, key=profile.wall.get)
+            print(f"  {profile.total():10.3f} s  mostly {stage:10s} {profile.file}")
 
 
 class Critter:
     @staticmethod
     def criteria_checker(taxons: list, criterium: list, tolerance: float, minimum: int, seed=None):
+        # taxons are Taxon objects of one subtree, reference for the match matrix path
         taxons_n = len(taxons)
 
-        tolerance_is_relative = tolerance < 1.0
-        tolerance_is_absolute = not tolerance_is_relative
-
-        used_relative_tolerance = 0.0
-        used_absolute_tolerance = 0
-
         if taxons_n < minimum:
             # too small subtree
             return False, 0, 0
 
-        taxon_objects = [_[0] for _ in taxons]
-
         # check for seed taxon
         if seed:
-            if seed not in [_.name for _ in taxon_objects]:
+            if seed not in [_.name for _ in taxons]:
                 # seed taxon not in this subtree, not a valid tree
                 return False, 0, 0
 
         passing_taxon_set = set()
+        group_counts = []
 
         for quantified in criterium:
             passing_taxon_count = 0
-            for tested_taxon in taxon_objects:
-                for re_pattern in quantified[1]:
-                    if match(re_pattern, tested_taxon.name):
+            for tested_taxon in taxons:
+                for pattern in quantified[1]:
+                    if pattern.match(tested_taxon.name):
                         passing_taxon_count += 1
                         passing_taxon_set.add(tested_taxon)
                         break
+            group_counts.append(passing_taxon_count)
+
+        return Critter.counts_checker(taxons_n, group_counts, len(passing_taxon_set), criterium, tolerance)
+
+    @staticmethod
+    def counts_checker(taxons_n: int, group_counts: list, passing_taxon_count: int, criterium: list,
+                       tolerance: float):
+        # group_counts are numbers of taxons passing each quantified group of criterium,
+        # passing_taxon_count is number of taxons passing any of them
+        tolerance_is_relative = tolerance < 1.0
+        tolerance_is_absolute = not tolerance_is_relative
+
+        used_relative_tolerance = 0.0
+        used_absolute_tolerance = 0
 
+        for quantified, group_count in zip(criterium, group_counts):
             # check if passes set quantification
             if quantified[0] < 1:
                 # relative quantification
-                if (passing_taxon_count / taxons_n) >= quantified[0]:
+                if (group_count / taxons_n) >= quantified[0]:
                     # enough occurences of specified set
                     pass
                 else:
@@ -171,7 +613,7 @@ class Critter:
                     return False, 0, 0
             else:
                 # absolute quantification
-                if passing_taxon_count > quantified[0]:
+                if group_count > quantified[0]:
                     # enough occurences of specified set
                     pass
                 else:
@@ -179,7 +621,6 @@ class Critter:
                     return False, 0, 0
 
         # check if passes total tolerance after all criteria are tested
-        passing_taxon_count = len(passing_taxon_set)
         if tolerance_is_relative:
             # relative quantification
             used_relative_tolerance = ((taxons_n - passing_taxon_count) / taxons_n)
@@ -217,11 +658,15 @@ class Critter:
             while s:
                 if s[0].isdigit():
                     i = s.find("+")
+                    if i < 0:
+                        raise ValueError(f"Quantifier without '+' in {s}")
                     q = float(s[:i])
                     s = s[i + 1:].lstrip(',')
                 elif s[0] == "(":
                     i = s.find(")")
-                    tup = (q, [Critter.regize(_) for _ in s[1:i].split(',')])
+                    if i < 0:
+                        raise ValueError(f"Group without ')' in {s}")
+                    tup = (q, [Critter.Pattern(_) for _ in s[1:i].split(',')])
                     crit_list.append(tup)
                     q = 0
                     s = s[i + 1:].lstrip(',')
@@ -229,7 +674,7 @@ class Critter:
                     i = len(s) + 1
                     i = s.find(',') if s.find(',') >= 0 else i
                     tax = s[0:i]
-                    tup = (q, [Critter.regize(tax)])
+                    tup = (q, [Critter.Pattern(tax)])
                     crit_list.append(tup)
                     q = 0
                     s = s[i:].lstrip(',')
@@ -240,128 +685,1097 @@ class Critter:
         for crit in criteria:
             # go through all string criteria and prepare filter
             crit = crit.split('=')
+            Critter.support_index(crit[0])
             crits_tree[crit[0]] = parse_crit(crit[1])
         return crits_tree
 
+    @staticmethod
+    def support_index(column):
+        # "name@2" ranks clades by the second of several support values like SH-aLRT/UFBoot,
+        # plain "name" by the first one
+        name, at, index = column.rpartition('@')
+        if not at:
+            return 0
+        if not index.isdigit() or int(index) < 1:
+            raise ValueError(f"Support value number has to be a positive integer in {column}")
+        return int(index) - 1
+
     @staticmethod
     def regize(s):
         s = s.replace("*", ".*")
         s = f"^{s}$"
         return s
 
-    @staticmethod
-    def sort_one_tree_file(tree, seed_taxon, crit_tree, tree_path):
-        highest_bootstrap = -1
-        lowest_rel_tolerance_used = 1.0
-        lowest_abs_tolerance_used = 10e6
-        tree_size = len(tree.taxons)
-        lowest_subtree_size = tree_size
-        nested = Settings.args.nested
-
-        valid_count = 0
-
-        results = dict()
+    class Pattern:
+        # taxon name pattern compiled once, plain * globs are matched without regex
+        __slots__ = ('source', 'parts', 'regex')
+        regex_chars = set('.^$+?{}[]|()\\')
+
+        def __init__(self, s):
+            self.source = s
+            if Critter.Pattern.regex_chars.intersection(s):
+                self.parts = None
+                try:
+                    self.regex = re_compile(Critter.regize(s))
+                except RegexError as e:
+                    raise ValueError(f"Taxon pattern {s} is not a valid regular expression: {e}")
+            else:
+                self.parts = s.split('*')
+                self.regex = None
+
+        def match(self, name):
+            if self.regex is not None:
+                return self.regex.match(name) is not None
+            parts = self.parts
+            if len(parts) == 1:
+                return name == parts[0]
+            first, last = parts[0], parts[-1]
+            end = len(name) - len(last)
+            if end < len(first) or not name.startswith(first) or not name.endswith(last):
+                return False
+            # remaining parts have to follow in order between prefix and suffix
+            pos = len(first)
+            for part in parts[1:-1]:
+                pos = name.find(part, pos, end)
+                if pos < 0:
+                    return False
+                pos += len(part)
+            return True
+
+    class MatchMatrix:
+        # Which taxons match which criterion group, computed once per tree. Every
+        # column of the matrix is kept as prefix sums over leaf order of the
+        # bipartition index, so counting a clade is a difference of two items.
+        def __init__(self, bip, crit_tree, memo=None):
+            self.crit_tree = crit_tree
+            self.bip = bip
+            self.memo = memo
+            self.groups = {}
+            self.passing = {}
+            self.quantified = {}
+            self.verdicts = {}
+            self.single_verdicts = {}
+            self.levels = {}
+            self.depths = {}
+            # passes over all sides for seed_bests and nested_seed_bests by (column, tolerance, minimum),
+            # shared by configurations of --sweep
+            self.node_bests = {}
+            self.nested_bests = {}
+            # --sweep keeps side counts of every column, its verdicts are taken at several
+            # tolerances and sizes
+            self.keep_counts = False
+            self.counts = {}
+
+            names = bip.leaf_names
+            if memo is not None:
+                self.criterion_ids = {column: memo.criterion_id(criterium) for column, criterium in crit_tree.items()}
+                # multiset hash of leaf names of every side is a difference of two prefix sums
+                self.leaf_hashes = self.prefix_sums(hash(name) for name in names)
+            attempts = 0
+            for column, criterium in crit_tree.items():
+                matrix = []
+                for name in names:
+                    if memo is not None:
+                        key = (self.criterion_ids[column], name)
+                        row = memo.get(key)
+                        if row is not SubtreeMemo.missing:
+                            matrix.append(row)
+                            continue
+                    row = []
+                    for group in criterium:
+                        # first matching pattern of a group is enough
+                        hit = False
+                        for pattern in group[1]:
+                            attempts += 1
+                            if pattern.match(name):
+                                hit = True
+                                break
+                        row.append(hit)
+                    matrix.append(row)
+                    if memo is not None:
+                        memo.put(key, row)
+                self.groups[column] = [self.prefix_sums(row[g] for row in matrix) for g in range(len(criterium))]
+                self.passing[column] = self.prefix_sums(any(row) for row in matrix)
+                quantified = [g for g, group in enumerate(criterium) if group[0] > 0.0]
+                self.quantified[column] = [any(row[g] for g in quantified) for row in matrix]
+            Profile.counters['pattern_matches'] += attempts
+
+        def covers(self, crit_tree):
+            # criteria of a sweep configuration are a part of the criteria the matrix was built for
+            return all(self.crit_tree.get(column) is criterium for column, criterium in crit_tree.items())
+
+        @staticmethod
+        def prefix_sums(hits):
+            return list(accumulate(hits, initial=0))
+
+        def count(self, prefix, e, d):
+            lo, hi = self.bip.child_range(e)
+            inside = prefix[hi] - prefix[lo]
+            return inside if d % 2 else prefix[-1] - inside
+
+        def side_counts(self, column, e, d):
+            # per group counts and number of taxons passing any group on side d of edge e
+            return ([self.count(prefix, e, d) for prefix in self.groups[column]],
+                    self.count(self.passing[column], e, d))
+
+        def column_counts(self, column):
+            # side_counts of every edge side at 2 * edge + side
+            if column not in self.counts:
+                self.counts[column] = [self.side_counts(column, e, d)
+                                       for e in range(len(self.bip.edge_child)) for d in range(2)]
+            return self.counts[column]
+
+        def side_verdicts(self, column, tolerance, minimum, engine='python'):
+            # (r_t, a_t) for every edge side at position 2 * edge + side, None where the side fails,
+            # computed once and shared by all seed taxons
+            key = (column, tolerance, minimum)
+            if key not in self.verdicts and engine == 'numpy':
+                self.numpy_verdicts(tolerance, minimum)
+            if key not in self.verdicts:
+                bip = self.bip
+                verdicts = []
+                checks = 0
+                for e in range(len(bip.edge_child)):
+                    for d in range(2):
+                        size = bip.side_size(e, d)
+                        if size < minimum:
+                            # too small subtree
+                            verdicts.append(None)
+                            continue
+                        checks += 1
+                        verdicts.append(self.check_side(column, tolerance, e, d, size))
+                self.verdicts[key] = verdicts
+                Profile.counters['checker_calls'] += checks
+            return self.verdicts[key]
+
+        def numpy_verdicts(self, tolerance, minimum):
+            # Verdicts of every edge side and every criterion at once, equal to side_verdicts.
+            # Sides are rows of a leaf membership matrix and criterion groups are columns of
+            # matching leaves. Sides are leaf ranges, so their product is a difference of the
+            # prefix sums at both range ends, taken for all sides and groups in one gather.
+            import numpy as np
+            bip = self.bip
+            columns = list(self.crit_tree)
+            prefixes = []
+            for column in columns:
+                prefixes += self.groups[column] + [self.passing[column]]
+            prefix = np.array(prefixes, dtype=np.int64).T
+            child = np.asarray(bip.edge_child, dtype=np.int64)
+            lo = np.asarray(bip.node_lo, dtype=np.int64)[child]
+            hi = np.asarray(bip.node_hi, dtype=np.int64)[child]
+
+            # side 0 of edge e at row 2 * e, side 1 at row 2 * e + 1
+            inside = prefix[hi] - prefix[lo]
+            counts = np.empty((2 * len(child), prefix.shape[1]), dtype=np.int64)
+            counts[0::2] = prefix[-1] - inside
+            counts[1::2] = inside
+            sizes = np.empty(2 * len(child), dtype=np.int64)
+            sizes[0::2] = bip.n_leaves - (hi - lo)
+            sizes[1::2] = hi - lo
+            divisor = np.maximum(sizes, 1)
+            large = sizes >= minimum
+            Profile.counters['checker_calls'] += int(large.sum()) * len(columns)
+
+            g = 0
+            for column in columns:
+                valid = large.copy()
+                for quantified in self.crit_tree[column]:
+                    if quantified[0] < 1:
+                        # relative quantification
+                        valid &= counts[:, g] / divisor >= quantified[0]
+                    else:
+                        # absolute quantification
+                        valid &= counts[:, g] > quantified[0]
+                    g += 1
+                outside = sizes - counts[:, g]
+                g += 1
+                if tolerance < 1.0:
+                    valid &= outside / divisor <= tolerance
+                else:
+                    valid &= outside <= tolerance
+
+                # rounding of valid sides only, in python to match counts_checker exactly
+                verdicts = [None] * len(sizes)
+                for side in np.flatnonzero(valid).tolist():
+                    taxons_n = int(sizes[side])
+                    used_absolute_tolerance = int(outside[side])
+                    used_relative_tolerance = used_absolute_tolerance / taxons_n
+                    if tolerance < 1.0:
+                        used_absolute_tolerance = round(used_relative_tolerance * taxons_n)
+                    verdicts[side] = (round(used_relative_tolerance, Settings.relative_tolerance_rounding),
+                                      used_absolute_tolerance)
+                self.verdicts[(column, tolerance, minimum)] = verdicts
+
+        def side_verdict(self, column, tolerance, minimum, e, d):
+            # verdict of a single edge side, for searches that look at a few sides only
+            key = (column, tolerance, minimum)
+            if key in self.verdicts:
+                return self.verdicts[key][2 * e + d]
+            known = self.single_verdicts.setdefault(key, {})
+            side = 2 * e + d
+            if side not in known:
+                size = self.bip.side_size(e, d)
+                verdict = None
+                if size >= minimum:
+                    Profile.counters['checker_calls'] += 1
+                    verdict = self.check_side(column, tolerance, e, d, size)
+                known[side] = verdict
+            return known[side]
+
+        def check_side(self, column, tolerance, e, d, size):
+            # (r_t, a_t) of a side large enough, None where it fails, sides with equal leaf names
+            # reuse the verdict with --memo
+            memo = self.memo
+            if memo is not None:
+                lo, hi = self.bip.child_range(e)
+                inside = self.leaf_hashes[hi] - self.leaf_hashes[lo]
+                key = (self.criterion_ids[column], tolerance, size, inside if d % 2 else self.leaf_hashes[-1] - inside)
+                verdict = memo.get(key)
+                if verdict is not SubtreeMemo.missing:
+                    return verdict
+            if self.keep_counts:
+                group_counts, passing_count = self.column_counts(column)[2 * e + d]
+            else:
+                group_counts, passing_count = self.side_counts(column, e, d)
+            is_valid, r_t, a_t = Critter.counts_checker(size, group_counts, passing_count, self.crit_tree[column],
+                                                        tolerance)
+            verdict = (r_t, a_t) if is_valid else None
+            if memo is not None:
+                memo.put(key, verdict)
+            return verdict
+
+        def quantified_depths(self, column):
+            # Smallest depth of a taxon passing quantified groups on every edge side at 2 * edge + side,
+            # inf without one. Inside a clade it is the shallowest such leaf below its node. Outside
+            # of it, it is the shallowest one hanging on the parent node besides the clade, or one
+            # level deeper than outside of the parent's own edge.
+            if column not in self.depths:
+                bip = self.bip
+                hits = self.quantified[column]
+                inf = float('inf')
+                n_nodes = len(bip.node_depth)
+                direct = [inf] * n_nodes
+                for leaf, node in enumerate(bip.leaf_node):
+                    if hits[leaf]:
+                        direct[node] = bip.node_depth[node]
+                below = list(direct)
+                for node in reversed(bip.order):
+                    parent = bip.node_parent[node]
+                    if parent >= 0 and below[node] < below[parent]:
+                        below[parent] = below[node]
+                # two smallest values of children, so that each child can be left out
+                first = [inf] * n_nodes
+                second = [inf] * n_nodes
+                for node in bip.order:
+                    parent = bip.node_parent[node]
+                    if parent < 0:
+                        continue
+                    value = below[node]
+                    if value < first[parent]:
+                        second[parent] = first[parent]
+                        first[parent] = value
+                    elif value < second[parent]:
+                        second[parent] = value
+                outside = [inf] * n_nodes
+                for node in bip.order:
+                    parent = bip.node_parent[node]
+                    if parent < 0:
+                        continue
+                    others = second[parent] if below[node] == first[parent] else first[parent]
+                    depth = min(direct[parent], others) - bip.node_depth[parent] + 1
+                    if bip.node_parent[parent] >= 0:
+                        depth = min(depth, outside[parent] + 1)
+                    outside[node] = depth
+                depths = []
+                for child in bip.edge_child:
+                    depths += [outside[child], below[child] - bip.node_depth[child] + 1]
+                self.depths[column] = depths
+            return self.depths[column]
+
+        def seed_side_bests(self, column, tolerance, minimum, engine='python'):
+            # Best valid side holding a leaf of every node, every edge has exactly one such side,
+            # for seed_bests of seed taxons found once. Complements of all edges in the subtree below
+            # each edge are merged bottom-up, sides above each node come top-down in one pre-order
+            # pass: the clade of the node's own edge, complements of its siblings' subtrees and
+            # whatever is above the parent.
+            key = (column, tolerance, minimum)
+            if key not in self.node_bests:
+                bip = self.bip
+                merge = Critter.merge_best
+                node_edges = bip.child_edges
+                verdicts = self.side_verdicts(column, tolerance, minimum, engine)
+                edges_bs = bip.support_values(Critter.support_index(column))
+                inside = []
+                below_outside = [None] * len(edges_bs)
+                for e, bs in enumerate(edges_bs):
+                    for d in range(2):
+                        verdict = verdicts[2 * e + d]
+                        candidate = None
+                        if verdict is not None:
+                            candidate = (bs, verdict[0], 2 * e + d, verdict[1], bip.side_size(e, d))
+                        if d:
+                            inside.append(candidate)
+                        else:
+                            below_outside[e] = candidate
+                for node in reversed(bip.order):
+                    e = bip.node_edge[node]
+                    if e >= 0:
+                        for child_e in node_edges[node]:
+                            below_outside[e] = merge(below_outside[e], below_outside[child_e])
+                above = [None] * len(bip.node_depth)
+                node_best = [None] * len(bip.node_depth)
+                for node in bip.order:
+                    edges = node_edges[node]
+                    # merged complements of child subtrees from both ends, so that each child can be left out
+                    prefix = [None]
+                    for e in edges:
+                        prefix.append(merge(prefix[-1], below_outside[e]))
+                    suffix = [None]
+                    for e in reversed(edges):
+                        suffix.append(merge(suffix[-1], below_outside[e]))
+                    node_best[node] = merge(above[node], prefix[-1])
+                    for k, e in enumerate(edges):
+                        others = merge(prefix[k], suffix[len(edges) - k - 1])
+                        above[bip.edge_child[e]] = merge(merge(above[node], inside[e]), others)
+                self.node_bests[key] = node_best
+                Profile.counters['edges'] += 2 * len(bip.edge_bs)
+            return self.node_bests[key]
+
+        def nested_side_bests(self, column, tolerance, minimum, engine='python'):
+            # For nested_seed_bests: best valid clade on the path from the top down to every node,
+            # depth of the shallowest taxon passing quantified groups below every node (counted from
+            # the top) and (threshold, pre-order position, candidate) of valid complements in
+            # ascending order of thresholds
+            key = (column, tolerance, minimum)
+            if key not in self.nested_bests:
+                bip = self.bip
+                merge = Critter.merge_best
+                depth = bip.node_depth
+                parent = bip.node_parent
+                position = bip.preorder_ranges[0]
+                inf = float('inf')
+                verdicts = self.side_verdicts(column, tolerance, minimum, engine)
+                quantified_depths = self.quantified_depths(column)
+                edges_bs = bip.support_values(Critter.support_index(column))
+                path_best = [None] * len(depth)
+                below = [-inf] * len(depth)
+                outside = []
+                for node in bip.order:
+                    e = bip.node_edge[node]
+                    if e < 0:
+                        continue
+                    best = path_best[parent[node]]
+                    verdict = verdicts[2 * e + 1]
+                    if verdict is not None:
+                        best = merge(best, (edges_bs[e], verdict[0], 2 * e + 1, verdict[1], bip.side_size(e, 1)))
+                    path_best[node] = best
+                    below[node] = quantified_depths[2 * e + 1] + depth[node] - 1
+                    verdict = verdicts[2 * e]
+                    if verdict is not None and quantified_depths[2 * e] < inf:
+                        outside.append((quantified_depths[2 * e] - depth[parent[node]], position[node],
+                                        (edges_bs[e], verdict[0], 2 * e, verdict[1], bip.side_size(e, 0))))
+                outside.sort(key=lambda entry: entry[0])
+                self.nested_bests[key] = path_best, below, outside
+                Profile.counters['edges'] += 2 * len(bip.edge_bs)
+            return self.nested_bests[key]
+
+        def bootstrap_levels(self, support=0):
+            # (bootstrap, edges) from the highest bootstrap down, edges of a level in tree order
+            if support not in self.levels:
+                levels = {}
+                for e, bs in enumerate(self.bip.support_values(support)):
+                    levels.setdefault(bs, []).append(e)
+                self.levels[support] = sorted(levels.items(), reverse=True)
+            return self.levels[support]
 
-        results['file'] = basename(tree_path)
-        results['taxon'] = seed_taxon
-        results['size'] = tree_size
-        results['crits'] = {}
+    @staticmethod
+    def seed_taxons(tree, file, options):
+        if options.seed_pattern:
+            return [name for name in tree.taxon_names() if options.seed_pattern.match(name)]
+        elif not options.no_seed:
+            return [file[1]]
+        else:
+            # no seed taxon
+            return [None]
 
-        for column, criterium in crit_tree.items():
+    @staticmethod
+    def evaluate_numbered(numbered_file, crit_tree, options, content=None):
+        # (index, file, results, profile, names, digest) of one numbered file entry, profile is None
+        # without --profile, names are taxon names of the parsed tree with --index and digest is the
+        # hash of the evaluated content for --incremental
+        i, file = numbered_file
+        profile = Profile(file, options) if options.profile else None
+        names = [] if options.collect_names else None
+        digest = None
+        if options.hash_files:
+            from treesorter.persistence import Cache
+            if options.stream and content is None:
+                # the file is not read into memory, it is hashed by chunks
+                digest = Cache.file_key(file[0])
+            else:
+                # read once, the same bytes are hashed and evaluated
+                content = Pipeline.read(file[0]) if content is None else content
+                digest = Cache.file_key(file[0], content)
+            if profile:
+                profile.lap('read')
+        results = Critter.evaluate_file(file, crit_tree, options, profile, names, content, digest)
+        return i, file, results, profile and profile.finish(), names or None, digest
 
-            # filter only quantified criteria
-            quantified_criteria = list(filter(lambda taxon_re : taxon_re[0] > 0.0, criterium))
+    @staticmethod
+    def evaluate_file(file, crit_tree, options, profile=None, names=None, content=None, file_key=None):
+        # read, parse and evaluate one [path, seed taxon] file entry, one result per seed taxon,
+        # content is given when the file was already read and its cache key when it was hashed
+        cache = options.cache
+        # best clades of each criterion are cached on their own, whole results of the other modes
+        per_criterion = cache and not (options.all_trees or options.stream or options.sweep)
+        stored = {}
+        if cache:
+            file_key = file_key or cache.file_key(file[0], content)
+            if per_criterion:
+                bests_keys = {column: cache.bests_key(file_key, file, column, criterium, options)
+                              for column, criterium in crit_tree.items()}
+                for column, key in bests_keys.items():
+                    entry = cache.load('bests', key)
+                    if entry is not None:
+                        stored[column] = entry
+                results = Critter.results_from_stored(file[0], crit_tree, stored) \
+                    if stored and len(stored) == len(crit_tree) else None
+            else:
+                results_key = cache.results_key(file_key, file, crit_tree, options)
+                results = cache.load('results', results_key)
+                for res in results or ():
+                    res['file'] = basename(file[0])
+            # taxon names for --index are kept under content of the file, results without them are
+            # evaluated again
+            cached_names = cache.load('names', file_key) if results is not None and names is not None else None
+            if profile:
+                profile.lap('cache')
+            if results is not None and (names is None or cached_names is not None):
+                if names is not None:
+                    names += cached_names
+                return results
+
+        if options.all_trees:
+            results = Critter.evaluate_tree_set(file, crit_tree, options, profile, content)
+        elif options.stream:
+            data, translate = Input.stream_first_tree(file[0], content)
+            if profile:
+                profile.lap('read')
+                profile.trees = 1
+            results = StreamTree(crit_tree, options).results(data, translate, file, names)
+            if profile:
+                profile.lap('evaluate')
+        else:
+            tree = cache.load('trees', file_key) if cache else None
+            if tree is None:
+                data, translate = Input.read_first_tree(file[0], content)
+                if profile:
+                    profile.lap('read')
+                tree = FlatTree(data, translate)
+                if profile:
+                    profile.lap('parse')
+                if cache:
+                    cache.store('trees', file_key, tree)
+            if names is not None:
+                names += tree.taxon_names()
+            if profile:
+                profile.lap('cache')
+                profile.trees = 1
+                Critter.get_match_matrix(tree, crit_tree, options.memo)
+                profile.lap('match')
+            seed_taxons = Critter.seed_taxons(tree, file, options)
+            if options.sweep:
+                results = options.sweep.evaluate(tree, seed_taxons, file[0], options)
+            elif per_criterion:
+                # criteria not in the cache only
+                missing = {column: criterium for column, criterium in crit_tree.items() if column not in stored}
+                seed_bests = Critter.seed_bests(tree, seed_taxons, missing, options) if missing else []
+                for k, column in enumerate(missing):
+                    stored[column] = (seed_taxons, tree.get_bipartitions().n_leaves,
+                                      [bests[k][1] for bests in seed_bests])
+                    cache.store('bests', bests_keys[column], stored[column])
+                results = Critter.results_from_stored(file[0], crit_tree, stored)
+            else:
+                results = Critter.sort_tree_seeds(tree, seed_taxons, crit_tree, file[0], options)
+            if profile:
+                profile.lap('evaluate')
+
+        if cache:
+            if not per_criterion:
+                cache.store('results', results_key, results)
+            if names is not None:
+                cache.store('names', file_key, names)
+            if profile:
+                profile.lap('cache')
+        return results
 
-            for edge in tree.edges:
-                for d in range(2):
-                    taxons = edge.get_subtree_taxons(d)
-                    this_subtree_size = len(taxons)
+    @staticmethod
+    def results_from_stored(tree_path, crit_tree, stored):
+        # results of all seed taxons from (seed taxons, tree size, best of each seed) of every criterion
+        seed_taxons, tree_size, _ = next(iter(stored.values()))
+        return [Critter.result_from_best(tree_path, seed_taxon, tree_size,
+                                         [(column, stored[column][2][k]) for column in crit_tree])
+                for k, seed_taxon in enumerate(seed_taxons)]
 
-                    is_valid, r_t, a_t = Critter.criteria_checker(taxons, criterium, float(Settings.args.tolerance),
-                                                          int(Settings.args.mintaxons), seed=seed_taxon)
+    @staticmethod
+    def criteria_signature(crit_tree):
+        return [(column, [(group[0], [p.source for p in group[1]]) for group in criterium])
+                for column, criterium in crit_tree.items()]
 
-                    if is_valid and nested:
-                        filtered = list(filter(lambda _ : _[1] == 1, taxons))
-                        filtered = [_[0].name for _ in filtered]
-                        # seed taxon is in depth one - right after bipartition
-                        if seed_taxon in filtered:
-                            is_valid = False
+    @staticmethod
+    def evaluate_tree_set(file, crit_tree, options, profile=None, content=None):
+        # every tree of a multi-tree file, results aggregated per seed taxon, with --all-trees the
+        # results of a tree do not carry the highest bootstrap over between criteria
+        supports = {}
+        trees_n = 0
+        stream = StreamTree(crit_tree, options) if options.stream else None
+        for data, translate in Input.iter_trees(file[0], content):
+            if profile:
+                profile.lap('read')
+            trees_n += 1
+            if stream:
+                if profile:
+                    profile.trees = trees_n
+                tree_results = stream.results(data, translate, file)
+            else:
+                tree = FlatTree(data, translate)
+                if profile:
+                    profile.lap('parse')
+                    profile.trees = trees_n
+                    Critter.get_match_matrix(tree, crit_tree, options.memo)
+                    profile.lap('match')
+                seed_taxons = Critter.seed_taxons(tree, file, options)
+                if options.sweep:
+                    tree_results = options.sweep.evaluate(tree, seed_taxons, file[0], options)
+                else:
+                    tree_results = Critter.sort_tree_seeds(tree, seed_taxons, crit_tree, file[0], options)
+            for res in tree_results:
+                key = (res.get('config'), res['taxon'])
+                if key not in supports:
+                    supports[key] = Critter.Support(res['crits'])
+                supports[key].add(res)
+            if profile:
+                profile.lap('evaluate')
+        return [support.result_dict(file[0], seed, trees_n, config) for (config, seed), support in supports.items()]
+
+    class Support:
+        # number of trees with a valid clade for each criterion and their mean highest bootstrap
+        def __init__(self, columns):
+            self.valid = {column: 0 for column in columns}
+            self.bs_sum = {column: 0 for column in columns}
+
+        def add(self, result):
+            for column, crit in result['crits'].items():
+                if crit:
+                    self.valid[column] += 1
+                    self.bs_sum[column] += crit[0]
+
+        def result_dict(self, tree_path, seed_taxon, trees_n, config=None):
+            results = dict()
+            if config is not None:
+                results['config'] = config
+            results['file'] = basename(tree_path)
+            results['taxon'] = seed_taxon
+            results['size'] = trees_n
+            results['crits'] = {}
+            for column, valid in self.valid.items():
+                mean_bs = round(self.bs_sum[column] / valid, 1) if valid else ''
+                results['crits'][column] = (round(valid / trees_n, Settings.relative_tolerance_rounding),
+                                            valid, mean_bs)
+            return results
 
-                    if is_valid and nested:
-                        # find seed taxon, get its depth
-                        found_seed = list(filter(lambda _ : _[0].name == seed_taxon, taxons))
-                        seed_depth = found_seed[0][1]
-                        # filter other taxons with lower depth
-                        lower_depth = list(filter(lambda _ : _[1] <= seed_depth, taxons))
+    @staticmethod
+    def get_match_matrix(tree, crit_tree, memo=None):
+        matrix = tree.match_matrix
+        if matrix is None or matrix.crit_tree is not crit_tree and not matrix.covers(crit_tree):
+            matrix = tree.match_matrix = Critter.MatchMatrix(tree.get_bipartitions(), crit_tree, memo)
+        return matrix
 
-                        any_match = False
-                        for taxon in lower_depth:
-                            for q_crit in quantified_criteria:
-                                for q_crit_re in q_crit[1]:
-                                    if match(q_crit_re, taxon[0].name):
-                                        any_match = True
-                        if not any_match:
-                            is_valid = False
+    @staticmethod
+    def merge_best(a, b):
+        # best of two (bs, r_t, order, a_t, size) candidates: highest bootstrap, then lowest
+        # tolerance first in edge order, size is the smallest one at the highest bootstrap
+        if a is None:
+            return b
+        if b is None or a[0] > b[0]:
+            return a
+        if b[0] > a[0]:
+            return b
+        best = a if (a[1], a[2]) <= (b[1], b[2]) else b
+        return best[0], best[1], best[2], best[3], min(a[4], b[4])
 
+    @staticmethod
+    def sort_tree_seeds(tree, seed_taxons, crit_tree, tree_path, options):
+        # results for all seed taxons of a tree, equal to sort_one_tree_file for each of them
+        tree_size = tree.get_bipartitions().n_leaves
+        return [Critter.result_from_best(tree_path, seed_taxon, tree_size, bests, not options.all_trees)
+                for seed_taxon, bests in zip(seed_taxons, Critter.seed_bests(tree, seed_taxons, crit_tree, options))]
 
+    @staticmethod
+    def seed_bests(tree, seed_taxons, crit_tree, options):
+        # (column, best candidate or None) of every criterion for each seed taxon, without carry over
+        bip = tree.get_bipartitions()
+        if any(len(bip.leaf_ids.get(seed, ())) != 1 for seed in seed_taxons):
+            # duplicate or missing names need the full search
+            return [Critter.column_bests(tree, seed, crit_tree, options) for seed in seed_taxons]
+        if options.nested:
+            return Critter.nested_seed_bests(tree, [bip.leaf_ids[seed][0] for seed in seed_taxons], crit_tree,
+                                             options)
+
+        matrix = Critter.get_match_matrix(tree, crit_tree, options.memo)
+
+        column_best = [(column, matrix.seed_side_bests(column, options.tolerance, options.mintaxons, options.engine))
+                       for column in crit_tree]
+        return [[(column, node_best[bip.leaf_node[bip.leaf_ids[seed_taxon][0]]]) for column, node_best in column_best]
+                for seed_taxon in seed_taxons]
 
-                        # check if at least one passes quantifed criteria
+    @staticmethod
+    def nested_seed_bests(tree, seed_leaves, crit_tree, options):
+        # Like seed_bests for the only copies of nested seed taxons. A side with the seed leaf at
+        # depth k (from the edge) is valid when a taxon passing quantified groups is not deeper.
+        # Clades of edges above the seed node: k shrinks and the depth of the shallowest such taxon
+        # below grows going down, so the valid ones are all edges from the top down to some node,
+        # found by jumps. Complements of other edges: with m the node where the path from the edge
+        # meets the path from the seed to the top, k is seed depth - 2 * depth(m) + depth(parent) + 1.
+        # Edges below the same m are a pre-order range or two, so each complement is checked against
+        # a threshold of m only and all of them are answered at once, thresholds in ascending order.
+        bip = tree.get_bipartitions()
+        matrix = Critter.get_match_matrix(tree, crit_tree, options.memo)
+        merge = Critter.merge_best
+        depth = bip.node_depth
+        parent = bip.node_parent
+        position, end = bip.preorder_ranges
+
+        # (threshold, first position, end position, seed) of the edge ranges of every meeting node,
+        # complements of edges right below the seed node have the seed at depth one
+        queries = []
+        for i, leaf in enumerate(seed_leaves):
+            node = bip.leaf_node[leaf]
+            seed_depth = depth[node]
+            for e in bip.child_edges[node]:
+                child = bip.edge_child[e]
+                queries.append((1 - seed_depth, position[child] + 1, end[child], i))
+            branch = bip.branch_above[node]
+            while branch is not None:
+                meet, child = branch
+                threshold = seed_depth + 1 - 2 * depth[meet]
+                queries.append((threshold, position[meet] + 1, position[child], i))
+                queries.append((threshold, end[child], end[meet], i))
+                branch = bip.branch_above[meet]
+        queries = [query for query in queries if query[1] < query[2]]
+        queries.sort(key=lambda query: query[0])
+
+        bests = [[] for _ in seed_leaves]
+        for column in crit_tree:
+            path_best, below, outside = matrix.nested_side_bests(column, options.tolerance, options.mintaxons,
+                                                                 options.engine)
+            column_bests = []
+            for leaf in seed_leaves:
+                node = bip.leaf_node[leaf]
+                seed_depth = depth[node]
+                above = parent[node]
+                if above >= 0 and below[above] > seed_depth:
+                    for level in reversed(bip.jumps):
+                        if below[level[above]] > seed_depth:
+                            above = level[above]
+                    above = parent[above]
+                column_bests.append(path_best[above] if above >= 0 else None)
+
+            # segment tree over pre-order positions, complements are added as thresholds are reached
+            size = len(depth)
+            segments = [None] * (2 * size)
+            k = 0
+            for threshold, lo, hi, i in queries:
+                while k < len(outside) and outside[k][0] <= threshold:
+                    _, p, candidate = outside[k]
+                    k += 1
+                    p += size
+                    while p:
+                        merged = merge(segments[p], candidate)
+                        if merged == segments[p]:
+                            # ancestors hold it already
+                            break
+                        segments[p] = merged
+                        p >>= 1
+                best = column_bests[i]
+                lo += size
+                hi += size
+                while lo < hi:
+                    if lo & 1:
+                        best = merge(best, segments[lo])
+                        lo += 1
+                    if hi & 1:
+                        hi -= 1
+                        best = merge(best, segments[hi])
+                    lo >>= 1
+                    hi >>= 1
+                column_bests[i] = best
+            for seed_bests, best in zip(bests, column_bests):
+                seed_bests.append((column, best))
+        Profile.counters['edges'] += len(queries) * len(crit_tree)
+        return bests
 
-                    if is_valid:
-                        valid_count += 1
-
-                        if is_valid and edge.bs > highest_bootstrap:
-                            # new best bootstrap
-                            highest_bootstrap = edge.bs
-                            lowest_subtree_size = this_subtree_size
-                            lowest_rel_tolerance_used = r_t
-                            lowest_abs_tolerance_used = a_t
-                        elif edge.bs == highest_bootstrap:
-                            # already at highest bootstrap
-                            if r_t < lowest_rel_tolerance_used:
-                                # can we get a lower tolarance used
-                                lowest_rel_tolerance_used = r_t
-                                lowest_abs_tolerance_used = a_t
-                            lowest_subtree_size = min(lowest_subtree_size, this_subtree_size)
+    @staticmethod
+    def result_from_best(tree_path, seed_taxon, tree_size, bests, carry=True):
+        # result of one seed taxon from (column, best candidate or None) of every criterion,
+        # highest bootstrap carries over between criteria like in sort_one_tree_file
+        results = dict()
+        results['file'] = basename(tree_path)
+        results['taxon'] = seed_taxon
+        results['size'] = tree_size
+        results['crits'] = {}
 
+        carried = {}
+        for column, best in bests:
+            key = Critter.carry_key(column, carry)
+            highest_bootstrap, lowest_rel_tolerance_used, lowest_abs_tolerance_used, lowest_subtree_size, \
+                valid_count = carried.get(key, (-1, 1.0, 10e6, tree_size, 0))
+            if best is not None:
+                bs, r_t, _, a_t, this_subtree_size = best
+                valid_count += 1
+                if bs > highest_bootstrap:
+                    highest_bootstrap = bs
+                    lowest_subtree_size = this_subtree_size
+                    lowest_rel_tolerance_used = r_t
+                    lowest_abs_tolerance_used = a_t
+                elif bs == highest_bootstrap:
+                    if r_t < lowest_rel_tolerance_used:
+                        lowest_rel_tolerance_used = r_t
+                        lowest_abs_tolerance_used = a_t
+                    lowest_subtree_size = min(lowest_subtree_size, this_subtree_size)
+            carried[key] = (highest_bootstrap, lowest_rel_tolerance_used, lowest_abs_tolerance_used,
+                            lowest_subtree_size, valid_count)
 
             if valid_count > 0:
                 results['size'] = lowest_subtree_size
-                results['crits'][column] = (highest_bootstrap, lowest_rel_tolerance_used, lowest_abs_tolerance_used)
-                pass
+                results['crits'][column] = (Critter.support_value(highest_bootstrap), lowest_rel_tolerance_used,
+                                            lowest_abs_tolerance_used)
             else:
                 results['size'] = ''
                 results['crits'][column] = None
-                pass
-
         return results
 
+    @staticmethod
+    def support_value(bs):
+        # one decimal label makes all supports of a tree floats, whole values are kept like integer labels
+        return int(bs) if isinstance(bs, float) and bs.is_integer() else bs
+
+    @staticmethod
+    def carry_key(column, carry=True):
+        # criteria with equal key share the highest bootstrap found so far, that is criteria ranking
+        # by the same support value, as values like SH-aLRT and UFBoot have different scales. Without
+        # carry over (--all-trees counts trees with a valid clade) every criterion stands on its own.
+        return Critter.support_index(column) if carry else column
+
+    @staticmethod
+    def sort_one_tree_file(tree, seed_taxon, crit_tree, tree_path, options=None):
+        if options is None:
+            options = Options.from_args(Settings.args) if Settings.args else Options()
+        bests = Critter.column_bests(tree, seed_taxon, crit_tree, options)
+        return Critter.result_from_best(tree_path, seed_taxon, tree.get_bipartitions().n_leaves, bests,
+                                        not options.all_trees)
+
+    @staticmethod
+    def column_bests(tree, seed_taxon, crit_tree, options):
+        # (column, best candidate or None) of every criterion for one seed taxon, searched side by side
+        bip = tree.get_bipartitions()
+        nested = options.nested
+        tolerance = options.tolerance
+        minimum = options.mintaxons
+        merge = Critter.merge_best
+
+        seed_leaves = bip.leaf_ids.get(seed_taxon, ()) if seed_taxon else ()
+        matrix = Critter.get_match_matrix(tree, crit_tree, options.memo)
+        pruned = options.search == 'pruned'
+
+        bests = []
+        for column, criterium in crit_tree.items():
+            best = None
+            # smallest depth of taxons passing any quantified criteria on each side
+            quantified_depths = matrix.quantified_depths(column) if nested else None
+            support = Critter.support_index(column)
+            edges_bs = bip.support_values(support)
+            if pruned:
+                # Edges from the highest bootstrap down, verdicts only for sides with the seed.
+                # Only valid sides at the highest valid bootstrap make the best candidate, so the
+                # search stops there.
+                levels = matrix.bootstrap_levels(support)
+            else:
+                levels = [(None, range(len(edges_bs)))]
+            if pruned and options.engine == 'python':
+                verdicts = None
+            else:
+                verdicts = matrix.side_verdicts(column, tolerance, minimum, options.engine)
+
+            for _, level_edges in levels:
+                Profile.counters['edges'] += len(level_edges)
+                for e in level_edges:
+                    for d in range(2):
+                        if seed_taxon and bip.first_in_side(e, d, seed_leaves) is None:
+                            # seed taxon not in this subtree, not a valid tree
+                            continue
+
+                        if verdicts is None:
+                            verdict = matrix.side_verdict(column, tolerance, minimum, e, d)
+                        else:
+                            verdict = verdicts[2 * e + d]
+                        if verdict is None:
+                            continue
+
+                        if nested:
+                            # every copy of a duplicate seed name, depth of the first one reached
+                            seed_depths = bip.seed_depths(e, d, seed_leaves)
+                            # seed taxon is in depth one - right after bipartition
+                            if 1 in seed_depths:
+                                continue
+                            # at least one taxon passing quantified criteria not deeper than seed taxon
+                            if quantified_depths[2 * e + d] > seed_depths[0]:
+                                continue
+
+                        r_t, a_t = verdict
+                        best = merge(best, (edges_bs[e], r_t, 2 * e + d, a_t, bip.side_size(e, d)))
+
+                if pruned and best is not None:
+                    # no lower bootstrap can beat a valid side of this level
+                    break
+            bests.append((column, best))
+        return bests
+
 
 class Input:
+    statement_re = re_compile(rb"[\[\];]")
+    tree_scan_re = re_compile(rb"[\[\];(]")
+    keyword_re = re_compile(rb"(?:\s|\[[^\]]*])*(\w*)")
+    tree_start_re = re_compile(rb"\(")
+    nexus_re = re_compile(rb"\s*#NEXUS", IGNORECASE)
+    compressed_extensions = [".gz", ".xz", ".zst"]
+    # bytes read from compressed files at once
+    chunk_size = 1 << 20
+
     @staticmethod
     def read_tree_file(path):
-        with open(path, 'r') as f:
-            line = f.readline().rstrip()
-            if line[:6] == "#NEXUS":
-                # preparse nexus format
-                begin = False
-                for line in f.readlines():
-                    line = line.rstrip()
-                    if begin:
-                        data = line[line.find('('):]
-                        data = sub('\d\.\d+E-\d+', '10.0', data)
-                        data = sub('\[&label=(\d+)]', '\\1', data)
-                        break
-                    if line[:12] == "begin trees;":
-                        begin = True
+        # first tree of the file only, as string
+        return bytes(Input.read_first_tree(path)[0]).decode()
+
+    @staticmethod
+    def read_first_tree(path, content=None):
+        # (newick buffer, translate table or None) of the first tree of the file
+        for data, translate in Input.iter_trees(path, content):
+            return data, translate
+        return b'', None
+
+    @staticmethod
+    def iter_trees(path, content=None):
+        # Yields (newick buffer, translate table or None) for every tree of a newick or nexus
+        # file. Plain files are memory mapped and trees are yielded as memoryview slices
+        # of the map, compressed files are streamed one statement at a time. Content of the
+        # file can be given when it was already read.
+        statements = Input.iter_file_statements(path, content)
+        first = next(statements, None)
+        if first is None:
+            return
+        header = Input.nexus_re.match(first)
+        if not header:
+            for statement in chain([first], statements):
+                if Input.tree_start_re.search(statement):
+                    yield statement, None
+            return
+
+        in_trees = False
+        translate = None
+        for statement in chain([first[header.end():]], statements):
+            m = Input.keyword_re.match(statement)
+            keyword = m.group(1).lower()
+            if keyword == b'begin':
+                in_trees = bytes(statement[m.end():]).strip().lower() == b'trees'
+            elif keyword in (b'end', b'endblock'):
+                in_trees = False
+                translate = None
+            elif in_trees and keyword == b'translate':
+                translate = Input.parse_translate(bytes(statement[m.end():]).decode())
+            elif in_trees and keyword == b'tree':
+                start = Input.tree_start_re.search(statement)
+                if start:
+                    yield statement[start.start():], translate
+
+    @staticmethod
+    def stream_first_tree(path, content=None):
+        # (newick data, translate table or None) of the first tree like read_first_tree, for
+        # compressed files data is a function giving the decompressed chunks from the opening
+        # bracket of the tree on, so the tree statement is never joined in memory
+        ext = next((ext for ext in Input.compressed_extensions if path[-len(ext):] == ext), None)
+        if ext is None:
+            return Input.read_first_tree(path, content)
+
+        def decompressed():
+            with Input.open_compressed(BytesIO(content) if content is not None else path, ext) as f:
+                yield from iter(lambda: f.read(Input.chunk_size), b'')
+
+        offset, translate = Input.locate_first_tree(decompressed())
+        if offset is None:
+            return b'', None
+
+        def chunks():
+            position = 0
+            for chunk in decompressed():
+                if position + len(chunk) > offset:
+                    yield chunk[max(offset - position, 0):]
+                position += len(chunk)
+        return chunks, translate
+
+    @staticmethod
+    def locate_first_tree(chunks):
+        # (offset of the opening bracket, translate table or None) of the first tree in byte chunks,
+        # statements before it are read like in iter_trees, the tree statement only up to the bracket
+        statement = []
+        comment_depth = 0
+        position = 0
+        nexus = None
+        in_trees = False
+        translate = None
+        for chunk in chunks:
+            start = 0
+            for m in Input.tree_scan_re.finditer(chunk):
+                c = m.group()
+                if c == b'[':
+                    comment_depth += 1
+                elif c == b']':
+                    comment_depth -= 1
+                elif comment_depth:
+                    continue
+                elif c == b'(':
+                    head = b''.join(statement) + chunk[start:m.start()]
+                    header = Input.nexus_re.match(head) if nexus is None else None
+                    if not (nexus or header):
+                        # newick, the first statement with a bracket is the tree
+                        return position + m.start(), None
+                    if in_trees and Input.keyword_re.match(head).group(1).lower() == b'tree':
+                        return position + m.start(), translate
+                else:
+                    text = b''.join(statement) + chunk[start:m.start()]
+                    statement = []
+                    start = m.end()
+                    if nexus is None:
+                        if not text.strip():
+                            continue
+                        header = Input.nexus_re.match(text)
+                        nexus = bool(header)
+                        if header:
+                            text = text[header.end():]
+                    if not nexus:
                         continue
+                    k = Input.keyword_re.match(text)
+                    keyword = k.group(1).lower()
+                    if keyword == b'begin':
+                        in_trees = text[k.end():].strip().lower() == b'trees'
+                    elif keyword in (b'end', b'endblock'):
+                        in_trees = False
+                        translate = None
+                    elif in_trees and keyword == b'translate':
+                        translate = Input.parse_translate(text[k.end():].decode())
+            statement.append(chunk[start:])
+            position += len(chunk)
+        return None, None
 
-            else:
-                data = line
-        return data
+    @staticmethod
+    def iter_file_statements(path, content=None):
+        # ';' terminated statements of a file, #NEXUS header comes as a statement of its own
+        for ext in Input.compressed_extensions:
+            if path[-len(ext):] == ext:
+                with Input.open_compressed(BytesIO(content) if content is not None else path, ext) as f:
+                    # fixed-size chunks, a tree on one line is not read as a whole line and the
+                    # zstandard reader can not be iterated by lines
+                    yield from Input.iter_statements(iter(lambda: f.read(Input.chunk_size), b''))
+                return
+
+        if content is not None:
+            buffer = content
+        else:
+            with open(path, 'rb') as f:
+                try:
+                    buffer = mmap(f.fileno(), 0, access=ACCESS_READ)
+                except ValueError:
+                    # empty file can not be mapped
+                    return
+        view = memoryview(buffer)
+        start = 0
+        comment_depth = 0
+        for m in Input.statement_re.finditer(buffer):
+            c = m.group()
+            if c == b'[':
+                comment_depth += 1
+            elif c == b']':
+                comment_depth -= 1
+            elif comment_depth == 0:
+                yield view[start:m.start()]
+                start = m.end()
+        if start < len(buffer) and bytes(view[start:]).strip():
+            yield view[start:]
+
+    @staticmethod
+    def open_compressed(path, ext):
+        # path can be a file object too
+        if ext == ".gz":
+            import gzip
+            return gzip.open(path, 'rb')
+        elif ext == ".xz":
+            import lzma
+            return lzma.open(path, 'rb')
+        try:
+            import zstandard
+        except ImportError:
+            exit(f"Reading {path} requires the zstandard package (pip install zstandard)")
+        return zstandard.open(path, 'rb')
+
+    @staticmethod
+    def iter_statements(chunks):
+        # ';' terminated statements from byte chunks split anywhere, semicolons inside [] comments are skipped
+        buffer = []
+        comment_depth = 0
+        for chunk in chunks:
+            start = 0
+            for m in Input.statement_re.finditer(chunk):
+                c = m.group()
+                if c == b'[':
+                    comment_depth += 1
+                elif c == b']':
+                    comment_depth -= 1
+                elif comment_depth == 0:
+                    buffer.append(chunk[start:m.start()])
+                    yield b''.join(buffer)
+                    buffer = []
+                    start = m.end()
+            buffer.append(chunk[start:])
+        rest = b''.join(buffer)
+        if rest.strip():
+            yield rest
+
+    @staticmethod
+    def parse_translate(data):
+        # "1 name_a, 2 name_b, ..." to dictionary
+        translate = {}
+        for pair in data.split(','):
+            pair = pair.split(None, 1)
+            if len(pair) == 2:
+                translate[pair[0]] = pair[1].strip().strip("'\"")
+        return translate
 
     @staticmethod
     def get_file_list(args):
+        files = Input.list_files(args)
+
+        missing_files = 0
+        for file in files:
+            if not isfile(file[0]):
+                missing_files += 1
+                print(f"File '{file[0]}' does not exist")
+        if missing_files > 0:
+            exit(f"EXIT: There were {missing_files} non-existent files.")
+
+        return files
+
+    @staticmethod
+    def list_files(args):
         # filename and root taxon
         if args.directory:
             files = Input.get_files_in_dir(args.directory[0])
@@ -374,15 +1788,6 @@ class Input:
             files = [[f, Input.strip_name_to_taxon(f)] for f in args.files]
         else:
             exit("No source of tree files specified.")
-
-        missing_files = 0
-        for file in files:
-            if not isfile(file[0]):
-                missing_files += 1
-                print(f"File '{file[0]}' does not exist")
-        if missing_files > 0:
-            exit(f"EXIT: There were {missing_files} non-existent files.")
-
         return files
 
     @staticmethod
@@ -417,10 +1822,16 @@ class Input:
         files_unfiltered = listdir(tree_dir)
         files = []
         for name in files_unfiltered:
-            for ext in Settings.allowed_extensions:
+            # compressed files (x.tre.gz) are matched by the extension under the compression
+            stripped = name
+            for ext in Input.compressed_extensions:
                 if name[-len(ext):] == ext:
+                    stripped = name[:-len(ext)]
+                    break
+            for ext in Settings.allowed_extensions:
+                if stripped[-len(ext):] == ext:
                     files.append(name)
-                    continue
+                    break
 
         files = [tree_dir + _ for _ in files]
         return files
@@ -438,9 +1849,61 @@ class PTree:
         self.edges = []
         self.taxons = []
         self.nodes = []
-    def parse_file(self, data):
+        self.bipartitions = None
+        self.match_matrix = None
+
+    def get_bipartitions(self):
+        # index is built once per tree and reused for every criterion and seed
+        if self.bipartitions is None:
+            self.bipartitions = self.Bipartitions(self)
+        return self.bipartitions
+
+    def parse_file(self, data, translate=None):
+        # parse into flat arrays, then build the object graph from them
+        self.build_from_flat(FlatTree(data, translate))
+
+    def build_from_flat(self, flat):
+        self.nodes = [self.Node() for _ in flat.node_parent]
+        for e, parent in enumerate(flat.edge_parent):
+            edge = self.Edge()
+            edge.bs = flat.edge_bs[e]
+            edge.supports = [values[e] for values in flat.edge_supports]
+            edge.length = flat.optional(flat.edge_length[e])
+            edge.nodes[0] = self.nodes[parent]
+            edge.nodes[1] = self.nodes[e + 1]
+            self.edges.append(edge)
+        for leaf, name in enumerate(flat.leaf_names):
+            taxon = self.Taxon(name)
+            taxon.length = flat.optional(flat.leaf_length[leaf])
+            taxon.edge = self.nodes[flat.leaf_node[leaf]]
+            self.taxons.append(taxon)
+        if flat.root is not None:
+            self.root = self.taxons[flat.root]
+
+        # fill node slots in order of appearance, parent edge first
+        for node, items in enumerate(flat.node_items):
+            slot = 0
+            if node > 0:
+                self.nodes[node].edges[0] = self.edges[node - 1]
+                slot = 1
+            if slot + len(items) > 3:
+                # polytomy
+                self.nodes[node].edges += [None] * (slot + len(items) - 3)
+            for is_edge, i in items:
+                self.nodes[node].edges[slot] = self.edges[i] if is_edge else self.taxons[i]
+                slot += 1
+        # flat arrays number leaves in order of appearance, so they are the bipartition index too
+        self.bipartitions = flat
+
+    def taxon_names(self):
+        return [taxon.name for taxon in self.taxons]
+
+    def parse_file_recursive(self, data):
+        # original recursive parser, kept as reference for the benchmark
         # start building tree from data
         # get root taxon name from the start
+        data = sub(r'\d\.\d+E-\d+', '10.0', data)
+        data = sub(r'\[&label=(\d+)]', '\\1', data)
         data = data.rstrip()[1:-2]
         data = sub(r':[0-9]+\.[0-9]*', '', data)
 
@@ -543,13 +2006,17 @@ class PTree:
         def __init__(self, name):
             self.name = name
             self.edge = None
+            self.length = None
 
     # noinspection PyTypeChecker
     class Edge:
         def __init__(self):
             self.bs = None
+            # all support values of the edge label, bs is the first one
+            self.supports = []
             self.nodes = [None, None]
             self.depth = 0
+            self.length = None
 
         def get_other_node(self, node):
             if self.nodes[0] == node:
@@ -580,9 +2047,701 @@ class PTree:
     class Node:
         def __init__(self):
             self.edges = [None, None, None]
+            self.index = None
+
+    class Bipartitions:
+        # Leaves are numbered so that the taxons below every node form one contiguous
+        # range [lo, hi). Side 1 of an edge is the range of its lower node, side 0 is
+        # the complement. Depths are counted in nodes from the edge, like
+        # Edge.get_subtree_taxons does. FlatTree shares the methods and is its own index.
+        def __init__(self, tree):
+            # Index of an object tree. Trees of parse_file are built from a FlatTree and use it
+            # instead, this is reached only by trees of parse_file_recursive, the benchmark reference.
+            self.leaves = []
+            self.leaf_ids = {}
+            self.leaf_depth = []
+            self.leaf_node = []
+            n_nodes = len(tree.nodes)
+            self.node_parent = [-1] * n_nodes
+            self.node_depth = [0] * n_nodes
+            self.node_lo = [0] * n_nodes
+            self.node_hi = [0] * n_nodes
+
+            for i, node in enumerate(tree.nodes):
+                node.index = i
+
+            # pre-order: parents, depths, leaf numbering and range starts
+            order = []
+            stack = [(tree.nodes[0], -1, 1)]
+            while stack:
+                node, parent, depth = stack.pop()
+                i = node.index
+                order.append(i)
+                self.node_parent[i] = parent
+                self.node_depth[i] = depth
+                self.node_lo[i] = len(self.leaves)
+                children = []
+                for obj in (node.edges if parent < 0 else node.edges[1:]):
+                    if isinstance(obj, PTree.Taxon):
+                        self.leaf_ids.setdefault(obj.name, []).append(len(self.leaves))
+                        self.leaves.append(obj)
+                        self.leaf_depth.append(depth)
+                        self.leaf_node.append(i)
+                    elif isinstance(obj, PTree.Edge):
+                        children.append(obj.nodes[1])
+                self.node_hi[i] = len(self.leaves)
+                for child in reversed(children):
+                    stack.append((child, i, depth + 1))
+
+            # post-order: range ends
+            for i in reversed(order):
+                parent = self.node_parent[i]
+                if parent >= 0 and self.node_hi[i] > self.node_hi[parent]:
+                    self.node_hi[parent] = self.node_hi[i]
+            self.order = order
+            self.n_leaves = len(self.leaves)
+
+            self.edge_parent = [edge.nodes[0].index for edge in tree.edges]
+            self.edge_child = [edge.nodes[1].index for edge in tree.edges]
+            self.edge_bs = [edge.bs for edge in tree.edges]
+            n_supports = max([len(edge.supports) for edge in tree.edges] + [1])
+            self.edge_supports = [self.edge_bs] + [[edge.supports[k] if k < len(edge.supports) else 1
+                                                    for edge in tree.edges] for k in range(1, n_supports)]
+            self.leaf_names = [taxon.name for taxon in self.leaves]
+            # edge leading to each node from above, -1 for the top node
+            self.node_edge = [-1] * n_nodes
+            for e, child in enumerate(self.edge_child):
+                self.node_edge[child] = e
+
+        def support_values(self, k):
+            # k-th support value of every edge, 1 where the edge has fewer values like unlabelled edges
+            if k < len(self.edge_supports):
+                return self.edge_supports[k]
+            return [1] * len(self.edge_bs)
+
+        def child_range(self, e):
+            # leaf range of the lower node, side 0 is everything outside of it
+            child = self.edge_child[e]
+            return self.node_lo[child], self.node_hi[child]
+
+        def side_size(self, e, d):
+            lo, hi = self.child_range(e)
+            return hi - lo if d % 2 else self.n_leaves - (hi - lo)
+
+        def side_contains(self, e, d, leaf):
+            lo, hi = self.child_range(e)
+            return (lo <= leaf < hi) == bool(d % 2)
+
+        def first_in_side(self, e, d, leaves):
+            # first of given leaves (e.g. all taxons of one name) on side d, None if there is none
+            for leaf in leaves:
+                if self.side_contains(e, d, leaf):
+                    return leaf
+            return None
+
+        @cached_property
+        def child_edges(self):
+            # edges to the children of every node
+            child_edges = [[] for _ in self.node_depth]
+            for e, parent in enumerate(self.edge_parent):
+                child_edges[parent].append(e)
+            return child_edges
+
+        @cached_property
+        def preorder_ranges(self):
+            # (position in pre-order, end of the subtree's positions) of every node
+            position = [0] * len(self.node_depth)
+            for k, node in enumerate(self.order):
+                position[node] = k
+            end = [k + 1 for k in position]
+            for node in reversed(self.order):
+                parent = self.node_parent[node]
+                if parent >= 0 and end[node] > end[parent]:
+                    end[parent] = end[node]
+            return position, end
+
+        @cached_property
+        def jumps(self):
+            # ancestors 1, 2, 4, ... levels up of every node, the top node is its own ancestor
+            level = [node if parent < 0 else parent for node, parent in enumerate(self.node_parent)]
+            jumps = [level]
+            for _ in range(max(self.node_depth).bit_length()):
+                level = [level[node] for node in level]
+                jumps.append(level)
+            return jumps
+
+        @cached_property
+        def branch_above(self):
+            # (nearest ancestor with more than one child node, its child on the way down) of every node
+            branch_above = [None] * len(self.node_depth)
+            for node in self.order:
+                parent = self.node_parent[node]
+                if parent >= 0:
+                    branch_above[node] = (parent, node) if len(self.child_edges[parent]) > 1 \
+                        else branch_above[parent]
+            return branch_above
+
+        def meet(self, node, leaf):
+            # lowest node above both the node and the leaf, found by jumps
+            depth = self.node_depth
+            other = self.leaf_node[leaf]
+            if depth[node] < depth[other]:
+                node, other = other, node
+            diff = depth[node] - depth[other]
+            k = 0
+            while diff:
+                if diff & 1:
+                    node = self.jumps[k][node]
+                diff >>= 1
+                k += 1
+            if node == other:
+                return node
+            for level in reversed(self.jumps):
+                if level[node] != level[other]:
+                    node, other = level[node], level[other]
+            return self.node_parent[node]
+
+        def seed_depths(self, e, d, leaves):
+            # Depths of given leaves (e.g. all taxons of one name) on side d, in the order
+            # Edge.get_subtree_taxons reaches them: leaf order below the edge, above it leaves whose
+            # path meets the path to the top higher up come first.
+            found = []
+            lo, hi = self.child_range(e)
+            parent = self.edge_parent[e]
+            for leaf in leaves:
+                if (lo <= leaf < hi) != bool(d % 2):
+                    continue
+                if d % 2:
+                    found.append(((0, leaf), self.leaf_depth[leaf] - self.node_depth[self.edge_child[e]] + 1))
+                    continue
+                meet = self.meet(parent, leaf)
+                depth = self.leaf_depth[leaf] - 2 * self.node_depth[meet] + self.node_depth[parent] + 1
+                found.append(((self.node_depth[meet], leaf), depth))
+            found.sort()
+            return [depth for _, depth in found]
+
+
+class FlatTree(PTree.Bipartitions):
+    # Tree kept in flat arrays instead of objects. Nodes are numbered in pre-order and
+    # edge e leads to node e + 1. Leaves are numbered in order of appearance, so taxons
+    # below every node form a contiguous range and the tree is its own bipartition index.
+    token_pattern = r"\s*(?:(\()|(\))|(,)|(;)|\[([^\]]*)]|:\s*([^,():;\[\s]*)|([^,():;\[\]]+))"
+    token_re = re_compile(token_pattern)
+    token_re_bytes = re_compile(token_pattern.encode())
+
+    def __init__(self, data, translate=None):
+        self.node_parent = array('l')
+        self.node_depth = array('l')
+        self.node_lo = array('l')
+        self.node_hi = array('l')
+        self.edge_parent = array('l')
+        self.edge_bs = array('l')
+        self.edge_length = array('d')
+        self.leaf_node = array('l')
+        self.leaf_depth = array('l')
+        self.leaf_length = array('d')
+        self.leaf_names = []
+        self.leaf_ids = {}
+        self.root = None
+        self.match_matrix = None
+        # support values of edges, edge_bs is the first one
+        self.edge_supports = [self.edge_bs]
+        self.parse(data, translate)
+
+        n_nodes = len(self.node_parent)
+        self.n_leaves = len(self.leaf_names)
+        self.order = range(n_nodes)
+        self.edge_child = range(1, n_nodes)
+        self.node_edge = range(-1, n_nodes - 1)
+
+    def parse(self, data, translate):
+        # Single pass over the newick data, open subtrees are kept on an explicit stack.
+        # Data can be str or any bytes-like buffer (bytes, mmap, memoryview), tokens are
+        # matched in place.
+        is_bytes = not isinstance(data, str)
+        token_re = self.token_re_bytes if is_bytes else self.token_re
+        label_prefix = b'&label=' if is_bytes else '&label='
+        nan = float('nan')
+        # (value number, edge, value) of second and further support values
+        extra_supports = []
+        # edges of the top node with a support label
+        top_labelled = set()
+        stack = []
+        # element (leaf or closed edge) that following label, comment or length belong to
+        last = -1
+        last_is_edge = False
+        after_close = False
+        i = 0
+        while True:
+            m = token_re.match(data, i)
+            if m is None:
+                if stack:
+                    raise ValueError(f"Unexpected character or end of newick tree at position {i}")
+                raise ValueError("No newick tree found in data")
+            i = m.end()
+            kind = m.lastindex
+            if kind == 1:
+                # new subtree, every node except the top one comes with an edge
+                if stack:
+                    parent = stack[-1]
+                    self.edge_parent.append(parent)
+                    self.edge_bs.append(1)
+                    self.edge_length.append(nan)
+                    self.node_depth.append(self.node_depth[parent] + 1)
+                else:
+                    parent = -1
+                    self.node_depth.append(1)
+                stack.append(len(self.node_parent))
+                self.node_parent.append(parent)
+                self.node_lo.append(len(self.leaf_names))
+                self.node_hi.append(0)
+                last = -1
+                after_close = False
+            elif kind == 2:
+                if not stack:
+                    raise ValueError(f"Unbalanced brackets in newick tree at position {i}")
+                node = stack.pop()
+                self.node_hi[node] = len(self.leaf_names)
+                if not stack:
+                    # end of the whole tree
+                    self.set_root_supports(top_labelled, extra_supports)
+                    self.set_extra_supports(extra_supports)
+                    break
+                # identical sequences not bearing any information, bootstrap stays 1
+                last = node - 1
+                last_is_edge = True
+                after_close = True
+            elif kind == 3:
+                last = -1
+                after_close = False
+            elif kind == 4:
+                if stack:
+                    raise ValueError(f"Unbalanced brackets in newick tree at position {i}")
+                raise ValueError("No newick tree found in data")
+            elif kind == 5:
+                # comment, IQ-TREE keeps support values as [&label=...]
+                comment = m.group(5)
+                if after_close and comment[:7] == label_prefix:
+                    if len(stack) == 1:
+                        top_labelled.add(last)
+                    label = comment[7:]
+                    try:
+                        self.edge_bs[last] = int(label)
+                    except ValueError:
+                        self.set_support(last, label.decode() if is_bytes else label, extra_supports)
+            elif kind == 6:
+                # branch length, scientific notation included
+                if last >= 0 and m.group(6):
+                    lengths = self.edge_length if last_is_edge else self.leaf_length
+                    lengths[last] = float(m.group(6))
+            else:
+                label = m.group(7)
+                if is_bytes:
+                    label = label.decode()
+                label = label.strip()
+                if after_close:
+                    # support value of the closed subtree
+                    if len(stack) == 1:
+                        top_labelled.add(last)
+                    try:
+                        self.edge_bs[last] = int(label)
+                    except ValueError:
+                        self.set_support(last, label, extra_supports)
+                    after_close = False
+                elif stack:
+                    if translate:
+                        label = translate.get(label, label)
+                    label = intern(label)
+                    last = len(self.leaf_names)
+                    last_is_edge = False
+                    if not self.leaf_names and len(self.node_parent) == 1:
+                        # first element of the top node
+                        self.root = last
+                    self.leaf_ids.setdefault(label, []).append(last)
+                    self.leaf_names.append(label)
+                    self.leaf_node.append(stack[-1])
+                    self.leaf_depth.append(self.node_depth[stack[-1]])
+                    self.leaf_length.append(nan)
+
+    @staticmethod
+    def parse_support(label):
+        # Values of a support label: decimal support like posterior 0.98, or several values
+        # like SH-aLRT/UFBoot 85.3/100. None where a value is missing.
+        values = []
+        for value in label.strip("'\"").split('/'):
+            value = value.strip()
+            if not value:
+                values.append(None)
+                continue
+            try:
+                values.append(int(value))
+            except ValueError:
+                try:
+                    values.append(float(value))
+                except ValueError:
+                    raise ValueError(f"Support value {label} of an edge is not a number")
+        return values
+
+    def set_support(self, e, label, extra_supports):
+        # label other than a plain integer, values after the first one are collected for the end of parsing
+        for k, value in enumerate(FlatTree.parse_support(label)):
+            if value is None:
+                # missing value stays 1
+                continue
+            if k > 0:
+                extra_supports.append((k, e, value))
+                continue
+            if isinstance(value, float) and self.edge_bs.typecode == 'l':
+                self.edge_bs = self.edge_supports[0] = array('d', self.edge_bs)
+            self.edge_bs[e] = value
+
+    def set_root_supports(self, top_labelled, extra_supports):
+        # Rooted tree: two subtrees of the top node split the leaves the same way, but usually only
+        # one of their edges is labelled. The other one gets the same support values instead of 1.
+        if len(top_labelled) != 1 or self.leaf_node.count(0) or self.edge_parent.count(0) != 2:
+            return
+        first = self.edge_parent.index(0)
+        second = self.edge_parent.index(0, first + 1)
+        labelled = first if first in top_labelled else second
+        other = second if labelled == first else first
+        self.edge_bs[other] = self.edge_bs[labelled]
+        extra_supports += [(k, other, value) for k, e, value in extra_supports if e == labelled]
+
+    def set_extra_supports(self, extra_supports):
+        for k, e, value in extra_supports:
+            while k >= len(self.edge_supports):
+                self.edge_supports.append(array('l', [1]) * len(self.edge_bs))
+            if isinstance(value, float) and self.edge_supports[k].typecode == 'l':
+                self.edge_supports[k] = array('d', self.edge_supports[k])
+            self.edge_supports[k][e] = value
+
+    @staticmethod
+    def optional(length):
+        return None if isnan(length) else length
+
+    def get_bipartitions(self):
+        return self
+
+    def taxon_names(self):
+        return self.leaf_names
+
+    def nbytes(self):
+        # approximate memory held by the tree, for memory limits
+        arrays = sum(value.itemsize * len(value) for value in self.__dict__.values() if isinstance(value, array))
+        arrays += sum(values.itemsize * len(values) for values in self.edge_supports[1:])
+        return arrays + sum(getsizeof(name) + 100 for name in self.leaf_names)
+
+    # derived from the arrays on first use, not stored with the tree
+    derived = ('node_items', 'taxons', 'edges', 'nodes', 'child_edges', 'preorder_ranges', 'jumps', 'branch_above')
+
+    def __getstate__(self):
+        # match matrix depends on criteria, it is not stored with the tree
+        state = self.__dict__.copy()
+        state['match_matrix'] = None
+        for name in FlatTree.derived:
+            state.pop(name, None)
+        return state
+
+    @cached_property
+    def node_items(self):
+        # (is edge, index) of elements hanging below each node, in order of appearance
+        items = [[] for _ in self.node_parent]
+        for leaf, node in enumerate(self.leaf_node):
+            items[node].append((leaf, 1, False, leaf))
+        for e, node in enumerate(self.edge_parent):
+            items[node].append((self.node_lo[e + 1], 0, True, e))
+        return [[(is_edge, i) for _, _, is_edge, i in sorted(node_items)] for node_items in items]
+
+    # thin views for code expecting PTree objects, built once per tree
+    @cached_property
+    def taxons(self):
+        return tuple(FlatTree.Taxon(self, i) for i in range(self.n_leaves))
+
+    @cached_property
+    def edges(self):
+        return tuple(FlatTree.Edge(self, e) for e in range(len(self.edge_parent)))
+
+    @cached_property
+    def nodes(self):
+        return tuple(FlatTree.Node(self, n) for n in range(len(self.node_parent)))
+
+    class View:
+        __slots__ = ('tree', 'index')
+
+        def __init__(self, tree, index):
+            self.tree = tree
+            self.index = index
+
+        def __eq__(self, other):
+            return type(self) is type(other) and self.tree is other.tree and self.index == other.index
+
+        def __hash__(self):
+            return hash((type(self), id(self.tree), self.index))
+
+    class Taxon(View):
+        __slots__ = ()
+
+        @property
+        def name(self):
+            return self.tree.leaf_names[self.index]
+
+        @property
+        def length(self):
+            return self.tree.optional(self.tree.leaf_length[self.index])
+
+        @property
+        def edge(self):
+            # node the taxon hangs on, like PTree.Taxon.edge
+            return self.tree.nodes[self.tree.leaf_node[self.index]]
+
+    class Edge(View):
+        __slots__ = ()
+
+        @property
+        def bs(self):
+            return self.tree.edge_bs[self.index]
+
+        @property
+        def supports(self):
+            return [values[self.index] for values in self.tree.edge_supports]
+
+        @property
+        def length(self):
+            return self.tree.optional(self.tree.edge_length[self.index])
+
+        @property
+        def nodes(self):
+            nodes = self.tree.nodes
+            return [nodes[self.tree.edge_parent[self.index]], nodes[self.index + 1]]
+
+    class Node(View):
+        __slots__ = ()
+
+        @property
+        def edges(self):
+            tree = self.tree
+            edges = [] if self.index == 0 else [tree.edges[self.index - 1]]
+            for is_edge, i in tree.node_items[self.index]:
+                edges.append(tree.edges[i] if is_edge else tree.taxons[i])
+            return edges
+
+
+
+class StreamTree:
+    # --stream: evaluation of huge trees in bounded memory, without keeping the tree. The newick
+    # data is tokenized twice. The first pass counts leaves, leaves matching each criterion group
+    # and copies of the seed taxon. The second pass keeps counts of every open node on a stack,
+    # adds them to the parent when the node closes and checks both sides of its edge right away,
+    # the outer side as totals minus the node. Only the best candidate of each criterion is kept,
+    # compared like in sort_tree_seeds, so results equal the other search modes. Memory is
+    # O(tree depth * criterion groups). Nested evaluation and seed patterns need the whole tree.
+    def __init__(self, crit_tree, options):
+        self.crit_tree = crit_tree
+        self.options = options
+        # (column, criterium, support index, offset of its groups in count vectors)
+        self.columns = []
+        width = 0
+        for column, criterium in crit_tree.items():
+            self.columns.append((column, criterium, Critter.support_index(column), width))
+            # group counts and count of taxons passing any group
+            width += len(criterium) + 1
+        self.width = width
+
+    @staticmethod
+    def tokens(data, translate=None):
+        # yields ('open' | 'close' | 'leaf' | 'support', value) of newick data, lengths are skipped.
+        # Data is a buffer or a function giving byte chunks of it, a token at the end of the buffer
+        # may go on in the next chunk and is matched again with it.
+        chunks = iter(data() if callable(data) else (data,))
+        data = next(chunks, b'')
+        more = True
+        # position of the buffer in the data
+        base = 0
+        is_bytes = not isinstance(data, str)
+        token_re = FlatTree.token_re_bytes if is_bytes else FlatTree.token_re
+        label_prefix = b'&label=' if is_bytes else '&label='
+        depth = 0
+        after_close = False
+        i = 0
+        while True:
+            m = token_re.match(data, i)
+            if more and (m is None or m.end() == len(data)):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    more = False
+                else:
+                    data = data[i:] + chunk
+                    base += i
+                    i = 0
+                continue
+            if m is None:
+                i += base
+                if depth:
+                    raise ValueError(f"Unexpected character or end of newick tree at position {i}")
+                raise ValueError("No newick tree found in data")
+            i = m.end()
+            kind = m.lastindex
+            if kind == 1:
+                depth += 1
+                after_close = False
+                yield 'open', None
+            elif kind == 2:
+                if not depth:
+                    raise ValueError(f"Unbalanced brackets in newick tree at position {base + i}")
+                depth -= 1
+                yield 'close', None
+                if not depth:
+                    return
+                after_close = True
+            elif kind == 3:
+                after_close = False
+            elif kind == 4:
+                if depth:
+                    raise ValueError(f"Unbalanced brackets in newick tree at position {base + i}")
+                raise ValueError("No newick tree found in data")
+            elif kind == 5:
+                comment = m.group(5)
+                if after_close and comment[:7] == label_prefix:
+                    label = comment[7:]
+                    yield 'support', label.decode() if is_bytes else label
+            elif kind == 7:
+                label = m.group(7)
+                if is_bytes:
+                    label = label.decode()
+                label = label.strip()
+                if after_close:
+                    after_close = False
+                    yield 'support', label
+                elif depth:
+                    yield 'leaf', translate.get(label, label) if translate else label
+
+    def row(self, name):
+        # counts a leaf adds to every group, matched again in each pass instead of kept per name
+        row = []
+        for column, criterium, support, offset in self.columns:
+            passing = False
+            for group in criterium:
+                hit = any(pattern.match(name) for pattern in group[1])
+                passing = passing or hit
+                row.append(int(hit))
+            row.append(int(passing))
+        return row
+
+    def results(self, data, translate, file, names=None):
+        # like sort_tree_seeds for Critter.seed_taxons, the seed taxon given by flag is a plain name here
+        options = self.options
+        if options.seed_pattern:
+            seed_taxon = options.seedtaxon
+        else:
+            seed_taxon = None if options.no_seed else file[1]
+        result = self.evaluate(data, translate, seed_taxon, file[0], names)
+        if options.seed_pattern:
+            # one row for every taxon of that name, none without it
+            return [dict(result) for _ in range(self.seeds_n)]
+        return [result]
+
+    def evaluate(self, data, translate, seed_taxon, tree_path, names=None):
+        # result of one tree for one seed taxon (None without seed), names of leaves are added to names
+        options = self.options
+        width = self.width
+
+        # first pass: totals
+        totals = [0] * width
+        n_leaves = 0
+        seeds_n = 0
+        for kind, name in self.tokens(data, translate):
+            if kind == 'leaf':
+                n_leaves += 1
+                seeds_n += name == seed_taxon
+                for g, hit in enumerate(self.row(name)):
+                    totals[g] += hit
+                if names is not None:
+                    names.append(name)
+
+        self.seeds_n = seeds_n
+        bests = [None] * len(self.columns)
+        merge = Critter.merge_best
+
+        def check(node, supports):
+            # both sides of the edge above a closed node, node is [edge, counts, leaves, seeds]
+            e, counts, inside_n, inside_seeds = node
+            Profile.counters['edges'] += 1
+            for d in range(2):
+                if seed_taxon and not (inside_seeds if d else inside_seeds < seeds_n):
+                    # seed taxon not in this subtree
+                    continue
+                size = inside_n if d else n_leaves - inside_n
+                if size < options.mintaxons:
+                    continue
+                side = counts if d else [total - count for total, count in zip(totals, counts)]
+                for c, (column, criterium, support, offset) in enumerate(self.columns):
+                    Profile.counters['checker_calls'] += 1
+                    end = offset + len(criterium)
+                    is_valid, r_t, a_t = Critter.counts_checker(size, side[offset:end], side[end], criterium,
+                                                                options.tolerance)
+                    if is_valid:
+                        bs = supports[support] if support < len(supports) and supports[support] is not None else 1
+                        bests[c] = merge(bests[c], (bs, r_t, 2 * e + d, a_t, size))
+
+        # second pass: open nodes with their counts, the closed node waiting for its support label
+        stack = []
+        pending = None
+        pending_supports = []
+        # rooted tree: edges of a top node with two subtrees only are checked at the end, so that
+        # the unlabelled one can take the support values of the other one like in FlatTree
+        top = []
+        top_closed = True
+        nodes_n = 0
+        for kind, value in self.tokens(data, translate):
+            if kind == 'support':
+                pending_supports = FlatTree.parse_support(value)
+                continue
+            if pending is not None:
+                if len(stack) == 1 and top_closed:
+                    top.append((pending, pending_supports))
+                    if len(top) > 2:
+                        top_closed = False
+                else:
+                    check(pending, pending_supports)
+                pending = None
+            if kind == 'open':
+                stack.append([nodes_n - 1, [0] * width, 0, 0])
+                nodes_n += 1
+            elif kind == 'close':
+                node = stack.pop()
+                if not stack:
+                    break
+                parent = stack[-1]
+                parent_counts = parent[1]
+                for g, count in enumerate(node[1]):
+                    parent_counts[g] += count
+                parent[2] += node[2]
+                parent[3] += node[3]
+                pending = node
+                pending_supports = []
+            else:
+                node = stack[-1]
+                if len(stack) == 1:
+                    # leaf of the top node
+                    top_closed = False
+                counts = node[1]
+                for g, hit in enumerate(self.row(value)):
+                    counts[g] += hit
+                node[2] += 1
+                node[3] += value == seed_taxon
+
+        if top_closed and len(top) == 2 and [bool(supports) for _, supports in top].count(True) == 1:
+            supports = top[0][1] or top[1][1]
+            top = [(node, supports) for node, _ in top]
+        for node, supports in top:
+            check(node, supports)
+
+        return Critter.result_from_best(tree_path, seed_taxon, n_leaves, list(zip(self.crit_tree, bests)),
+                                        not options.all_trees)
 
 
 def parse_args():
+    from argparse import ArgumentParser
     parser = ArgumentParser(
         prog='TreeSorter',
         description="Analyses your phylogenetic tree files to determine highest bootstrap\
@@ -610,17 +2769,123 @@ def parse_args():
 
     parser.add_argument('-o', '--output', nargs=1,
                         help="Output CSV file")
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet', 'arrow'],
+                        help="Output format, by default given by extension of output file (.jsonl, .parquet, \
+                        .arrow or .feather) and CSV otherwise. Parquet and arrow need the pyarrow package")
     parser.add_argument('-v', action='store_true',
                         help="Run verbose")
     parser.add_argument('--nested', action='store_true',
                         help="Requires use of seed taxon. Checks if seed taxon is nested within criteria set with minimum occurence.")
 
+    parser.add_argument('--all-trees', action='store_true',
+                        help="Evaluate every tree of multi-tree files (bootstrap replicates, posterior samples) \
+                        and report for each criterion the fraction of trees with a valid clade, \
+                        number of such trees and their mean highest bootstrap. Each criterion counts its own \
+                        clades, the highest bootstrap is not carried over from other criteria")
+
+    parser.add_argument('--serve', action='store_true',
+                        help="Run a local query server keeping parsed trees of the listed files in memory. \
+                        Queries are GET requests with c=CRITERION repeated and tolerance, mintaxons, seedtaxon, \
+                        no_seed, nested, files and format (csv or jsonl) parameters, or POST requests with the \
+                        same keys in a JSON object (criteria as a list). Options not in a query are taken from \
+                        the command line")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Address the server listens on, default is localhost only")
+    parser.add_argument('--port', type=int, default=8765,
+                        help="Port the server listens on")
+    parser.add_argument('--socket',
+                        help="Listen on this unix socket instead of a TCP port")
+    parser.add_argument('--server-memory', type=float,
+                        help=f"Memory limit for parsed trees in MB, least recently used trees are dropped over it. \
+                        Default is {Settings.default_server_memory}")
+    parser.add_argument('--watch-interval', type=float, default=5,
+                        help="Seconds between checks of the tree files for changes, 0 disables watching")
+
+    parser.add_argument('--shards', type=int,
+                        help="Split files into this many shards by a hash of their path. Without --shard or \
+                        --merge-shards all shards are evaluated in worker processes and merged to the output. \
+                        Each shard keeps a checkpoint next to the output, so a restart skips finished files")
+    parser.add_argument('--shard', type=int,
+                        help="Evaluate only this shard (0 to SHARDS - 1), e.g. on one of several hosts sharing \
+                        the filesystem, with the same arguments everywhere")
+    parser.add_argument('--merge-shards', action='store_true',
+                        help="Only write the output from checkpoints of all shards, in the order of the file list")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Keep a manifest of evaluated files next to the output file and on the next run \
+                        evaluate only new or changed files, rows of unchanged files are taken from the manifest \
+                        and rows of files no longer listed are dropped")
+
+    parser.add_argument('--index',
+                        help="File with index of taxon names of all evaluated files, created if missing. Files \
+                        without a matching seed taxon or without enough taxons for any criterion are not parsed, \
+                        their empty rows are written directly. Not used with --all-trees")
+
+    parser.add_argument('--cache',
+                        help="Directory for cache of parsed trees and results, unchanged files with unchanged \
+                        settings are not parsed or evaluated again. Results are kept for each criterion, a run \
+                        with added criteria evaluates only those")
+    parser.add_argument('--cache-size', type=float,
+                        help=f"Cache size limit in MB, least recently used entries are removed over it. \
+                        Default is {Settings.default_cache_size}")
+    parser.add_argument('--clear-cache', action='store_true',
+                        help="Remove all entries from cache directory before running")
+
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help="Read this many upcoming files ahead in reader threads while the current one is \
+                        evaluated and write rows from a writer thread, for slow or network storage. \
+                        Default 0 reads files one by one")
+    parser.add_argument('--readers', type=int, default=4,
+                        help="Number of reader threads with --prefetch")
+    parser.add_argument('--stream', action='store_true',
+                        help="Evaluate huge trees in two streaming passes over the file without keeping the tree \
+                        in memory, memory then grows with tree depth only. Not with --nested or a seed taxon pattern")
+    parser.add_argument('--memo', type=int, default=0,
+                        help="Keep up to this many match rows of taxon names and verdicts of clades in memory and \
+                        reuse them for equal clades within a tree and across trees, e.g. paralog copies or re-runs. \
+                        Default 0 turns the memo off")
+    parser.add_argument('--sweep',
+                        help="JSON file of configurations evaluated on every tree, e.g. {\"criteria\": {\"strict\": \
+                        [\"dinos=0.5+Dinos*\"], \"loose\": [\"dinos=0.2+Dinos*\"]}, \"tolerance\": [0, 0.1], \
+                        \"mintaxons\": [1, 2], \"nested\": [false, true]}, every combination is one configuration. \
+                        Missing keys are taken from -c, -t, -m and --nested. Trees are parsed and matched once, \
+                        rows are written in long format, one per configuration, seed taxon and criterion")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Number of worker processes evaluating files in parallel")
+    parser.add_argument('--chunksize', type=int,
+                        help="Number of files sent to a worker process at once, default is derived from file count")
+    parser.add_argument('--unordered', action='store_true',
+                        help="With --jobs, write rows as files finish instead of in input order")
+
+    parser.add_argument('--search', choices=['pruned', 'exhaustive'], default='pruned',
+                        help="Search for the best clade of a single seed taxon from the highest bootstrap down \
+                        and stop at the first valid one (pruned, default) or check every edge (exhaustive), \
+                        both give the same results")
+
+    parser.add_argument('--engine', choices=['python', 'numpy'], default='python',
+                        help="Check criteria clade by clade in pure python (default) or for all clades and \
+                        criteria at once with numpy arrays, which needs the numpy package")
+
+    parser.add_argument('--profile',
+                        help="Write wall and cpu time of every stage and counts of edges visited, pattern matches \
+                        and criteria checks of each file to this CSV file (JSON if it ends with .json) and print \
+                        a summary with the slowest files and peak memory of the process")
+    parser.add_argument('--profile-memory', action='store_true',
+                        help="With --profile, trace python allocations and write peak memory of each file, which \
+                        is empty otherwise, this slows down the run")
+    parser.add_argument('--cprofile',
+                        help="Write cProfile statistics of the run to this file, worker processes of --jobs \
+                        are not included")
+
     parser.add_argument('-c', '--criteria', nargs='*',
                         help="One or more criteria to apply on subtrees defined with taxon names (* as wildcard), \
                         in the format of NAME=DEFINITIONS, where definitions can include required minimums using \
                         \'NUMBER+\' in front (decimal for relative, whole for absolute), also allowing \
-                        one level of brackets to denote grouping of taxons with one common minimum\
-                        Example: \"some_dinos=0.333+Dinos*\" \"some_two=0.125(Toxo*,Bobo*),4+Karo*,Mimi-123-2\"")
+                        one level of brackets to denote grouping of taxons with one common minimum. \
+                        NAME@N ranks clades by the N-th of several support values of an edge (e.g. SH-aLRT/UFBoot). \
+                        A criterion without a better clade of its own reports the highest bootstrap of the \
+                        criteria before it, only of those ranking by the same support value. \
+                        Example: \"some_dinos=0.333+Dinos*\" \"some_two=0.125(Toxo*,Bobo*),4+Karo*,Mimi-123-2\" \
+                        \"ufboot_dinos@2=0.333+Dinos*\"")
 
     return parser.parse_args()
 
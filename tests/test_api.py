@@ -0,0 +1,40 @@
+# Library interface: malformed input is raised as ValueError instead of exiting or looping
+import pytest
+
+from treesorter import api
+
+
+@pytest.mark.parametrize("criteria", ["x=(A", "x=1+(A*,B*", "x=1A", "x", "x=A)", "x=[A", "x@0=A*"])
+def test_malformed_criteria(criteria):
+    with pytest.raises(ValueError):
+        api.compile_criteria(criteria)
+
+
+def test_malformed_tree():
+    with pytest.raises(ValueError):
+        api.parse_tree("(A,(B,C)")
+    with pytest.raises(ValueError):
+        api.parse_tree("no tree here")
+
+
+def test_evaluate():
+    results = api.evaluate("(X,(A1,A2)90,(B1,(B2,G2)50)40);", ["a=1+A*", "b=1+B*"], mintaxons=2)
+    assert results == [{'file': '', 'taxon': None, 'size': 2, 'crits': {'a': (90, 0.0, 0), 'b': (90, 0.0, 0)}}]
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"mintaxons": None}, {"mintaxons": "3"}, {"mintaxons": 0}, {"mintaxons": 2.5}, {"mintaxons": True},
+    {"tolerance": None}, {"tolerance": "0.2"}, {"tolerance": -1}, {"tolerance": float("nan")},
+    {"nested": "yes"}, {"nested": 1}, {"search": "fast"}, {"engine": "cuda"}, {"name": None},
+    {"memo": {}}, {"seed": 3}, {"seed": ["A1", 2]}, {"seed": None, "nested": True},
+])
+def test_evaluate_arguments(kwargs):
+    with pytest.raises(ValueError):
+        api.evaluate("(X,(A1,A2)90,(B1,B2)40);", ["a=1+A*"], **kwargs)
+
+
+@pytest.mark.parametrize("tree, criteria", [(None, ["a=1+A*"]), (b"(X,(A1,A2)90,(B1,B2)40);", None),
+                                            ("(X,(A1,A2)90,(B1,B2)40);", [1]), ("(X,(A1,A2)90,(B1,B2)40);", [])])
+def test_evaluate_tree_and_criteria(tree, criteria):
+    with pytest.raises(ValueError):
+        api.evaluate(tree, criteria)
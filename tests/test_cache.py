@@ -0,0 +1,108 @@
+# --cache: hits skip parsing and evaluation, criteria are cached one by one, changed files and
+# settings miss, eviction keeps the size limit
+import os
+from os.path import join
+
+import pytest
+
+from treesorter.persistence import Cache
+from treesorter.treesorter import Critter, FlatTree, Input, Options
+
+newick = "(X,(A1,A2)90,((A3,B1)70,(B2,B3)60)80);"
+criteria = ["a=1+A*", "b=1+B*", "ab=0.5+(A*,B*)"]
+
+
+def evaluate(path, criteria, cache, **settings):
+    options = Options(mintaxons=2, cache=cache, **settings)
+    return Critter.evaluate_file([path, "A1"], Critter.build_criteria_tree(criteria), options)
+
+
+def uncached(criteria, **settings):
+    options = Options(mintaxons=2, **settings)
+    crit_tree = Critter.build_criteria_tree(criteria)
+    return [Critter.sort_one_tree_file(FlatTree(newick), "A1", crit_tree, "tree.tre", options)]
+
+
+def entries(cache, kind):
+    return [path for _, _, path in cache.entries() if os.sep + kind + os.sep in path]
+
+
+@pytest.fixture
+def tree_file(tmp_path):
+    path = join(tmp_path, "tree.tre")
+    with open(path, "w") as f:
+        f.write(newick)
+    return path
+
+
+@pytest.fixture
+def evaluated(monkeypatch):
+    # criteria every evaluation got, parsing fails the test after it is forbidden
+    calls = []
+    seed_bests = Critter.seed_bests
+
+    def counted(tree, seed_taxons, crit_tree, options):
+        calls.append(list(crit_tree))
+        return seed_bests(tree, seed_taxons, crit_tree, options)
+    monkeypatch.setattr(Critter, "seed_bests", counted)
+    return calls
+
+
+def test_hit_skips_parsing_and_evaluation(tmp_path, tree_file, evaluated, monkeypatch):
+    cache = Cache(join(tmp_path, "cache"))
+    assert evaluate(tree_file, criteria, cache) == uncached(criteria)
+    assert evaluated == [["a", "b", "ab"]]
+    assert len(entries(cache, "trees")) == 1 and len(entries(cache, "bests")) == 3
+
+    def no_reading(*args):
+        raise AssertionError("file read again")
+    monkeypatch.setattr(Input, "read_first_tree", no_reading)
+    assert evaluate(tree_file, criteria, cache) == uncached(criteria)
+    assert evaluated == [["a", "b", "ab"]]
+
+
+def test_criteria_cached_one_by_one(tmp_path, tree_file, evaluated):
+    cache = Cache(join(tmp_path, "cache"))
+    evaluate(tree_file, criteria[:2], cache)
+    # new criterion only, the others in another order still carry over like without cache
+    more = ["b=1+B*", "c=1+C*", "a=1+A*", "ab=0.5+(A*,B*)"]
+    assert evaluate(tree_file, more, cache) == uncached(more)
+    assert evaluated == [["a", "b"], ["c", "ab"]]
+    # a renamed criterion ranking by the same support value is the same entry
+    assert evaluate(tree_file, ["other=1+A*"], cache)[0]['crits'] == {'other': (90, 0.0, 0)}
+    assert len(evaluated) == 2
+
+
+def test_changes_miss(tmp_path, tree_file, evaluated):
+    cache = Cache(join(tmp_path, "cache"))
+    evaluate(tree_file, criteria, cache)
+    evaluate(tree_file, criteria, cache, tolerance=1)
+    evaluate(tree_file, criteria, cache, nested=True)
+    assert len(evaluated) == 3
+    # changed content is a new tree, the old entries stay until evicted
+    with open(tree_file, "w") as f:
+        f.write(newick.replace("90", "95"))
+    assert evaluate(tree_file, criteria, cache)[0]['crits']['a'] == (95, 0.0, 0)
+    assert len(evaluated) == 4
+    assert len(entries(cache, "trees")) == 2
+
+
+def test_whole_results_of_all_trees(tmp_path, tree_file, evaluated):
+    cache = Cache(join(tmp_path, "cache"))
+    first = evaluate(tree_file, criteria, cache, all_trees=True)
+    assert evaluate(tree_file, criteria, cache, all_trees=True) == first
+    assert len(evaluated) == 1
+    assert len(entries(cache, "results")) == 1 and not entries(cache, "bests")
+
+
+def test_eviction_and_clear(tmp_path, tree_file):
+    cache = Cache(join(tmp_path, "cache"))
+    evaluate(tree_file, criteria, cache)
+    sizes = sorted(size for _, size, _ in cache.entries())
+    # least recently used entries go first, down to the limit
+    limit = sum(sizes) - 1
+    cache.max_bytes = limit
+    cache.evict()
+    assert 0 < sum(size for _, size, _ in cache.entries()) <= limit
+    cache.clear()
+    assert cache.entries() == []
@@ -0,0 +1,288 @@
+# Command line runs over the test trees: modes that only change how files are read, evaluated
+# or stored write the same rows as a plain serial run
+import csv
+import json
+import os
+import shutil
+import sys
+import tracemalloc
+from os.path import basename, dirname, join
+from time import sleep
+
+import pytest
+
+from treesorter.persistence import Cache, CorpusIndex
+from treesorter.treesorter import Critter, Input, Pipeline, main
+
+tests_dir = dirname(__file__)
+few_dir = join(tests_dir, "few")
+multi_dir = join(tests_dir, "multi")
+criteria = ["karenia=0.8+Dinos-Kareniaceae*", "hapto=3+Haptophytes-*",
+            "dinos=0.5+(Dinos-Gonyaulacales*,Dinos-Suessiales*)"]
+# every tree of the directory with the taxon of its file name as seed
+few_args = ("-d", few_dir, "-s", "-t", "0.2")
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    # runs main with given arguments and criteria, returns the text of the output file
+    def run(*args, output="out.csv", criteria=criteria):
+        path = join(tmp_path, output)
+        monkeypatch.setattr(sys, "argv", ["treesorter", *args, "-o", path, "-c", *criteria])
+        main()
+        with open(path) as f:
+            return f.read()
+    return run
+
+
+def test_jobs_keep_input_order(run):
+    serial = run(*few_args)
+    assert len(serial.splitlines()) == 11
+    assert run(*few_args, "-j", "2") == serial
+    assert run(*few_args, "-j", "3", "--chunksize", "1") == serial
+    # rows as files finish, same rows in any order
+    unordered = run(*few_args, "-j", "3", "--chunksize", "1", "--unordered")
+    assert sorted(unordered.splitlines()) == sorted(serial.splitlines())
+
+
+def test_all_trees_rows(run, tmp_path):
+    # a has a clade in trees 1 and 3, b too and does not take the higher bootstrap of a
+    expected = ['"filename","seed_taxon","total_trees","a=1+A*","valid_trees","mean_bs","b=1+B*","valid_trees",'
+                '"mean_bs"']
+    for name in ["replicates.tre", "replicates.nex"]:
+        rows = run("-f", join(multi_dir, name), "-n", "-m", "1", "--all-trees", criteria=["a=1+A*", "b=1+B*"])
+        assert rows.splitlines() == expected + [f'"{name}","None","3","0.667","2","75.0","0.667","2","45.0"']
+    # seed taxon from a list file, b has no clade with it
+    listing = join(tmp_path, "list.csv")
+    with open(listing, "w") as f:
+        f.write(f'"{join(multi_dir, "replicates.nex")}","A1"\n')
+    rows = run("-l", listing, "-s", "-m", "1", "--all-trees", criteria=["a=1+A*", "b=1+B*"])
+    assert rows.splitlines()[1:] == ['"replicates.nex","A1","3","0.667","2","75.0","0.0","0",""']
+
+
+def compress(source_dir, target_dir, ext):
+    # copies of all tree files of a directory compressed by extension
+    if ext == ".gz":
+        import gzip as module
+    elif ext == ".xz":
+        import lzma as module
+    else:
+        module = pytest.importorskip("zstandard")
+    os.makedirs(target_dir)
+    for name in os.listdir(source_dir):
+        with open(join(source_dir, name), "rb") as f:
+            data = f.read()
+        with open(join(target_dir, name + ext), "wb") as f:
+            f.write(module.compress(data))
+
+
+@pytest.mark.parametrize("ext", [".gz", ".xz", ".zst"])
+def test_compressed_files(run, tmp_path, monkeypatch, ext):
+    plain = run(*few_args)
+    all_trees = run("-d", multi_dir, "-n", "-m", "1", "--all-trees")
+    compress(few_dir, join(tmp_path, "few"), ext)
+    compress(multi_dir, join(tmp_path, "multi"), ext)
+    # small chunks, statements and comments are split between them
+    monkeypatch.setattr(Input, "chunk_size", 7)
+    for extra in [(), ("--prefetch", "2")]:
+        rows = run("-d", join(tmp_path, "few"), "-s", "-t", "0.2", *extra)
+        # directories are listed in different order, file names keep the extension
+        assert sorted(rows.replace(ext, "").splitlines()) == sorted(plain.splitlines())
+        rows = run("-d", join(tmp_path, "multi"), "-n", "-m", "1", "--all-trees", *extra)
+        assert sorted(rows.replace(ext, "").splitlines()) == sorted(all_trees.splitlines())
+        rows = run("-d", join(tmp_path, "few"), "-s", "-t", "0.2", "--stream", *extra)
+        assert sorted(rows.replace(ext, "").splitlines()) == sorted(plain.splitlines())
+
+
+def test_plain_files_mapped_or_read(run):
+    # plain files are memory mapped, with --prefetch reader threads read them whole
+    plain = run(*few_args)
+    assert run(*few_args, "--prefetch", "3", "--readers", "2") == plain
+
+
+def test_prefetch_keeps_input_order(run, monkeypatch):
+    serial = run(*few_args)
+    serial_jsonl = run(*few_args, output="out.jsonl")
+    all_trees = run("-d", multi_dir, "-n", "-m", "1", "--all-trees")
+    read = Pipeline.read
+    listed = sorted(os.listdir(few_dir))
+
+    def slow_read(path):
+        # files ahead in the listing are read last
+        sleep(0.002 * (len(listed) - listed.index(basename(path))) if basename(path) in listed else 0)
+        return read(path)
+    monkeypatch.setattr(Pipeline, "read", slow_read)
+    for depth in ["1", "3", "20"]:
+        assert run(*few_args, "--prefetch", depth, "--readers", "4") == serial
+        assert run(*few_args, "--prefetch", depth, output="out.jsonl") == serial_jsonl
+        assert run("-d", multi_dir, "-n", "-m", "1", "--all-trees", "--prefetch", depth) == all_trees
+    # rows of worker processes go through the writer thread
+    assert run(*few_args, "-j", "2", "--prefetch", "2") == serial
+
+
+def test_profile_memory_per_file_only_when_traced(run, tmp_path, capsys):
+    report = join(tmp_path, "profile.csv")
+    rows = run(*few_args)
+    assert run(*few_args, "--profile", report) == rows
+    with open(report) as f:
+        profiles = list(csv.DictReader(f))
+    assert len(profiles) == 10 and all(int(profile["edges"]) > 0 for profile in profiles)
+    # without tracing there is no peak of a single file, the summary has the peak of the process
+    assert {profile["peak_memory"] for profile in profiles} == {""}
+    assert "peak memory of the process" in capsys.readouterr().out
+    try:
+        run(*few_args, "--profile", report, "--profile-memory")
+    finally:
+        tracemalloc.stop()
+    with open(report) as f:
+        assert all(int(profile["peak_memory"]) > 0 for profile in csv.DictReader(f))
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    # paths read whole for evaluation and paths hashed by a read of their own
+    reads = {"evaluated": [], "hashed": []}
+    read, file_key = Pipeline.read, Cache.file_key
+
+    def counted_read(path):
+        reads["evaluated"].append(path)
+        return read(path)
+
+    def counted_key(path, content=None):
+        if content is None:
+            reads["hashed"].append(path)
+        return file_key(path, content)
+    monkeypatch.setattr(Pipeline, "read", counted_read)
+    monkeypatch.setattr(Cache, "file_key", counted_key)
+    return reads
+
+
+def test_incremental(run, tmp_path, reads):
+    trees = join(tmp_path, "trees")
+    shutil.copytree(few_dir, trees)
+    args = ("-d", trees, "-s", "-t", "0.2", "--incremental")
+    first = run(*args)
+    assert first == run("-d", trees, "-s", "-t", "0.2", output="full.csv")
+    # every file read once, hashed while evaluated
+    assert len(reads["evaluated"]) == 10 and reads["hashed"] == []
+    reads["evaluated"].clear()
+
+    assert run(*args) == first
+    assert reads == {"evaluated": [], "hashed": []}
+
+    # touched but unchanged, the content is hashed to find out and the rows are kept
+    names = sorted(os.listdir(trees))
+    touched = join(trees, names[0])
+    os.utime(touched, ns=(0, 0))
+    assert run(*args) == first
+    assert reads == {"evaluated": [], "hashed": [touched]}
+    reads["hashed"].clear()
+    with open(join(tmp_path, "out.csv.manifest")) as f:
+        assert {entry["path"]: entry["mtime_ns"] for entry in json.load(f)["files"]}[touched] == 0
+
+    # changed file is evaluated again, a deleted one drops out of the output and the manifest
+    changed = join(trees, names[1])
+    with open(changed) as f:
+        data = f.read()
+    with open(changed, "w") as f:
+        f.write(data.replace(")100:", ")97:"))
+    os.remove(join(trees, names[2]))
+    rows = run(*args)
+    assert reads == {"evaluated": [changed], "hashed": []}
+    assert rows == run("-d", trees, "-s", "-t", "0.2", output="full.csv") != first
+    with open(join(tmp_path, "out.csv.manifest")) as f:
+        assert sorted(entry["path"] for entry in json.load(f)["files"]) == sorted(join(trees, name)
+                                                                                   for name in names[:2] + names[3:])
+
+
+@pytest.mark.parametrize("index_criteria, evaluated_files", [
+    (criteria, 10),
+    # more than 60 taxons of Dinos are in six trees only
+    (["none=1+Nothing*", "dinos=60+Dinos-*"], 6),
+    (["none=1+Nothing*"], 0),
+])
+def test_index_keeps_rows(run, tmp_path, monkeypatch, index_criteria, evaluated_files):
+    trees = join(tmp_path, "trees")
+    shutil.copytree(few_dir, trees)
+    args = ("-d", trees, "-s", "-t", "0.2")
+    index = join(tmp_path, "names.index")
+    plain = run(*args, criteria=index_criteria)
+    evaluated = []
+    evaluate_file = Critter.evaluate_file
+
+    def counted(file, *rest, **kwargs):
+        evaluated.append(file[0])
+        return evaluate_file(file, *rest, **kwargs)
+    monkeypatch.setattr(Critter, "evaluate_file", staticmethod(counted))
+    # first run builds the index, the next ones skip files where no criterion can match
+    assert run(*args, "--index", index, criteria=index_criteria) == plain
+    assert len(evaluated) == 10
+    assert run(*args, "--index", index, "-j", "2", criteria=index_criteria) == plain
+    evaluated.clear()
+    assert run(*args, "--index", index, criteria=index_criteria) == plain
+    assert len(evaluated) == evaluated_files
+    # entries of deleted files are dropped
+    os.remove(join(trees, sorted(os.listdir(trees))[0]))
+    assert run(*args, "--index", index, criteria=index_criteria) == run(*args, criteria=index_criteria)
+    assert sorted(CorpusIndex(index).files) == sorted(join(trees, name) for name in os.listdir(trees))
+
+
+def test_shards_split_restart_merge(run, tmp_path, monkeypatch):
+    single = run(*few_args)
+    output = join(tmp_path, "sharded.csv")
+    evaluated = []
+    evaluate_file = Critter.evaluate_file
+
+    def counted(file, *rest, **kwargs):
+        evaluated.append(file[0])
+        return evaluate_file(file, *rest, **kwargs)
+    monkeypatch.setattr(Critter, "evaluate_file", staticmethod(counted))
+
+    def shard(k):
+        monkeypatch.setattr(sys, "argv", ["treesorter", *few_args, "-o", output, "-c", *criteria,
+                                          "--shards", "3", "--shard", str(k)])
+        main()
+    for k in range(3):
+        shard(k)
+    assert len(evaluated) == 10
+    # shard 1 was interrupted while writing its last record, on restart only that file is evaluated again
+    checkpoint = f"{output}.shard-1-of-3"
+    with open(checkpoint, "rb") as f:
+        lines = f.read().splitlines(keepends=True)
+    assert len(lines) > 2
+    with open(checkpoint, "wb") as f:
+        f.write(b"".join(lines[:-1]) + lines[-1][:len(lines[-1]) // 2])
+    evaluated.clear()
+    shard(1)
+    shard(0)
+    assert evaluated == [json.loads(lines[-1])["path"]]
+    assert run(*few_args, "--shards", "3", "--merge-shards", output="sharded.csv") == single
+    # all shards in worker processes of one run
+    assert run(*few_args, "--shards", "3", output="local.csv") == single
+
+
+def test_sweep_rows_match_separate_runs(run, tmp_path):
+    sweep = join(tmp_path, "sweep.json")
+    sets = {"three": criteria, "two": criteria[1:]}
+    with open(sweep, "w") as f:
+        json.dump({"criteria": sets, "tolerance": [0, 0.2], "mintaxons": [1, 3], "nested": [False, True]}, f)
+    rows = list(csv.reader(run("-d", few_dir, "-s", "--sweep", sweep, criteria=[]).splitlines()))
+    assert rows[0] == ["config", "filename", "seed_taxon", "total_taxons", "criterion", "bootstrap", "tu_R", "tu_A"]
+    configs = {}
+    for row in rows[1:]:
+        configs.setdefault(row[0], []).append(row[1:])
+    assert len(configs) == 16
+    found = 0
+    for name, set_criteria in sets.items():
+        for tolerance in ["0", "0.2"]:
+            for mintaxons in ["1", "3"]:
+                for nested in [(), ("--nested",)]:
+                    separate = list(csv.reader(run("-d", few_dir, "-s", "-t", tolerance, "-m", mintaxons, *nested,
+                                                   output="separate.csv", criteria=set_criteria).splitlines()))
+                    # one row of a separate run is a row of every criterion in the sweep
+                    expected = [row[:3] + [column.split("=")[0]] + row[3 + 3 * c:6 + 3 * c]
+                                for row in separate[1:] for c, column in enumerate(set_criteria)]
+                    config = f"{name}:t={tolerance}:m={mintaxons}" + (":nested" if nested else "")
+                    assert configs[config] == expected, config
+                    found += sum(row[4] != "" for row in expected)
+    assert found
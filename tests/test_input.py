@@ -0,0 +1,78 @@
+# Reading trees from newick and nexus files: translate tables, several trees per file, views of flat trees
+import gzip
+import pickle
+from os.path import dirname, join
+
+from treesorter.benchmark import generate_newick
+from treesorter.treesorter import Critter, FlatTree, Input, Options, PTree, StreamTree
+
+tests_dir = dirname(__file__)
+multi_dir = join(tests_dir, "multi")
+
+# the same three trees in both files, nexus leaves are numbers of its translate block
+replicates = ["(X,(A1,A2)90,(B1,B2)40);", "(X,(A1,B1)80,(A2,B2)70);", "(X,(A1,A2)60,(B1,B2)50);"]
+
+
+def tree_summary(data, translate):
+    tree = FlatTree(data, translate)
+    return tree.leaf_names, list(tree.edge_bs)
+
+
+def test_newick_trees():
+    trees = [tree_summary(data, translate) for data, translate in Input.iter_trees(join(multi_dir, "replicates.tre"))]
+    assert trees == [tree_summary(newick, None) for newick in replicates]
+
+
+def test_nexus_translate_block():
+    trees = list(Input.iter_trees(join(multi_dir, "replicates.nex")))
+    assert [translate for _, translate in trees] == [{'1': 'X', '2': 'A1', '3': 'A2', '4': 'B1', '5': 'B2'}] * 3
+    assert [tree_summary(data, translate) for data, translate in trees] == \
+        [tree_summary(newick, None) for newick in replicates]
+
+
+def test_first_tree():
+    data, translate = Input.read_first_tree(join(multi_dir, "replicates.nex"))
+    assert FlatTree(data, translate).leaf_names == ["X", "A1", "A2", "B1", "B2"]
+    assert Input.read_tree_file(join(multi_dir, "replicates.tre")) == replicates[0][:-1]
+
+
+def test_flat_tree_views():
+    # views of the flat arrays connect like the object tree, across pickling too
+    newick = "(X:1,(A1,(A2,B1)70:0.5)90,(B1,B2)40);"
+    objects = PTree()
+    objects.parse_file(newick)
+    for tree in [FlatTree(newick), pickle.loads(pickle.dumps(FlatTree(newick)))]:
+        assert [taxon.name for taxon in tree.taxons] == objects.taxon_names()
+        assert [(edge.bs, edge.length) for edge in tree.edges] == [(edge.bs, edge.length) for edge in objects.edges]
+        for node, other in zip(tree.nodes, objects.nodes):
+            assert [type(obj).__name__ for obj in node.edges] == [type(obj).__name__ for obj in other.edges]
+        assert tree.taxons[2].edge.edges[0].nodes == [tree.nodes[1], tree.nodes[2]]
+    # every view of a large tree in linear time, elements of nodes are indexed once per tree
+    tree = FlatTree(generate_newick("caterpillar", 20000))
+    assert sum(len(node.edges) for node in tree.nodes) == len(tree.edges) * 2 + tree.n_leaves
+    assert "node_items" not in pickle.loads(pickle.dumps(tree)).__dict__
+
+
+def test_stream_compressed_in_chunks(tmp_path, monkeypatch):
+    # --stream gets the first tree of a compressed file in chunks from its opening bracket on
+    monkeypatch.setattr(Input, "chunk_size", 7)
+    crit_tree = Critter.build_criteria_tree(["a=1+A*", "b=1+B*"])
+    stream = StreamTree(crit_tree, Options(0, 2, no_seed=True))
+    for name in ["replicates.tre", "replicates.nex"]:
+        path = join(tmp_path, name + ".gz")
+        with open(join(multi_dir, name), "rb") as f, gzip.open(path, "wb") as out:
+            out.write(f.read())
+        chunks, translate = Input.stream_first_tree(path)
+        data, expected_translate = Input.read_first_tree(join(multi_dir, name))
+        assert translate == expected_translate
+        assert all(len(chunk) <= 7 for chunk in chunks())
+        assert b"".join(chunks()).startswith(bytes(data))
+        assert stream.results(chunks, translate, [name, None]) == stream.results(data, translate, [name, None])
+    # trees split anywhere, also inside labels, lengths and comments
+    newick = "(X:1.25,(A1[&x=1],A2)[&label=90]:0.5,(B1,B2)40);"
+    expected = stream.results(newick, None, ["tree.tre", None])
+    for size in [1, 2, 5]:
+        def chunks():
+            data = newick.encode()
+            return (data[i:i + size] for i in range(0, len(data), size))
+        assert stream.results(chunks, None, ["tree.tre", None]) == expected
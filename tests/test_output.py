@@ -0,0 +1,108 @@
+# Output writers: quoting of CSV fields, records of JSON Lines, Parquet and Arrow read back as written
+import csv
+import json
+from os.path import join
+
+import pytest
+
+from treesorter.output import ArrowOutput, CSVOutput, JSONLinesOutput
+from treesorter.treesorter import Settings
+
+criteria = ["a=1+A*", "b@2=1+B*"]
+results = [
+    {'file': 'quoted "name", with comma.tre', 'taxon': 'Seed "x",y', 'size': 5,
+     'crits': {'a': (90, 0.0, 0), 'b@2': None}},
+    {'file': 'none.tre', 'taxon': None, 'size': '', 'crits': {'a': None, 'b@2': None}},
+    {'file': 'decimal.tre', 'taxon': 'S', 'size': 3, 'crits': {'a': (0.98, 0.125, 1), 'b@2': (85.3, 0.0, 0)}},
+]
+# (config, file, seed taxon, trees, criterion, valid fraction, valid trees, mean bootstrap) of --sweep --all-trees
+sweep_results = [
+    {'config': 'strict:t=0:m=2', 'file': 'trees.nex', 'taxon': 'S', 'size': 4,
+     'crits': {'a': (0.5, 2, 72.5), 'b@2': (0.0, 0, '')}},
+]
+
+records = [
+    {'filename': 'quoted "name", with comma.tre', 'seed_taxon': 'Seed "x",y', 'total_taxons': 5,
+     'a': 90, 'a_tu_R': 0.0, 'a_tu_A': 0, 'b@2': None, 'b@2_tu_R': None, 'b@2_tu_A': None},
+    {'filename': 'none.tre', 'seed_taxon': None, 'total_taxons': None,
+     'a': None, 'a_tu_R': None, 'a_tu_A': None, 'b@2': None, 'b@2_tu_R': None, 'b@2_tu_A': None},
+    {'filename': 'decimal.tre', 'seed_taxon': 'S', 'total_taxons': 3,
+     'a': 0.98, 'a_tu_R': 0.125, 'a_tu_A': 1, 'b@2': 85.3, 'b@2_tu_R': 0.0, 'b@2_tu_A': 0},
+]
+sweep_records = [
+    {'config': 'strict:t=0:m=2', 'filename': 'trees.nex', 'seed_taxon': 'S', 'total_trees': 4, 'criterion': 'a',
+     'valid_fraction': 0.5, 'valid_trees': 2, 'mean_bs': 72.5},
+    {'config': 'strict:t=0:m=2', 'filename': 'trees.nex', 'seed_taxon': 'S', 'total_trees': 4, 'criterion': 'b@2',
+     'valid_fraction': 0.0, 'valid_trees': 0, 'mean_bs': None},
+]
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    # rows are flushed in several batches
+    monkeypatch.setattr(Settings, "output_batch_rows", 2)
+
+
+def write(output, rows, support=False, sweep=False):
+    output.write_headers(criteria, support, sweep)
+    for result in rows:
+        output.write_result(result)
+    output.close_file()
+
+
+def test_csv_quotes(tmp_path):
+    path = join(tmp_path, "out.csv")
+    write(CSVOutput(path), results)
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["filename", "seed_taxon", "total_taxons", "a=1+A*", "tu_R", "tu_A",
+                       "b@2=1+B*", "tu_R", "tu_A"]
+    # read back by a csv parser as the values were
+    assert rows[1] == ['quoted "name", with comma.tre', 'Seed "x",y', "5", "90", "0.0", "0", "", "", ""]
+    assert rows[2] == ["none.tre", "None", "", "", "", "", "", "", ""]
+    assert rows[3] == ["decimal.tre", "S", "3", "0.98", "0.125", "1", "85.3", "0.0", "0"]
+
+
+def test_csv_sweep_rows(tmp_path):
+    path = join(tmp_path, "out.csv")
+    write(CSVOutput(path), sweep_results, support=True, sweep=True)
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows == [["config", "filename", "seed_taxon", "total_trees", "criterion", "valid_fraction",
+                     "valid_trees", "mean_bs"],
+                    ["strict:t=0:m=2", "trees.nex", "S", "4", "a", "0.5", "2", "72.5"],
+                    ["strict:t=0:m=2", "trees.nex", "S", "4", "b@2", "0.0", "0", ""]]
+
+
+def test_jsonl_round_trip(tmp_path):
+    path = join(tmp_path, "out.jsonl")
+    write(JSONLinesOutput(path), results)
+    with open(path) as f:
+        assert [json.loads(line) for line in f] == records
+    write(JSONLinesOutput(path), sweep_results, support=True, sweep=True)
+    with open(path) as f:
+        assert [json.loads(line) for line in f] == sweep_records
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_arrow_round_trip(tmp_path, output_format):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    def read(path):
+        if output_format == "parquet":
+            return pyarrow.parquet.read_table(path)
+        with pyarrow.ipc.open_file(path) as reader:
+            return reader.read_all()
+
+    path = join(tmp_path, "out." + output_format)
+    write(ArrowOutput(path, output_format), results)
+    table = read(path)
+    assert table.column_names == list(records[0])
+    # supports and relative tolerances are floats, counts integers
+    assert table.schema.field("a").type == pyarrow.float64()
+    assert table.schema.field("a_tu_A").type == pyarrow.int64()
+    assert table.to_pylist() == records
+    write(ArrowOutput(path, output_format), sweep_results, support=True, sweep=True)
+    assert read(path).to_pylist() == sweep_records
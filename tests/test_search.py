@@ -0,0 +1,235 @@
+# Search modes, the all-seeds pass, the memo and streaming checked against the original clade by clade
+# evaluation on the object tree, on the test trees and on generated trees
+from functools import lru_cache
+from glob import glob
+from importlib.util import find_spec
+from os.path import basename, dirname, join
+from random import Random
+
+import pytest
+
+from treesorter.benchmark import generate_newick, default_criteria
+from treesorter.treesorter import PTree, FlatTree, Input, Critter, Options, Profile, StreamTree, SubtreeMemo
+
+tests_dir = dirname(__file__)
+
+known_criteria = {
+    "euglenids": ["green=2+(PRA_*,CHL_*,ULV_*,STR_*)", "red=2+(RHO_*,secondary_*)", "bac=1+BAC_*"],
+    "kareniacea": ["hapto=3+Haptophytes-*",
+                   "rhodo=3+(*Chondrus*,*Cyanidioschyzon*,*Porphyridium*,*Pyropia*,*Galdieria*)"],
+    "rhodophytes": ["rc=1+Rhodophyta*,Cryptophyta*"],
+}
+
+# tree where a seed name occurs three times and one copy sits right after a bipartition
+duplicate_seed_tree = ("((Aa-4,(Bb-1,Bb-0)51)26,(Bb-1,(((Bb-4,Bb-2)100,((Bb-3,Aa-5)57,Bb-1)14)88,Aa-0)35)11,"
+                       "((Bb-5,Aa-3)31,((Aa-1,Aa-2)40,Aa-2)33)49);")
+duplicate_criteria = ["c1=1+Aa*", "c2=1+Bb*", "c3=0.5+(Bb*,Aa-1)"]
+
+# criteria checked clade by clade or for all clades at once, the second one needs numpy
+engines = ["python", pytest.param("numpy", marks=pytest.mark.skipif(find_spec("numpy") is None,
+                                                                    reason="numpy is not installed"))]
+
+# (tolerance, minimal subtree size, nested)
+settings = [(tolerance, mintaxons, nested) for tolerance in [0, 0.2, 2] for mintaxons in [2, 3, 5]
+            for nested in [False, True]]
+
+
+def random_newick(seed, names):
+    # random binary tree joining two random subtrees at a time, top node keeps three
+    rng = Random(seed)
+    nodes = list(names)
+    while len(nodes) > 3:
+        a = nodes.pop(rng.randrange(len(nodes)))
+        b = nodes.pop(rng.randrange(len(nodes)))
+        nodes.append(f"({a},{b}){rng.randint(0, 100)}")
+    return "(" + ",".join(nodes) + ");"
+
+
+def known_cases():
+    cases = []
+    for path in sorted(glob(join(tests_dir, "known_results", "*", "*.tre"))):
+        name = basename(path)[:-len(".tre")]
+        data, translate = Input.read_first_tree(path)
+        cases.append((f"{basename(dirname(path))}-{name}", bytes(data).decode(), translate, known_criteria[name]))
+    return cases
+
+
+def generated_cases():
+    cases = [(f"{shape}-40", generate_newick(shape, 40, seed=1), None, default_criteria)
+             for shape in ["balanced", "caterpillar", "realistic"]]
+    cases.append(("duplicate-seeds", duplicate_seed_tree, None, duplicate_criteria))
+    for seed in range(3):
+        names = [f"Aa-{i}" for i in range(6)] + [f"Bb-{i}" for i in range(6)] + ["Bb-1", "Bb-1", "Aa-2"]
+        cases.append((f"random-duplicates-{seed}", random_newick(seed, names), None, duplicate_criteria))
+    return cases
+
+
+cases = {case[0]: case for case in known_cases() + generated_cases()}
+
+
+def case_seeds(data, translate):
+    # a few seeds from the start of the tree and every duplicate name
+    names = FlatTree(data, translate).leaf_names
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    return list(dict.fromkeys(names[:4] + duplicates))
+
+
+def original_result(data, translate, seed_taxon, crit_tree, tolerance, minimum, nested):
+    # evaluation of the first version, every side of every edge gathered from the object tree
+    tree = PTree()
+    tree.parse_file(data, translate)
+    highest_bootstrap = -1
+    lowest_rel_tolerance_used = 1.0
+    lowest_abs_tolerance_used = 10e6
+    lowest_subtree_size = len(tree.taxons)
+    valid_count = 0
+    results = {'file': "tree.tre", 'taxon': seed_taxon, 'size': len(tree.taxons), 'crits': {}}
+    for column, criterium in crit_tree.items():
+        quantified = [group for group in criterium if group[0] > 0.0]
+        for edge in tree.edges:
+            for d in range(2):
+                taxons = edge.get_subtree_taxons(d)
+                is_valid, r_t, a_t = Critter.criteria_checker([_[0] for _ in taxons], criterium, tolerance, minimum,
+                                                              seed=seed_taxon)
+                if is_valid and nested:
+                    if seed_taxon in [_[0].name for _ in taxons if _[1] == 1]:
+                        is_valid = False
+                if is_valid and nested:
+                    seed_depth = [_ for _ in taxons if _[0].name == seed_taxon][0][1]
+                    if not any(pattern.match(taxon.name) for taxon, depth in taxons if depth <= seed_depth
+                               for group in quantified for pattern in group[1]):
+                        is_valid = False
+                if is_valid:
+                    valid_count += 1
+                    if edge.bs > highest_bootstrap:
+                        highest_bootstrap = edge.bs
+                        lowest_subtree_size = len(taxons)
+                        lowest_rel_tolerance_used = r_t
+                        lowest_abs_tolerance_used = a_t
+                    elif edge.bs == highest_bootstrap:
+                        if r_t < lowest_rel_tolerance_used:
+                            lowest_rel_tolerance_used = r_t
+                            lowest_abs_tolerance_used = a_t
+                        lowest_subtree_size = min(lowest_subtree_size, len(taxons))
+        if valid_count > 0:
+            results['size'] = lowest_subtree_size
+            results['crits'][column] = (highest_bootstrap, lowest_rel_tolerance_used, lowest_abs_tolerance_used)
+        else:
+            results['size'] = ''
+            results['crits'][column] = None
+    return results
+
+
+@lru_cache(maxsize=None)
+def expected_results(name):
+    # original results of every setting and seed of a case, keyed by (setting, seed)
+    _, data, translate, criteria = cases[name]
+    crit_tree = Critter.build_criteria_tree(criteria)
+    expected = {}
+    for tolerance, mintaxons, nested in settings:
+        for seed in case_seeds(data, translate) + ([] if nested else [None]):
+            expected[(tolerance, mintaxons, nested), seed] = original_result(data, translate, seed, crit_tree,
+                                                                             tolerance, mintaxons, nested)
+    return expected
+
+
+@pytest.mark.parametrize("name", list(cases))
+@pytest.mark.parametrize("search", ["pruned", "exhaustive"])
+@pytest.mark.parametrize("engine", engines)
+def test_search_matches_original(name, search, engine):
+    _, data, translate, criteria = cases[name]
+    crit_tree = Critter.build_criteria_tree(criteria)
+    for ((tolerance, mintaxons, nested), seed), expected in expected_results(name).items():
+        # fresh tree, so that no verdicts are shared between settings
+        tree = FlatTree(data, translate)
+        options = Options(tolerance, mintaxons, nested, search=search, engine=engine)
+        assert Critter.sort_one_tree_file(tree, seed, crit_tree, "tree.tre", options) == expected, \
+            (seed, tolerance, mintaxons, nested)
+
+
+@pytest.mark.parametrize("name", list(cases))
+@pytest.mark.parametrize("engine", engines)
+def test_all_seeds_match_original(name, engine):
+    _, data, translate, criteria = cases[name]
+    crit_tree = Critter.build_criteria_tree(criteria)
+    expected = expected_results(name)
+    for setting in settings:
+        seeds = [seed for (other, seed) in expected if other == setting]
+        tree = FlatTree(data, translate)
+        results = Critter.sort_tree_seeds(tree, seeds, crit_tree, "tree.tre", Options(*setting, engine=engine))
+        assert results == [expected[setting, seed] for seed in seeds], setting
+
+
+@pytest.mark.parametrize("shape", ["realistic", "caterpillar"])
+def test_nested_seeds_of_large_tree(shape, monkeypatch):
+    # nested seeds found once in a tree are answered together, with work bounded per tree and not per seed
+    data = generate_newick(shape, 5000, seed=2)
+    tree = FlatTree(data)
+    seeds = [name for name in tree.leaf_names if name.startswith("Alpha-1")]
+    crit_tree = Critter.build_criteria_tree(default_criteria)
+    sample = seeds[::len(seeds) // 6]
+    expected = [Critter.sort_one_tree_file(FlatTree(data), seed, crit_tree, "tree.tre",
+                                           Options(0.1, 3, True, search="exhaustive")) for seed in sample]
+
+    def per_seed(*args):
+        raise AssertionError("nested seeds searched one by one")
+    monkeypatch.setattr(Critter, "column_bests", per_seed)
+    monkeypatch.setitem(Profile.counters, "edges", 0)
+    results = Critter.sort_tree_seeds(tree, seeds, crit_tree, "tree.tre", Options(0.1, 3, True))
+    assert len(seeds) > 300 and Profile.counters["edges"] < 4 * len(tree.edge_bs) * len(crit_tree)
+    assert [results[seeds.index(seed)] for seed in sample] == expected
+
+
+def test_memo_matches_original():
+    # one memo shared by all trees and settings, like a run over many files
+    memo = SubtreeMemo(10000)
+    for name, (_, data, translate, criteria) in cases.items():
+        crit_tree = Critter.build_criteria_tree(criteria)
+        for ((tolerance, mintaxons, nested), seed), expected in expected_results(name).items():
+            tree = FlatTree(data, translate)
+            options = Options(tolerance, mintaxons, nested, memo=memo)
+            assert Critter.sort_tree_seeds(tree, [seed], crit_tree, "tree.tre", options) == [expected], \
+                (name, seed, tolerance, mintaxons, nested)
+
+
+@pytest.mark.parametrize("name", list(cases))
+def test_stream_matches_original(name):
+    _, data, translate, criteria = cases[name]
+    crit_tree = Critter.build_criteria_tree(criteria)
+    for ((tolerance, mintaxons, nested), seed), expected in expected_results(name).items():
+        if nested:
+            # nested evaluation needs the whole tree
+            continue
+        stream = StreamTree(crit_tree, Options(tolerance, mintaxons, no_seed=seed is None))
+        assert stream.results(data, translate, ["tree.tre", seed]) == [expected], (seed, tolerance, mintaxons)
+
+
+@pytest.mark.parametrize("search", ["pruned", "exhaustive"])
+@pytest.mark.parametrize("engine", engines)
+def test_carry_over_by_support_value(search, engine):
+    # b has no clade of its own and takes the highest bootstrap of a, not the UFBoot value of a2@2
+    data = "(X,(A1,A2)85.3/100,(B1,B2)/95);"
+    crit_tree = Critter.build_criteria_tree(["a=1+A*", "a2@2=1+A*", "b=1+B*"])
+    options = Options(0, 2, search=search, engine=engine)
+    expected = {'a': (85.3, 0.0, 0), 'a2@2': (100, 0.0, 0), 'b': (85.3, 0.0, 0)}
+    assert Critter.sort_one_tree_file(FlatTree(data), None, crit_tree, "tree.tre", options)['crits'] == expected
+    assert Critter.sort_tree_seeds(FlatTree(data), [None], crit_tree, "tree.tre", options)[0]['crits'] == expected
+    stream = StreamTree(crit_tree, Options(0, 2, no_seed=True))
+    assert stream.results(data, None, ["tree.tre", None])[0]['crits'] == expected
+
+
+@pytest.mark.parametrize("data, seedtaxon", [
+    # a seed name given by flag occurs twice, one row for each copy
+    ("(X,(A1,A2)90,(A1,(B1,B2)70)80);", "A1"),
+    ("(X,(A1,A2)90,(A1,(B1,B2)70)80);", "Z"),
+    # decimal labels next to integer ones, whole values stay integers
+    ("(X,(A1,A2)[&label=77],(B1,(B2,B3)0.5)[&label=88/99]);", None),
+])
+def test_stream_matches_default_rows(data, seedtaxon):
+    crit_tree = Critter.build_criteria_tree(["a=1+A*", "b=1+B*", "b2@2=1+B*", "c=0.5+B*"])
+    options = Options(0, 2, seedtaxon=seedtaxon, no_seed=seedtaxon is None)
+    file = ["tree.tre", ""]
+    tree = FlatTree(data)
+    rows = Critter.sort_tree_seeds(tree, Critter.seed_taxons(tree, file, options), crit_tree, file[0], options)
+    # compared as written, 77 == 77.0
+    assert repr(StreamTree(crit_tree, options).results(data, None, file)) == repr(rows)
@@ -0,0 +1,98 @@
+# Query server over the test trees: GET and POST queries answer the rows of a command line run,
+# wrong queries are refused and trees over the memory limit are dropped
+import json
+import sys
+from os.path import dirname, join
+from threading import Thread
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+import pytest
+
+from treesorter.server import Server
+from treesorter.treesorter import main, parse_args
+
+tests_dir = dirname(__file__)
+few_dir = join(tests_dir, "few")
+criteria = ["karenia=0.8+Dinos-Kareniaceae*", "hapto=3+Haptophytes-*"]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # server of the few trees on a free port, seed taxons from the file names
+    from http.server import ThreadingHTTPServer
+    monkeypatch.setattr(sys, "argv", ["treesorter", "-d", few_dir, "-s", "--serve"])
+    args = parse_args()
+    args.mintaxons = 3
+    http = ThreadingHTTPServer(("127.0.0.1", 0), Server.make_handler())
+    http.treesorter = Server(args)
+    thread = Thread(target=http.serve_forever, daemon=True)
+    thread.start()
+    yield http
+    http.shutdown()
+    http.server_close()
+
+
+def get(server, query):
+    return urlopen(f"http://127.0.0.1:{server.server_address[1]}/?{urlencode(query, doseq=True)}").read().decode()
+
+
+def post(server, params):
+    request = Request(f"http://127.0.0.1:{server.server_address[1]}/", data=json.dumps(params).encode(),
+                      headers={"Content-Type": "application/json"})
+    return urlopen(request).read().decode()
+
+
+def refused(request, *args):
+    with pytest.raises(HTTPError) as error:
+        request(*args)
+    assert error.value.code == 400
+    return error.value.read().decode()
+
+
+@pytest.fixture
+def expected(tmp_path, monkeypatch):
+    # rows of a command line run with the same criteria and options
+    path = join(tmp_path, "out.csv")
+    monkeypatch.setattr(sys, "argv", ["treesorter", "-d", few_dir, "-s", "-t", "0.2", "-o", path, "-c", *criteria])
+    main()
+    with open(path) as f:
+        return sorted(f.read().splitlines())
+
+
+def test_get_and_post(server, expected):
+    rows = get(server, {"c": criteria, "tolerance": "0.2"})
+    assert sorted(rows.splitlines()) == expected
+    assert post(server, {"criteria": criteria, "tolerance": 0.2}) == rows
+    # false given as text or as JSON boolean
+    assert post(server, {"criteria": criteria, "tolerance": 0.2, "no_seed": "false", "nested": False}) == rows
+    assert get(server, {"c": criteria, "tolerance": "0.2", "no_seed": "0"}) == rows
+    jsonl = [json.loads(line) for line in post(server, {"criteria": criteria, "tolerance": 0.2, "format": "jsonl"})
+             .splitlines()]
+    assert len(jsonl) == len(expected) - 1
+
+
+def test_wrong_queries(server):
+    assert "No sorting criteria" in refused(get, server, {"tolerance": "0.2"})
+    assert "no_seed has to be true or false" in refused(get, server, {"c": criteria, "no_seed": "maybe"})
+    assert "nested has to be true or false" in refused(post, server, {"criteria": criteria, "nested": "nope"})
+    assert "nested requires the use of seed taxon" in refused(post, server, {"criteria": criteria, "no_seed": True,
+                                                                             "nested": "true", "mintaxons": 2})
+    assert "Wrong query" in refused(post, server, {"criteria": criteria, "tolerance": "high"})
+
+
+def test_eviction(server):
+    trees = server.treesorter
+    trees.memory_limit = 1
+    get(server, {"c": criteria})
+    # only the tree used last stays, match matrices of the queries are not kept with it
+    assert len(trees.trees) == 1
+    (path, (_, _, tree, size)), = trees.trees.items()
+    assert trees.memory == size == tree.nbytes() and path == trees.files[-1][0]
+    assert tree.match_matrix is None
+    trees.memory_limit = 1 << 30
+    get(server, {"c": criteria})
+    assert len(trees.trees) == len(trees.files)
+    assert trees.memory == sum(entry[3] for entry in trees.trees.values())
+    assert all(entry[2].match_matrix is None for entry in trees.trees.values())